@@ -12,39 +12,190 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from build_graph import Graph, Node, Scope
+import marshal
+import multiprocessing
+
+from ast_cache import digest
+from build_graph import Graph, Node, Scope, quote_paths
+from path_table import PathTable
 from pyn_exceptions import PynException
 
 
+# Parsing fewer subninjas than this isn't worth starting processes for.
+MIN_PARALLEL_SUBNINJAS = 8
+
+
 class NinjaAnalyzer(object):
-    def __init__(self, host, args, parse, expand_vars):
+    def __init__(self, host, args, parse, expand_vars, ast_cache=None):
+        # 'too many arguments' pylint: disable=R0913
         self.host = host
         self.args = args
         self.parse = parse
         self.expand_vars = expand_vars
+        self.ast_cache = ast_cache
+
+        # Every graph (and subgraph) we create shares one path table, so
+        # that each path is stored once however many files mention it.
+        self.paths = PathTable()
+
+        # The scopes holding the variables of build statements, by file
+        # scope and variables; see _build_vars_scope().
+        self._build_vars_scopes = {}
+
+        # The mtime of each manifest, from just before it was read; see
+        # Graph.manifest_mtimes.
+        self.manifest_mtimes = {}
 
     def analyze(self, ast, filename, parent_scope=None):
         graph = Graph(filename)
+        graph.paths = self.paths
+        graph.manifest_mtimes = self.manifest_mtimes
         scope = Scope(filename, parent_scope)
         graph.scopes[filename] = scope
         graph = self._add_ast(graph, scope, ast)
-        graph = self._add_subninjas(graph)
+        graph = self._add_subninjas(graph, graph.subninjas)
+        return graph
+
+    def reanalyze(self, graph, subninjas):
+        """Re-analyze some of graph's subninjas, updating it in place.
+
+        Everything the subninjas declared is removed from the graph and
+        then they are analyzed again from scratch, so this takes time
+        proportional to the size of the subninjas, not of the graph.
+        This is only valid if nothing else has changed since the graph
+        was analyzed, since the subninjas inherit the top-level scope.
+        """
+        self.paths = graph.paths
+        self.manifest_mtimes = graph.manifest_mtimes
+        removed_rules = set()
+        for path in subninjas:
+            removed_rules.update(self._remove_subninja(graph, path))
+        graph = self._add_subninjas(graph, subninjas)
+
+        # Nodes elsewhere may use the rules that were declared again.
+        graph.forget_commands(removed_rules)
         return graph
 
+    def _remove_subninja(self, graph, path):
+        """Remove what the subninja declared; returns the rules' names."""
+        graph.remove_nodes([graph.nodes[o]
+                            for o in graph.subninja_nodes.pop(path, [])])
+        rules = graph.subninja_rules.pop(path, [])
+        for name in rules:
+            del graph.rules[name]
+        for name in graph.subninja_scopes.pop(path, []):
+            del graph.scopes[name]
+        for name in graph.subninja_pools.pop(path, []):
+            del graph.pools[name]
+        graph.subninja_manifests.pop(path, None)
+        return rules
+
+    def parse_file(self, path):
+        """Yield the declarations in path, from the AST cache if we can."""
+        self._stat_manifest(path)
+        contents = self.host.mmap(path)
+        try:
+            if self.ast_cache:
+                decls = self.ast_cache.parse(self.parse, contents, path)
+            else:
+                decls = self.parse(contents, path)
+            for decl in decls:
+                yield decl
+        finally:
+            contents.close()
+
+    def _cached_ast(self, path):
+        """Return path's declarations from the cache (or None), and the
+        digest of its contents, so that it isn't hashed twice on a miss.
+
+        The cache entry isn't read (or even left open) until the
+        declarations are replayed, one file at a time.
+        """
+        if not self.host.exists(path):
+            return None, None
+        contents = self.host.mmap(path)
+        try:
+            contents_digest = digest(contents)
+        finally:
+            contents.close()
+        return self.ast_cache.lookup(path, contents_digest), contents_digest
+
+    def _stat_manifest(self, path):
+        mtime = self.host.maybe_mtime(path)
+        if mtime is not None:
+            self.manifest_mtimes[path] = mtime
+
     def _add_ast(self, graph, scope, ast):
         for decl in ast:
             graph = getattr(self, '_decl_' + decl[0])(graph, scope, decl)
         return graph
 
-    def _add_subninjas(self, graph):
-        for path in graph.subninjas:
+    def _add_subninjas(self, graph, paths):
+        # There's no point in more processes than CPUs, whatever -j is.
+        jobs = min(self.args.parse_jobs if self.args else 1,
+                   self.host.cpu_count())
+        asts = [None] * len(paths)
+        digests = [None] * len(paths)
+        if jobs > 1 and len(paths) >= MIN_PARALLEL_SUBNINJAS:
+            for path in paths:
+                self._stat_manifest(path)
+            if self.ast_cache:
+                for i, path in enumerate(paths):
+                    asts[i], digests[i] = self._cached_ast(path)
+            misses = [i for i, ast in enumerate(asts) if ast is None]
+            if len(misses) >= MIN_PARALLEL_SUBNINJAS:
+                parsed = self._parse_in_parallel(
+                    [paths[i] for i in misses], [digests[i] for i in misses],
+                    jobs)
+                for i, ast in zip(misses, parsed):
+                    asts[i] = ast
+
+        for path, ast in zip(paths, asts):
             if not self.host.exists(path):
                 raise PynException("'%s' not found." % path)
-            ast = self.parse(self.host.read(path), path)
+            if ast is None:
+                ast = self.parse_file(path)
             subgraph = self.analyze(ast, path, graph.scopes[graph.name])
+            graph.subninja_manifests[path] = [path] + subgraph.includes + [
+                f for s in subgraph.subninjas
+                for f in subgraph.subninja_manifests[s]]
+            graph.subninja_nodes[path] = sorted(
+                n.paths[0] for n in subgraph.unique_nodes())
+            graph.subninja_rules[path] = sorted(subgraph.rules)
+            graph.subninja_scopes[path] = sorted(subgraph.scopes)
+            graph.subninja_pools[path] = sorted(subgraph.pools)
             graph = self._merge_graphs(graph, subgraph)
         return graph
 
+    def _parse_in_parallel(self, paths, digests, jobs):
+        """Parse each file in a separate process.
+
+        Parsing doesn't depend on any scope, so it can be done up front,
+        but the results have to be analyzed in order. Each file's
+        declarations are replayed to the analyzer as if they were being
+        parsed, so errors come out in the same order as they otherwise
+        would. They are recorded in the AST cache (under the given
+        digests) as they are replayed.
+        """
+        pool = multiprocessing.Pool(min(jobs, len(paths)))
+        try:
+            results = pool.map(_parse_file,
+                               [(self.host, self.parse, p) for p in paths])
+        finally:
+            pool.close()
+            pool.join()
+        asts = []
+        for path, contents_digest, result in zip(paths, digests, results):
+            decls, err = marshal.loads(result)
+            if decls is None:
+                asts.append(None)
+                continue
+            ast = _replay(decls, err)
+            if contents_digest is not None:
+                ast = self.ast_cache.record(path, contents_digest, ast)
+            asts.append(ast)
+        return asts
+
     def _merge_graphs(self, graph, subgraph):
         for rule_name, rule_scope in subgraph.rules.items():
             if rule_name in graph.rules:
@@ -56,12 +207,17 @@ class NinjaAnalyzer(object):
                 raise PynException("scope '%s' declared in multiple files " %
                                    name)
             graph.scopes[name] = scope
+        for name, depth in subgraph.pools.items():
+            if name in graph.pools:
+                raise PynException("pool '%s' declared in multiple files " %
+                                   name)
+            graph.pools[name] = depth
 
-        self._add_nodes_to_graph(subgraph.nodes, graph)
+        self._add_nodes_to_graph(subgraph.unique_nodes(), graph)
         return graph
 
     def _exp(self, scope, paths):
-        return [self.expand_vars(p, scope) for p in paths]
+        return [self.paths.intern(self.expand_vars(p, scope)) for p in paths]
 
     def _add_vars_to_scope(self, var_decls, scope, expand=True):
         for _, name, val in var_decls:
@@ -71,38 +227,52 @@ class NinjaAnalyzer(object):
                 scope.objs[name] = val
 
     def _add_nodes_to_graph(self, nodes, graph):
-        for name, node in nodes.items():
-            if name in graph.nodes:
-                raise PynException("build output '%s' declared more than "
-                                   "once " % name)
-            graph.nodes[name] = node
+        for node in nodes:
+            for name in node.outputs:
+                if name in graph.nodes:
+                    raise PynException("build output '%s' declared more "
+                                       "than once " % name)
+        graph.add_nodes(nodes)
 
     def _decl_build(self, graph, scope, decl):
         _, outs, rule_name, edeps, ideps, odeps, build_vars = decl
 
-        exp_outs = self._exp(scope, outs)
-        quoted_outs = ' '.join(('"%s"' % o if ' ' in o else o)
-                               for o in exp_outs)
-        exp_edeps = self._exp(scope, edeps)
-        quoted_edeps = ' '.join(('"%s"' % o if ' ' in o else o)
-                                for o in exp_edeps)
-        build_scope = Scope(quoted_outs, scope)
-        build_scope['out'] = quoted_outs
-        build_scope['in'] = quoted_edeps
-        self._add_vars_to_scope(build_vars, build_scope)
-
         # FIXME: using exp_outs instead of quoted_outs might get us
         # into trouble; we should probably have a different kind of name
         # entirely.
-        n = Node(' '.join(exp_outs), build_scope, exp_outs, rule_name,
-                 exp_edeps, self._exp(scope, ideps), self._exp(scope, odeps))
-        nodes = {}
-        for o in exp_outs:
-            nodes[o] = n
-        self._add_nodes_to_graph(nodes, graph)
+        exp_outs = self._exp(scope, outs)
+        n = Node(' '.join(exp_outs), scope, exp_outs, rule_name,
+                 self._exp(scope, edeps), self._exp(scope, ideps),
+                 self._exp(scope, odeps))
+        n.scope = self._build_vars_scope(n, build_vars)
+        self._add_nodes_to_graph([n], graph)
 
         return graph
 
+    def _build_vars_scope(self, node, build_vars):
+        """Return a scope holding a build statement's variables.
+
+        The variables are expanded as if they were in the node's own
+        scope, so they can refer to $in and $out, but only the variables
+        themselves are kept, in a scope that is shared by every node in
+        the same file that ends up with the same values.
+        """
+        file_scope = node.scope
+        build_scope = Scope(node.name, file_scope)
+        build_scope['in'] = quote_paths(node.explicit_deps)
+        build_scope['out'] = quote_paths(node.outputs)
+        self._add_vars_to_scope(build_vars, build_scope)
+        del build_scope.objs['in']
+        del build_scope.objs['out']
+
+        key = (file_scope, tuple(sorted(build_scope.objs.items())))
+        scope = self._build_vars_scopes.get(key)
+        if scope is None:
+            scope = Scope(node.name, file_scope)
+            scope.objs = build_scope.objs
+            self._build_vars_scopes[key] = scope
+        return scope
+
     def _decl_default(self, graph, scope, decl):
         _, defaults = decl
 
@@ -114,7 +284,7 @@ class NinjaAnalyzer(object):
         full_path = self.expand_vars(path, scope)
         if not self.host.exists(full_path):
             raise PynException("'%s' not found." % full_path)
-        ast = self.parse(self.host.read(full_path), full_path)
+        ast = self.parse_file(full_path)
         graph = self._add_ast(graph, graph.scopes[graph.name], ast)
         graph.includes.append(full_path)
         return graph
@@ -122,7 +292,7 @@ class NinjaAnalyzer(object):
     def _decl_pool(self, graph, scope, decl):
         _, name, pool_vars = decl
 
-        if name in graph.pools:
+        if name in graph.pools or name == 'console':
             raise PynException("pool '%s' already declared" % name)
         if not pool_vars:
             raise PynException("pool '%s' has no depth variable" % name)
@@ -161,3 +331,28 @@ class NinjaAnalyzer(object):
     def _decl_var(self, graph, scope, decl):
         self._add_vars_to_scope([decl], scope)
         return graph
+
+
+def _parse_file(request):
+    # The declarations are just nested lists of strings, which marshal
+    # sends back to the parent far more cheaply than pickle would.
+    host, parse, path = request
+    if not host.exists(path):
+        return marshal.dumps((None, None))
+    decls = []
+    contents = host.mmap(path)
+    try:
+        for decl in parse(contents, path):
+            decls.append(decl)
+    except PynException as e:
+        return marshal.dumps((decls, str(e)))
+    finally:
+        contents.close()
+    return marshal.dumps((decls, None))
+
+
+def _replay(decls, err):
+    for decl in decls:
+        yield decl
+    if err:
+        raise PynException(err)
@@ -12,11 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import unittest
 
-from analyzer import NinjaAnalyzer
+from analyzer import MIN_PARALLEL_SUBNINJAS, NinjaAnalyzer
+from ast_cache import AstCache
 from host_fake import FakeHost
-from parser import parse
+from parser import parse, parse_iter
 from pyn_exceptions import PynException
 from var_expander import expand_vars
 
@@ -48,6 +50,39 @@ class TestAnalyzer(unittest.TestCase):
                     [['var', 'foo', 'bar'],
                      ['var', 'foo', 'bar']]]])
 
+    def test_paths_are_interned(self):
+        graph = self.check([['build', ['foo.o'], 'cc', ['foo.c'], [], [], []],
+                            ['build', ['foo'], 'link', ['foo.o'], [], [],
+                             []]])
+        self.assertTrue(graph.nodes['foo'].explicit_deps[0] is
+                        graph.nodes['foo.o'].outputs[0])
+        self.assertEqual(graph.paths.paths, ['foo.o', 'foo.c', 'foo'])
+
+    def test_build_vars_are_shared(self):
+        graph = self.check([['var', 'cflags', '-O2'],
+                            ['build', ['a.o'], 'cc', ['a.c'], [], [],
+                             [['var', 'defines', '-DA']]],
+                            ['build', ['b.o'], 'cc', ['b.c'], [], [],
+                             [['var', 'defines', '-DA']]],
+                            ['build', ['c.o'], 'cc', ['c.c'], [], [],
+                             [['var', 'defines', '-D$out']]],
+                            ['build', ['d.o'], 'cc', ['d.c'], [], [], []],
+                            ['build', ['e.o'], 'cc', ['e.c'], [], [], []]])
+        nodes = graph.nodes
+        self.assertEqual(nodes['a.o'].scope.objs, {'defines': '-DA'})
+        self.assertTrue(nodes['a.o'].scope is nodes['b.o'].scope)
+        self.assertEqual(nodes['c.o'].scope.objs, {'defines': '-Dc.o'})
+        self.assertEqual(nodes['d.o'].scope.objs, {})
+        self.assertTrue(nodes['d.o'].scope is nodes['e.o'].scope)
+        self.assertTrue(nodes['a.o'].scope.parent is
+                        graph.scopes['build.ninja'])
+
+        # $in and $out are filled in when they're needed.
+        build_scope = nodes['a.o'].build_scope()
+        self.assertEqual(build_scope.objs, {'defines': '-DA', 'in': 'a.c',
+                                            'out': 'a.o'})
+        self.assertEqual(build_scope['cflags'], '-O2')
+
     def test_vars(self):
         self.check([['var', 'foo', 'bar']])
         self.check([['var', 'foo', 'bar'],
@@ -66,6 +101,170 @@ class TestAnalyzer(unittest.TestCase):
         self.host.files['/tmp/sub.ninja'] = ''
         self.check([['subninja', 'sub.ninja']])
 
+    def analyze_subninjas(self, jobs, files, parse_fn=parse_iter,
+                          ast_cache=None):
+        self.host.files.update(('/tmp/' + path, contents)
+                               for path, contents in files.items())
+        ast = [['subninja', path] for path in sorted(files)]
+        analyzer = NinjaAnalyzer(self.host,
+                                 argparse.Namespace(parse_jobs=jobs),
+                                 parse_fn, expand_vars, ast_cache)
+        try:
+            return analyzer.analyze(ast, 'build.ninja')
+        except PynException as e:
+            return str(e)
+
+    def test_parallel_subninjas(self):
+        files = {}
+        for i in range(MIN_PARALLEL_SUBNINJAS + 2):
+            files['sub%02d.ninja' % i] = ('rule r%d\n'
+                                          '  command = echo %d\n'
+                                          'build out%d: r%d in%d\n'
+                                          % (i, i, i, i, i))
+        serial_graph = self.analyze_subninjas(1, files)
+        parallel_graph = self.analyze_subninjas(2, files)
+        self.assertEqual(sorted(parallel_graph.nodes),
+                         sorted(serial_graph.nodes))
+        self.assertEqual(sorted(parallel_graph.rules),
+                         sorted(serial_graph.rules))
+        self.assertEqual(parallel_graph.paths.paths,
+                         serial_graph.paths.paths)
+        self.assertTrue(all(buf.closed for buf in self.host.mmaps))
+
+        # Errors come out in the same order, too.
+        files['sub03.ninja'] += 'rule r2\n  command = echo\n'
+        files['sub05.ninja'] += 'syntaxerror\n'
+        err = self.analyze_subninjas(1, files)
+        self.assertEqual(self.analyze_subninjas(2, files), err)
+        self.assertTrue("rule 'r2' declared in multiple files" in err)
+
+        del files['sub03.ninja']
+        err = self.analyze_subninjas(1, files)
+        self.assertEqual(self.analyze_subninjas(2, files), err)
+        self.assertTrue(err.startswith('sub05.ninja:4:12 '))
+
+        # An error in the declarations before a syntax error wins.
+        files['sub05.ninja'] = ('rule x\n  command = a\n'
+                                'rule x\n  command = b\n'
+                                'syntaxerror\n')
+        err = self.analyze_subninjas(1, files)
+        self.assertEqual(self.analyze_subninjas(2, files), err)
+        self.assertTrue("'rule x' declared more than once" in err)
+
+    def test_parse_jobs_are_capped_at_cpu_count(self):
+        files = dict(('sub%02d.ninja' % i, 'build out%d: phony\n' % i)
+                     for i in range(MIN_PARALLEL_SUBNINJAS))
+        parsed = []
+
+        def counting_parse(contents, fname):
+            parsed.append(fname)
+            return parse_iter(contents, fname)
+
+        # With one CPU, everything is parsed in this process.
+        self.host.cpu_count = lambda: 1
+        self.analyze_subninjas(128, files, counting_parse)
+        self.assertEqual(parsed, sorted(files))
+
+    def test_ast_cache(self):
+        files = dict(('sub%02d.ninja' % i, 'build out%d: phony\n' % i)
+                     for i in range(MIN_PARALLEL_SUBNINJAS))
+        parsed = []
+
+        def counting_parse(contents, fname):
+            parsed.append(fname)
+            return parse_iter(contents, fname)
+
+        ast_cache = AstCache(self.host)
+        graph = self.analyze_subninjas(1, files, counting_parse, ast_cache)
+        self.assertEqual(parsed, sorted(files))
+        self.assertEqual(sorted(graph.nodes),
+                         ['out%d' % i for i in range(len(files))])
+
+        # Only the file that changed is parsed again, whether or not
+        # the rest would have been parsed in parallel.
+        for jobs in (1, 2):
+            parsed = []
+            files['sub03.ninja'] = 'build new%d: phony\n' % jobs
+            graph = self.analyze_subninjas(jobs, files, counting_parse,
+                                           ast_cache)
+            self.assertEqual(parsed, ['sub03.ninja'])
+            self.assertTrue('new%d' % jobs in graph.nodes)
+            self.assertFalse('out3' in graph.nodes)
+        self.assertTrue(all(buf.closed for buf in self.host.mmaps))
+
+    def analyze_build_ninja(self):
+        analyzer = NinjaAnalyzer(self.host, self.args, parse_iter,
+                                 expand_vars)
+        return analyzer.analyze(analyzer.parse_file('build.ninja'),
+                                'build.ninja')
+
+    def test_reanalyze(self):
+        self.host.files = {
+            '/tmp/build.ninja': ('rule cc\n'
+                                 '  command = cc $in\n'
+                                 'subninja a.ninja\n'
+                                 'subninja b.ninja\n'),
+            '/tmp/a.ninja': 'build a.o: cc a.c\n',
+            '/tmp/b.ninja': ('pool p\n'
+                             '  depth = 1\n'
+                             'rule link\n'
+                             '  command = link $in\n'
+                             'build b.o: cc b.c\n'
+                             'build b: link b.o a.o\n'
+                             'subninja c.ninja\n'),
+            '/tmp/c.ninja': 'build c.o: cc c.c\n',
+        }
+        graph = self.analyze_build_ninja()
+        self.assertEqual(graph.subninja_manifests,
+                         {'a.ninja': ['a.ninja'],
+                          'b.ninja': ['b.ninja', 'c.ninja']})
+        self.assertEqual(graph.subninja_nodes,
+                         {'a.ninja': ['a.o'],
+                          'b.ninja': ['b', 'b.o', 'c.o']})
+        self.assertEqual(graph.subninja_rules,
+                         {'a.ninja': [], 'b.ninja': ['link']})
+        self.assertEqual(graph.subninja_scopes,
+                         {'a.ninja': ['a.ninja'],
+                          'b.ninja': ['b.ninja', 'c.ninja']})
+        self.assertEqual(graph.subninja_pools,
+                         {'a.ninja': [], 'b.ninja': ['p']})
+        graph.consumers_by_path()
+        a_o = graph.nodes['a.o']
+        graph.command('a.o', expand_vars)
+        graph.command('b', expand_vars)
+
+        self.host.files['/tmp/b.ninja'] = ('pool p\n'
+                                           '  depth = 2\n'
+                                           'rule link\n'
+                                           '  command = link $in\n'
+                                           'build b.o: cc b.c\n'
+                                           'build b: link b.o\n'
+                                           'include c.ninja\n')
+        analyzer = NinjaAnalyzer(self.host, self.args, parse_iter,
+                                 expand_vars)
+        graph = analyzer.reanalyze(graph, ['b.ninja'])
+        expected = self.analyze_build_ninja()
+        self.assertEqual(sorted(graph.nodes), sorted(expected.nodes))
+        self.assertEqual(sorted(graph.rules), sorted(expected.rules))
+        self.assertEqual(sorted(graph.scopes), sorted(expected.scopes))
+        self.assertEqual(graph.pools, expected.pools)
+        for section in ('subninja_manifests', 'subninja_nodes',
+                        'subninja_rules', 'subninja_scopes',
+                        'subninja_pools'):
+            self.assertEqual(getattr(graph, section),
+                             getattr(expected, section))
+        self.assertEqual(graph.consumer_index, expected.consumers_by_path())
+
+        # The other subninja's nodes are left alone.
+        self.assertTrue(graph.nodes['a.o'] is a_o)
+
+        # Only the commands that might have changed are forgotten.
+        self.assertEqual(graph.commands, {'a.o': 'cc a.c'})
+
+        self.host.files['/tmp/b.ninja'] = 'build a.o: cc a.c\n'
+        self.assertRaises(PynException, analyzer.reanalyze, graph,
+                          ['b.ninja'])
+
     def test_scope_of_subninjas(self):
         self.host.files = {
             '/tmp/build.ninja': ('foo = 1\n'
@@ -83,13 +282,13 @@ class TestAnalyzer(unittest.TestCase):
 
         n = graph.nodes['one']
         rule_scope = graph.rules[n.rule_name]
-        self.assertEqual(expand_vars(rule_scope['command'], n.scope,
+        self.assertEqual(expand_vars(rule_scope['command'], n.build_scope(),
                                      rule_scope),
                          'echo 1 2')
 
         n = graph.nodes['two']
         rule_scope = graph.rules[n.rule_name]
-        self.assertEqual(expand_vars(rule_scope['command'], n.scope,
+        self.assertEqual(expand_vars(rule_scope['command'], n.build_scope(),
                                      rule_scope),
                          'echo s1 2')
 
@@ -106,6 +305,7 @@ class TestAnalyzer(unittest.TestCase):
         self.err([['pool', 'foo', [['var', 'depth', '4']]],
                   ['pool', 'foo', [['var', 'depth', '4']]]])
         self.err([['pool', 'foo', []]])
+        self.err([['pool', 'console', [['var', 'depth', '1']]]])
         self.err([['pool', 'foo', [['var', 'foo', '4']]]])
         self.err([['pool', 'foo', [['var', 'depth', '4'],
                                    ['var', 'foo', 'bar']]]])
@@ -48,7 +48,11 @@ def parse_args(host, argv, version, tool_names):
                     default=host.cpu_count(),
                     help=('run N jobs in parallel [default=%(default)s, '
                           'derived from CPUs available]'))
-    ap.add_argument('-l', metavar='N', type=float,
+    ap.add_argument('--parse-jobs', metavar='N', type=int, default=1,
+                    help=('parse subninjas in up to N processes '
+                          '(experimental) [default=%(default)s]'))
+    ap.add_argument('-l', metavar='N', type=float, dest='max_load',
+                    default=0.0,
                     help=('do not start new jobs if the load average '
                           'is greater than N'))
     ap.add_argument('-k', metavar='N', type=int, dest='errors', default=1,
@@ -0,0 +1,161 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import marshal
+import struct
+
+
+AST_CACHE_DIR = '.pyn_asts.d'
+
+AST_CACHE_VERSION = 2
+
+_AST_CACHE_HEADER = '# pyn asts v%d\n' % AST_CACHE_VERSION
+
+# Written after the last declaration, so that an entry that was cut
+# short (say, by ^C) is never mistaken for a complete one.
+_AST_CACHE_TRAILER = '# end\n'
+
+# Each declaration is stored as its marshal'ed length, then itself.
+_AST_CACHE_LENGTH = struct.Struct('<I')
+
+# How much to buffer up before appending it to an entry.
+_AST_CACHE_CHUNK_SIZE = 1024 * 1024
+
+
+def digest(contents):
+    """Return the hash that identifies a version of a file's contents."""
+    return hashlib.md5(contents).digest()
+
+
+class AstCache(object):
+    """Remember the parsed declarations of each manifest file.
+
+    Each file gets its own entry (a file in the cache directory), which
+    holds an MD5 hash of the contents it was parsed from, so a file is
+    only re-parsed when it actually changes (hashing is much cheaper
+    than parsing), and only the entries of the files that change are
+    ever rewritten.
+
+    Declarations are written to an entry as they are parsed and read
+    back one at a time, so neither parsing a file nor reading its entry
+    ever holds all of the file's declarations in memory at once.
+
+    prune() removes the entries that weren't used since the cache was
+    created, so files that are no longer part of the build drop out.
+    """
+
+    def __init__(self, host, path=AST_CACHE_DIR):
+        self.host = host
+        self.path = path
+        self._used = set()
+
+    def lookup(self, path, contents_digest):
+        """Return an iterator over path's declarations, or None if it
+        has changed since they were recorded.
+
+        The entry is only mapped in again once the iterator is used, so
+        a caller can hold on to the iterators for many files without
+        holding a file descriptor open for each.
+        """
+        entry = self._entry(path)
+        if not self.host.exists(entry):
+            return None
+        buf = self.host.mmap(entry)
+        prefix = _prefix(path, contents_digest)
+        try:
+            trailer = buf[len(buf) - len(_AST_CACHE_TRAILER):]
+            if buf[:len(prefix)] != prefix or trailer != _AST_CACHE_TRAILER:
+                return None
+        finally:
+            buf.close()
+        self._used.add(entry)
+        return _read_decls(self.host, entry, len(prefix))
+
+    def record(self, path, contents_digest, decls):
+        """Yield decls, and save them as path's entry as they go by.
+
+        The entry only counts once the last declaration has been
+        yielded; if decls raises an error (or we stop early), it is
+        removed.
+        """
+        entry = self._entry(path)
+        self.host.maybe_mkdir(self.path)
+        self.host.write_binary(entry, _prefix(path, contents_digest))
+        self._used.add(entry)
+        chunk = []
+        size = 0
+        complete = False
+        try:
+            for decl in decls:
+                data = marshal.dumps(decl)
+                chunk.append(_AST_CACHE_LENGTH.pack(len(data)))
+                chunk.append(data)
+                size += _AST_CACHE_LENGTH.size + len(data)
+                if size >= _AST_CACHE_CHUNK_SIZE:
+                    self.host.append_binary(entry, ''.join(chunk))
+                    chunk = []
+                    size = 0
+                yield decl
+            chunk.append(_AST_CACHE_TRAILER)
+            self.host.append_binary(entry, ''.join(chunk))
+            complete = True
+        finally:
+            if not complete:
+                self.host.remove(entry)
+                self._used.discard(entry)
+
+    def parse(self, parse, contents, path):
+        """Return the declarations in contents, parsing them if need be.
+
+        When the file has to be parsed, the declarations are still
+        returned as they are parsed, and only cached if the whole file
+        parses successfully.
+        """
+        contents_digest = digest(contents)
+        decls = self.lookup(path, contents_digest)
+        if decls is not None:
+            return decls
+        return self.record(path, contents_digest, parse(contents, path))
+
+    def keep(self, paths):
+        """Keep the entries for paths in the cache, even though unused."""
+        self._used.update(self._entry(p) for p in paths)
+
+    def prune(self):
+        """Remove the entries that haven't been used or kept."""
+        for name in self.host.files_under(self.host.abspath(self.path)):
+            entry = self.host.join(self.path, name)
+            if entry not in self._used:
+                self.host.remove(entry)
+
+    def _entry(self, path):
+        return self.host.join(self.path, hashlib.md5(path).hexdigest())
+
+
+def _prefix(path, contents_digest):
+    return '%s%s%s\n' % (_AST_CACHE_HEADER, contents_digest, path)
+
+
+def _read_decls(host, entry, start):
+    buf = host.mmap(entry)
+    try:
+        p, end = start, len(buf) - len(_AST_CACHE_TRAILER)
+        while p < end:
+            length, = _AST_CACHE_LENGTH.unpack_from(buf, p)
+            p += _AST_CACHE_LENGTH.size
+            yield marshal.loads(buf[p:p + length])
+            p += length
+    finally:
+        buf.close()
@@ -0,0 +1,149 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import ast_cache
+from ast_cache import AstCache, digest
+from host_fake import FakeHost
+from parser import parse_iter
+from pyn_exceptions import PynException
+
+
+class TestAstCache(unittest.TestCase):
+    def setUp(self):  # 'invalid name' pylint: disable=C0103
+        self.host = FakeHost()
+        self.parsed = []
+
+    def entries(self):
+        return sorted(self.host.files_under('/tmp/.pyn_asts.d'))
+
+    def parse(self, cache, contents, path='build.ninja'):
+        return list(cache.parse(self.counting_parse, contents, path))
+
+    def counting_parse(self, contents, path):
+        self.parsed.append(path)
+        return parse_iter(contents, path)
+
+    def test_hit(self):
+        cache = AstCache(self.host)
+        decls = self.parse(cache, 'foo = bar\n')
+        self.assertEqual(decls, [['var', 'foo', 'bar']])
+        self.assertEqual(self.parse(AstCache(self.host), 'foo = bar\n'),
+                         decls)
+        self.assertEqual(self.parsed, ['build.ninja'])
+        self.assertTrue(all(buf.closed for buf in self.host.mmaps))
+
+    def test_lookup_holds_no_mapping(self):
+        cache = AstCache(self.host)
+        self.parse(cache, 'foo = bar\n')
+        decls = cache.lookup('build.ninja', digest('foo = bar\n'))
+        self.assertTrue(all(buf.closed for buf in self.host.mmaps))
+        self.assertEqual(list(decls), [['var', 'foo', 'bar']])
+        self.assertTrue(all(buf.closed for buf in self.host.mmaps))
+
+    def test_changed_contents_are_reparsed(self):
+        cache = AstCache(self.host)
+        self.parse(cache, 'foo = bar\n')
+        self.assertEqual(self.parse(cache, 'foo = baz\n'),
+                         [['var', 'foo', 'baz']])
+        self.assertEqual(self.parsed, ['build.ninja', 'build.ninja'])
+
+        # The same contents under a different name are a different file.
+        self.parse(cache, 'foo = baz\n', 'sub.ninja')
+        self.assertEqual(len(self.parsed), 3)
+
+    def test_only_changed_entries_are_rewritten(self):
+        cache = AstCache(self.host)
+        self.parse(cache, 'foo = bar\n')
+        self.parse(cache, 'x = 1\n', 'sub.ninja')
+        self.host.written_files = {}
+
+        cache = AstCache(self.host)
+        self.parse(cache, 'foo = bar\n')
+        self.parse(cache, 'x = 2\n', 'sub.ninja')
+        self.assertEqual(len(self.host.written_files), 1)
+
+    def test_errors_are_not_cached(self):
+        cache = AstCache(self.host)
+        self.assertRaises(PynException, self.parse, cache, 'foo bar\n')
+        self.assertRaises(PynException, self.parse, cache, 'foo bar\n')
+        self.assertEqual(len(self.parsed), 2)
+        self.assertEqual(self.entries(), [])
+
+    def test_partial_entries_are_not_cached(self):
+        cache = AstCache(self.host)
+        decls = cache.parse(self.counting_parse, 'a = 1\nb = 2\n',
+                            'build.ninja')
+        next(decls)
+        decls.close()
+        self.assertEqual(self.entries(), [])
+
+    def test_lookup_and_record(self):
+        cache = AstCache(self.host)
+        self.assertEqual(cache.lookup('sub.ninja', digest('x = 1\n')), None)
+        self.assertEqual(list(cache.record('sub.ninja', digest('x = 1\n'),
+                                           [['var', 'x', '1']])),
+                         [['var', 'x', '1']])
+        self.assertEqual(list(cache.lookup('sub.ninja', digest('x = 1\n'))),
+                         [['var', 'x', '1']])
+        self.assertEqual(cache.lookup('sub.ninja', digest('x = 2\n')), None)
+
+    def test_entries_are_written_in_chunks(self):
+        # 'access to a protected member' pylint: disable=W0212
+        orig_chunk_size = ast_cache._AST_CACHE_CHUNK_SIZE
+        try:
+            ast_cache._AST_CACHE_CHUNK_SIZE = 16
+            contents = ''.join('v%d = %d\n' % (i, i) for i in range(100))
+            decls = self.parse(AstCache(self.host), contents)
+            self.assertEqual(len(decls), 100)
+            self.assertEqual(self.parse(AstCache(self.host), contents),
+                             decls)
+            self.assertEqual(len(self.parsed), 1)
+        finally:
+            ast_cache._AST_CACHE_CHUNK_SIZE = orig_chunk_size
+
+    def test_prune(self):
+        cache = AstCache(self.host)
+        self.parse(cache, 'foo = bar\n')
+        self.parse(cache, 'x = 1\n', 'sub.ninja')
+        self.parse(cache, 'y = 1\n', 'other.ninja')
+        self.assertEqual(len(self.entries()), 3)
+
+        cache = AstCache(self.host)
+        self.parse(cache, 'foo = bar\n')
+        cache.keep(['other.ninja'])
+        cache.prune()
+        self.assertEqual(len(self.entries()), 2)
+        self.parse(cache, 'y = 1\n', 'other.ninja')
+        self.assertEqual(self.parsed, ['build.ninja', 'sub.ninja',
+                                       'other.ninja'])
+
+    def test_other_versions_are_ignored(self):
+        cache = AstCache(self.host)
+        self.parse(cache, 'foo = bar\n')
+        entry = '/tmp/.pyn_asts.d/' + self.entries()[0]
+        self.host.write(entry, self.host.read(entry).replace(
+            '# pyn asts v%d' % ast_cache.AST_CACHE_VERSION, '# pyn asts v0'))
+        self.parse(cache, 'foo = bar\n')
+        self.assertEqual(len(self.parsed), 2)
+
+    def test_truncated_entries_are_ignored(self):
+        cache = AstCache(self.host)
+        self.parse(cache, 'foo = bar\n')
+        entry = '/tmp/.pyn_asts.d/' + self.entries()[0]
+        self.host.write(entry, self.host.read(entry)[:-3])
+        self.assertEqual(self.parse(cache, 'foo = bar\n'),
+                         [['var', 'foo', 'bar']])
+        self.assertEqual(len(self.parsed), 2)
@@ -12,9 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import deque
+from itertools import chain, islice
+
+from path_table import PathTable
 from pyn_exceptions import PynException
 
 
+# The states of a node during Graph.tsort().
+_VISITING = 1
+_SORTED = 2
+
+# The kinds of edges recorded in Graph.consumer_index.
+EXPLICIT = 0
+IMPLICIT = 1
+ORDER_ONLY = 2
+
+
 class Graph(object):
     def __init__(self, name):
         self.name = name
@@ -26,30 +40,183 @@ class Graph(object):
         self.subninjas = []
         self.includes = []
         self.is_dirty = False
+        self.paths = PathTable()
+
+        # For each subninja, the manifests it read (itself, and any files
+        # it includes or subninjas in turn), and the nodes (by their first
+        # output), rules, scopes and pools it declared, so that it can be
+        # re-analyzed on its own when they change.
+        self.subninja_manifests = {}
+        self.subninja_nodes = {}
+        self.subninja_rules = {}
+        self.subninja_scopes = {}
+        self.subninja_pools = {}
+
+        # The mtime of each manifest that was read, from just before it
+        # was read, so that we can tell if it has changed since; see
+        # main._load_cached_graph().
+        self.manifest_mtimes = {}
+
+        # The expanded command of each node (by name) that has been
+        # asked for so far; see command().
+        self.commands = {}
+
+        # A map of each path to the (output, kind) pairs of the nodes
+        # that list it as an input in the manifests; see consumers().
+        self.consumer_index = None
+        self._depsfile_consumers = None
+
+        # Attributes that are only computed when first used; see defer().
+        self._loaders = {}
 
     def __repr__(self):
         return 'Graph(name="%s")' % self.name
 
+    def __getattr__(self, name):
+        # This is only called for attributes that haven't been set.
+        loader = self.__dict__.get('_loaders', {}).pop(name, None)
+        if loader is None:
+            raise AttributeError(name)
+        value = loader()
+        setattr(self, name, value)
+        return value
+
+    def defer(self, name, loader):
+        """Set the attribute 'name' to loader() when it is first used.
+
+        GraphCache uses this for the parts of a saved graph that most
+        builds never look at, so that they are only decoded if needed.
+        """
+        self.__dict__.pop(name, None)
+        self._loaders[name] = loader
+
     def roots(self):
         """Find all the outputs that are not inputs of other outputs."""
-        all_deps = set()
-        roots = set()
-        for n in self.nodes.values():
-            for d in n.explicit_deps:
-                all_deps.add(d)
-        for n in self.nodes.values():
-            for d in n.outputs:
-                if not d in all_deps:
-                    roots.add(d)
-        return list(roots)
+        index = self.consumers_by_path()
+        return [o for o in self.nodes
+                if not any(kind == EXPLICIT for _, kind in index.get(o, ()))]
+
+    def consumers(self, path, include_order_only=False):
+        """Return the outputs of the nodes that have path as an input.
+
+        Like Node.deps(), this includes inputs read from depfiles, and
+        order-only inputs only if asked. This takes time proportional
+        to the number of consumers, not the size of the graph.
+        """
+        consumers = [o for o, kind in self.consumers_by_path().get(path, ())
+                     if kind != ORDER_ONLY or include_order_only]
+        if self._depsfile_consumers is None:
+            self._index_depsfile_deps()
+        consumers.extend(self._depsfile_consumers.get(path, ()))
+        unique_consumers = []
+        seen = set()
+        for o in consumers:
+            if o not in seen:
+                seen.add(o)
+                unique_consumers.append(o)
+        return unique_consumers
+
+    def freeze_scopes(self):
+        """Flatten the scopes of each file, once analysis is done.
+
+        The scopes of the build edges are left alone (there are lots of
+        them, and each is only used a few times), but their lookups of
+        inherited variables become a single dict access.
+        """
+        for scope in self.scopes.values():
+            scope.freeze()
+
+    def command(self, node_name, expand_vars):
+        """Return a node's command, expanding it only the first time.
+
+        Expanded commands are saved along with the graph, so they are
+        only expanded again if the node, or its rule, is re-analyzed.
+        """
+        n = self.nodes[node_name]
+        command = self.commands.get(n.name)
+        if command is None:
+            rule_scope = self.rules[n.rule_name]
+            command = expand_vars(rule_scope['command'], n.build_scope(),
+                                  rule_scope)
+            self.commands[n.name] = command
+            self.is_dirty = True
+        return command
+
+    def forget_commands(self, rule_names):
+        """Forget the commands of the nodes that use the given rules."""
+        if not self.commands or not rule_names:
+            return
+        for n in self.unique_nodes():
+            if n.rule_name in rule_names:
+                self.commands.pop(n.name, None)
+
+    def set_depsfile_deps(self, node_name, deps):
+        self.nodes[node_name].depsfile_deps = deps
+        self._depsfile_consumers = None
+
+    def consumers_by_path(self):
+        """Return the index of the edges in the manifests (see consumers())."""
+        if self.consumer_index is None:
+            self.consumer_index = {}
+            self._index_nodes(self.unique_nodes())
+        return self.consumer_index
+
+    def add_nodes(self, nodes):
+        """Add nodes that weren't in the graph when it was analyzed."""
+        for n in nodes:
+            for o in n.outputs:
+                self.nodes[o] = n
+        if self.consumer_index is not None:
+            self._index_nodes(nodes)
+        self._depsfile_consumers = None
+
+    def remove_nodes(self, nodes):
+        """Remove nodes, and their edges, from the graph.
+
+        Like add_nodes(), this updates the index of consumers in place,
+        touching only the paths the nodes read.
+        """
+        removed = set()
+        for n in nodes:
+            for o in n.outputs:
+                del self.nodes[o]
+                removed.add(o)
+            self.commands.pop(n.name, None)
+        if self.consumer_index is not None:
+            index = self.consumer_index
+            for d in set(d for n in nodes for d, _ in n.edges()):
+                consumers = [c for c in index[d] if c[0] not in removed]
+                if consumers:
+                    index[d] = consumers
+                else:
+                    del index[d]
+        self._depsfile_consumers = None
+
+    def _index_nodes(self, nodes):
+        index = self.consumer_index
+        for n in nodes:
+            outputs = n.outputs
+            for d, kind in n.edges():
+                index.setdefault(d, []).extend((o, kind) for o in outputs)
+
+    def _index_depsfile_deps(self):
+        index = {}
+        for n in self.unique_nodes():
+            for d in n.depsfile_deps:
+                index.setdefault(d, []).extend(n.outputs)
+        self._depsfile_consumers = index
+
+    def unique_nodes(self):
+        """Return each node once (self.nodes has one entry per output)."""
+        return [n for o, n in self.nodes.items() if o == n.paths[0]]
 
     def closure(self, targets):
         """Return the set of the targets plus all their dependencies."""
-        unvisited_nodes = targets[:]
+        unvisited_nodes = deque(targets)
         unvisited_set = set(unvisited_nodes)
         nodes_to_build = set()
         while unvisited_nodes:
-            node_name = unvisited_nodes.pop(0)
+            node_name = unvisited_nodes.popleft()
             node = self.nodes[node_name]
             unvisited_set.remove(node_name)
             nodes_to_build.add(node_name)
@@ -62,68 +229,159 @@ class Graph(object):
 
     def tsort(self, nodes_to_build):
         """Sort a list of nodes based on their dependencies (leaves first)."""
-        # This performs a topological sort of the nodes in the graph by
-        # picking nodes arbitrarily, and then doing depth-first searches
-        # across the graph from there. It should run in O(|nodes|) time.
-        # See http://en.wikipedia.org/wiki/Topological_sorting and
-        # Tarjan (1976).
-        #
-        # This algorithm diverges a bit from the Wikipedia algorithm by
-        # inserting new nodes at the tail of the sorted node list instead
-        # of the head, because we want to ultimately do a bottom-up traversal.
-        def visit(node_name, visited_nodes, sorted_nodes, unvisited_nodes,
-                  unvisited_set, sorted_set):
-            if node_name in visited_nodes:
-                raise PynException("'%s' is part of a cycle" % node_name)
-
-            visited_nodes.add(node_name)
-            for d in self.nodes[node_name].deps(include_order_only=True):
-                if d in self.nodes and d not in sorted_set:
-                    visit(d, visited_nodes, sorted_nodes, unvisited_nodes,
-                          unvisited_set, sorted_set)
-            if node_name in unvisited_nodes:
-                unvisited_nodes.remove(node_name)
-                unvisited_set.remove(node_name)
-            sorted_nodes.append(node_name)
-            sorted_set.add(node_name)
-
-        visited_nodes = set()
-        unvisited_nodes = [node_name for node_name in nodes_to_build]
+        # This is a depth-first search from each node in turn, appending
+        # each node to the list once all of its dependencies have been
+        # appended (see http://en.wikipedia.org/wiki/Topological_sorting
+        # and Tarjan (1976)). The search uses an explicit stack rather
+        # than recursion so that long chains of dependencies don't run
+        # into Python's recursion limit, and it touches each node and
+        # edge once, so it runs in O(|nodes| + |edges|) time.
+        def deps_of(node_name):
+            return iter(self.nodes[node_name].deps(include_order_only=True))
+
         sorted_nodes = []
-        sorted_set = set(sorted_nodes)
-        unvisited_set = set(unvisited_nodes)
-        while unvisited_nodes:
-            visit(unvisited_nodes[0], visited_nodes, sorted_nodes,
-                  unvisited_nodes, unvisited_set, sorted_set)
+        state = {}
+        for node_name in nodes_to_build:
+            if node_name in state:
+                continue
+            state[node_name] = _VISITING
+            stack = [(node_name, deps_of(node_name))]
+            while stack:
+                top, deps = stack[-1]
+                for d in deps:
+                    if d not in self.nodes:
+                        continue
+                    d_state = state.get(d)
+                    if d_state is None:
+                        state[d] = _VISITING
+                        stack.append((d, deps_of(d)))
+                        break
+                    if d_state == _VISITING:
+                        raise PynException(_cycle_message(stack, d))
+                else:
+                    stack.pop()
+                    state[top] = _SORTED
+                    sorted_nodes.append(top)
         return sorted_nodes
 
 
+def quote_paths(paths):
+    """Return paths as the value of $in or $out."""
+    return ' '.join(('"%s"' % p if ' ' in p else p) for p in paths)
+
+
+def _cycle_message(stack, node_name):
+    path = [name for name, _ in stack]
+    path = path[path.index(node_name):] + [node_name]
+    return 'dependency cycle: %s' % ' -> '.join(path)
+
+
 class Node(object):
+    """A build edge: a rule, and the paths it reads and writes.
+
+    The outputs and the explicit, implicit, and order-only deps are kept
+    back to back in one tuple, with the offsets of where each kind of
+    dep starts, so a node costs one small object rather than a handful
+    of lists. Each kind is still available as an attribute (as a slice
+    of the tuple), but deps() and edges() walk the tuple without
+    copying it, and paths[0] is always the first output.
+    """
+
+    __slots__ = ('name', 'scope', 'rule_name', 'paths', 'depsfile_deps',
+                 '_explicit_start', '_implicit_start', '_order_only_start')
+
     def __init__(self, name, scope, outputs, rule_name, explicit_deps=None,
                  implicit_deps=None, order_only_deps=None, depsfile_deps=None):
         # 'too many arguments' pylint: disable=R0913
+        explicit_deps = explicit_deps or []
+        implicit_deps = implicit_deps or []
+        order_only_deps = order_only_deps or []
         self.name = name
         self.scope = scope
-        self.outputs = outputs
         self.rule_name = rule_name
-        self.explicit_deps = explicit_deps or []
-        self.implicit_deps = implicit_deps or []
-        self.order_only_deps = order_only_deps or []
-        self.depsfile_deps = depsfile_deps or []
-        self.running = False
+        self.paths = tuple(outputs + explicit_deps + implicit_deps +
+                           order_only_deps)
+        self.depsfile_deps = depsfile_deps or ()
+        self._explicit_start = len(outputs)
+        self._implicit_start = self._explicit_start + len(explicit_deps)
+        self._order_only_start = self._implicit_start + len(implicit_deps)
+
+    @property
+    def outputs(self):
+        return self.paths[:self._explicit_start]
+
+    @property
+    def explicit_deps(self):
+        return self.paths[self._explicit_start:self._implicit_start]
+
+    @property
+    def implicit_deps(self):
+        return self.paths[self._implicit_start:self._order_only_start]
+
+    @property
+    def order_only_deps(self):
+        return self.paths[self._order_only_start:]
+
+    def build_scope(self):
+        """Return the scope the node's rule should be expanded in.
+
+        The node's scope only holds the variables set on the build
+        statement (and is shared with any other nodes in the same file
+        that set them to the same values); this adds $in and $out,
+        which are derived from the node's paths as needed rather than
+        stored for every node.
+        """
+        scope = Scope(self.name, self.scope.parent)
+        scope.objs = dict(self.scope.objs)
+        scope.objs['in'] = quote_paths(self.explicit_deps)
+        scope.objs['out'] = quote_paths(self.outputs)
+        return scope
 
     def deps(self, include_order_only=False):
-        node_names = (self.explicit_deps + self.implicit_deps +
-                      self.depsfile_deps)
+        """Return an iterator over the paths the node reads.
+
+        This is the explicit and implicit deps, and the deps that were
+        read from the node's depfile, followed by the order-only deps if
+        include_order_only is True.
+        """
+        paths = self.paths
+        node_names = chain(islice(paths, self._explicit_start,
+                                  self._order_only_start),
+                           self.depsfile_deps)
         if include_order_only:
-            node_names += self.order_only_deps
+            return chain(node_names,
+                         islice(paths, self._order_only_start, None))
         return node_names
 
+    def edges(self):
+        """Yield a (path, kind) pair for each dep listed in the manifests."""
+        paths = self.paths
+        for kind, start, end in (
+                (EXPLICIT, self._explicit_start, self._implicit_start),
+                (IMPLICIT, self._implicit_start, self._order_only_start),
+                (ORDER_ONLY, self._order_only_start, len(paths))):
+            for d in islice(paths, start, end):
+                yield d, kind
+
     def __repr__(self):
         return 'Node(name="%s")' % self.name
 
 
 class Scope(object):
+    """A set of variables, plus the variables of its parent scope.
+
+    Once a graph has been analyzed, its file scopes can be frozen (see
+    Graph.freeze_scopes()), which flattens everything they can see into
+    a single dict, so that looking up an inherited variable is a single
+    dict access rather than a walk up the chain of parents. Scopes with
+    no variables of their own share their parent's dict. Frozen scopes
+    must not be changed.
+    """
+
+    # The flattened variables, once frozen; set per-instance by freeze()
+    # so that the (many) scopes that are never frozen don't pay for it.
+    flat = None
+
     def __init__(self, name, parent):
         self.name = name
         self.parent = parent
@@ -133,18 +391,36 @@ class Scope(object):
         return 'Scope(name="%s")' % self.name
 
     def __contains__(self, key):
+        if self.flat is not None:
+            return key in self.flat
         return key in self.objs or (self.parent and key in self.parent)
 
     def __setitem__(self, key, value):
+        assert self.flat is None, 'frozen scopes can not be changed'
         self.objs[key] = value
 
     def __delitem__(self, key):
+        assert self.flat is None, 'frozen scopes can not be changed'
         if key in self.objs:
             del self.objs[key]
 
     def __getitem__(self, key):
+        if self.flat is not None:
+            return self.flat.get(key, '')
         if key in self.objs:
             return self.objs[key]
         if self.parent:
             return self.parent[key]
         return ''
+
+    def freeze(self):
+        """Flatten this scope and its parents; returns the flat dict."""
+        if self.flat is None:
+            if self.parent is None:
+                self.flat = dict(self.objs)
+            elif self.objs:
+                self.flat = dict(self.parent.freeze())
+                self.flat.update(self.objs)
+            else:
+                self.flat = self.parent.freeze()
+        return self.flat
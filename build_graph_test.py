@@ -36,6 +36,96 @@ class TestGraph(unittest.TestCase):
         self.assertEqual(repr(Graph('build.ninja')),
                          'Graph(name="build.ninja")')
 
+    def test_closure(self):
+        g = Graph('build.ninja')
+        g.nodes['lib'] = Node('lib', None, ['lib'], 'ar', ['a.o', 'b.o'])
+        g.nodes['a.o'] = Node('a.o', None, ['a.o'], 'cc', ['a.c'],
+                              order_only_deps=['gen.h'])
+        g.nodes['b.o'] = Node('b.o', None, ['b.o'], 'cc', ['b.c'])
+        g.nodes['gen.h'] = Node('gen.h', None, ['gen.h'], 'gen')
+        self.assertEqual(g.closure(['lib']), set(['lib', 'a.o', 'b.o']))
+
+    def test_consumers(self):
+        g = Graph('build.ninja')
+        n = Node('foo.h foo.cc', None, ['foo.h', 'foo.cc'], 'gen',
+                 ['foo.idl'])
+        g.nodes['foo.h'] = n
+        g.nodes['foo.cc'] = n
+        g.nodes['foo.o'] = Node('foo.o', None, ['foo.o'], 'cc', ['foo.cc'],
+                                ['foo.h'], ['gen'])
+        g.nodes['foo'] = Node('foo', None, ['foo'], 'link', ['foo.o'])
+        self.assertEqual(g.consumers('foo.idl'), ['foo.h', 'foo.cc'])
+        self.assertEqual(g.consumers('foo.h'), ['foo.o'])
+        self.assertEqual(g.consumers('gen'), [])
+        self.assertEqual(g.consumers('gen', include_order_only=True),
+                         ['foo.o'])
+        self.assertEqual(g.consumers('foo'), [])
+
+        # Only explicit deps keep an output from being a root.
+        self.assertEqual(sorted(g.roots()), ['foo', 'foo.h'])
+
+        # Deps from depfiles are picked up as they are added.
+        self.assertEqual(g.consumers('bar.h'), [])
+        g.set_depsfile_deps('foo.o', ['foo.h', 'bar.h'])
+        self.assertEqual(g.consumers('bar.h'), ['foo.o'])
+        self.assertEqual(g.consumers('foo.h'), ['foo.o'])
+
+    def test_add_and_remove_nodes(self):
+        g = Graph('build.ninja')
+        foo_o = Node('foo.o', None, ['foo.o'], 'cc', ['foo.c'], ['foo.h'])
+        bar_o = Node('bar.o', None, ['bar.o'], 'cc', ['bar.c'], ['foo.h'])
+        g.add_nodes([foo_o, bar_o])
+        g.consumers_by_path()
+
+        g.add_nodes([Node('foo', None, ['foo'], 'link', ['foo.o', 'bar.o'])])
+        g.remove_nodes([bar_o])
+        self.assertEqual(sorted(g.nodes), ['foo', 'foo.o'])
+
+        # The index is updated in place, to match what it would have been.
+        index = g.consumer_index
+        g.consumer_index = None
+        self.assertEqual(index, g.consumers_by_path())
+        self.assertEqual(g.consumers('foo.h'), ['foo.o'])
+        self.assertEqual(g.consumers('bar.c'), [])
+
+    def test_command(self):
+        g = Graph('build.ninja')
+        cc = Scope('cc', None)
+        cc['command'] = 'cc $in'
+        g.rules['cc'] = cc
+        foo_o = Node('foo.o', Scope('foo.o', None), ['foo.o'], 'cc',
+                     ['foo.c'])
+        foo_o.scope['in'] = 'foo.c'
+        g.add_nodes([foo_o])
+
+        expansions = []
+
+        def expand_vars(msg, scope, rule_scope):
+            expansions.append(msg)
+            return msg.replace('$in', scope['in'])
+
+        self.assertEqual(g.command('foo.o', expand_vars), 'cc foo.c')
+        self.assertTrue(g.is_dirty)
+        self.assertEqual(g.command('foo.o', expand_vars), 'cc foo.c')
+        self.assertEqual(len(expansions), 1)
+
+        g.forget_commands(['link'])
+        self.assertEqual(g.commands, {'foo.o': 'cc foo.c'})
+        g.forget_commands(['cc'])
+        self.assertEqual(g.commands, {})
+
+        g.command('foo.o', expand_vars)
+        g.remove_nodes([foo_o])
+        self.assertEqual(g.commands, {})
+
+    def test_freeze_scopes(self):
+        g = Graph('build.ninja')
+        g.scopes['build.ninja'] = Scope('build.ninja', None)
+        g.scopes['sub.ninja'] = Scope('sub.ninja', g.scopes['build.ninja'])
+        g.scopes['build.ninja']['foo'] = 'bar'
+        g.freeze_scopes()
+        self.assertEqual(g.scopes['sub.ninja'].flat, {'foo': 'bar'})
+
     def test_tsort_cycle(self):
         g = Graph('build.ninja')
         n1 = Node(name='foo.so', scope='build.ninja', outputs=['foo.so'],
@@ -46,6 +136,40 @@ class TestGraph(unittest.TestCase):
         g.nodes[n2.name] = n2
         self.assertRaises(PynException, g.tsort, ['foo.so'])
 
+    def test_tsort_cycle_path(self):
+        g = Graph('build.ninja')
+        for name, dep in (('a', 'b'), ('b', 'c'), ('c', 'a'), ('top', 'a')):
+            g.nodes[name] = Node(name, None, [name], 'cc', [dep])
+        try:
+            g.tsort(['top'])
+            self.fail('tsort() should have raised an exception')
+        except PynException as e:
+            self.assertEqual(str(e), 'dependency cycle: a -> b -> c -> a')
+
+    def test_tsort_self_cycle(self):
+        g = Graph('build.ninja')
+        g.nodes['a'] = Node('a', None, ['a'], 'cc', ['a.c'],
+                            order_only_deps=['a'])
+        self.assertRaises(PynException, g.tsort, ['a'])
+
+    def test_tsort_deep_chain(self):
+        g = Graph('build.ninja')
+        names = ['n%d' % i for i in range(10000)]
+        for i, name in enumerate(names):
+            g.nodes[name] = Node(name, None, [name], 'cc', names[i + 1:i + 2])
+        self.assertEqual(g.tsort(['n0']), list(reversed(names)))
+
+    def test_tsort_shared_deps(self):
+        g = Graph('build.ninja')
+        g.nodes['lib'] = Node('lib', None, ['lib'], 'ar', ['a.o', 'b.o'])
+        g.nodes['a.o'] = Node('a.o', None, ['a.o'], 'cc', ['a.c'],
+                              order_only_deps=['gen.h'])
+        g.nodes['b.o'] = Node('b.o', None, ['b.o'], 'cc', ['b.c'],
+                              order_only_deps=['gen.h'])
+        g.nodes['gen.h'] = Node('gen.h', None, ['gen.h'], 'gen')
+        self.assertEqual(g.tsort(['b.o', 'lib']),
+                         ['gen.h', 'b.o', 'a.o', 'lib'])
+
     def test_tsort_simple(self):
         g = Graph('build.ninja')
         n1 = Node(name='foo.so', scope='build.ninja', outputs=['foo.so'],
@@ -59,11 +183,39 @@ class TestGraph(unittest.TestCase):
 
 class TestNode(unittest.TestCase):
     def test_repr(self):
-        self.assertEqual(repr(Node('foo.o', ['foo.o'], Scope('build.ninja',
-                                                             None),
-                                   'cc', [])),
+        self.assertEqual(repr(Node('foo.o', Scope('build.ninja', None),
+                                   ['foo.o'], 'cc', [])),
                          'Node(name="foo.o")')
 
+    def test_deps(self):
+        n = Node('foo.o', None, ['foo.o'], 'cc', ['foo.c'], ['foo.h'],
+                 ['gen'])
+        self.assertEqual(n.outputs, ('foo.o',))
+        self.assertEqual(n.explicit_deps, ('foo.c',))
+        self.assertEqual(n.implicit_deps, ('foo.h',))
+        self.assertEqual(n.order_only_deps, ('gen',))
+        self.assertEqual(list(n.deps()), ['foo.c', 'foo.h'])
+        self.assertEqual(list(n.deps(include_order_only=True)),
+                         ['foo.c', 'foo.h', 'gen'])
+
+        n.depsfile_deps = ['bar.h']
+        self.assertEqual(list(n.deps(include_order_only=True)),
+                         ['foo.c', 'foo.h', 'bar.h', 'gen'])
+
+    def test_slots(self):
+        n = Node('foo.o', None, ['foo.o'], 'cc')
+        self.assertRaises(AttributeError, setattr, n, 'running', True)
+
+    def test_build_scope(self):
+        file_scope = Scope('build.ninja', None)
+        build_vars = Scope('foo', file_scope)
+        build_vars['in'] = 'ignored'
+        n = Node('foo', build_vars, ['foo'], 'link', ['my lib.a', 'foo.o'])
+        scope = n.build_scope()
+        self.assertTrue(scope.parent is file_scope)
+        self.assertEqual(scope['in'], '"my lib.a" foo.o')
+        self.assertEqual(scope['out'], 'foo')
+
 
 class TestScope(unittest.TestCase):
     def setUp(self):
@@ -98,3 +250,27 @@ class TestScope(unittest.TestCase):
         del self.c['foo']
         self.assertEqual(self.p['foo'], 'p-foo')
         self.assertEqual(self.c['foo'], 'p-foo')
+
+    def test_freeze(self):
+        empty = Scope('empty.ninja', self.c)
+        build = Scope('out', empty)
+        build['baz'] = 'b-baz'
+
+        self.assertEqual(empty.freeze(), {'foo': 'c-foo', 'bar': 'p-bar'})
+        self.assertEqual(self.p.flat, {'foo': 'p-foo', 'bar': 'p-bar'})
+
+        # Scopes without variables of their own share their parent's.
+        self.assertTrue(empty.flat is self.c.flat)
+
+        # Lookups give the same answers as before.
+        self.assertEqual(self.c['foo'], 'c-foo')
+        self.assertEqual(self.c['baz'], '')
+        self.assertTrue('bar' in self.c)
+        self.assertFalse('baz' in self.c)
+        self.assertEqual(build['foo'], 'c-foo')
+        self.assertEqual(build['baz'], 'b-baz')
+
+        # Scopes that weren't frozen can still be changed.
+        build['foo'] = 'b-foo'
+        self.assertEqual(build['foo'], 'b-foo')
+        self.assertRaises(AssertionError, self.c.__setitem__, 'foo', 'x')
@@ -0,0 +1,118 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+
+
+LOG_FILE = '.pyn_log'
+
+BUILD_LOG_VERSION = 2
+
+_BUILD_LOG_HEADER = '# pyn log v%d\n' % BUILD_LOG_VERSION
+
+# Recompact the log when it has this many times more lines than entries.
+_BUILD_LOG_RECOMPACT_RATIO = 3
+
+# ... but don't bother until it has at least this many lines.
+_BUILD_LOG_MIN_RECOMPACT_LINES = 100
+
+
+def hash_command(command):
+    """Return a stable 64-bit hash of a command line."""
+    return int(hashlib.md5(command).hexdigest()[:16], 16)
+
+
+class LogEntry(object):
+    def __init__(self, output, command_hash, start, end, mtime):
+        # 'too many arguments' pylint: disable=R0913
+        self.output = output
+        self.command_hash = command_hash
+        self.start = start
+        self.end = end
+        self.mtime = mtime
+
+    def __repr__(self):
+        return 'LogEntry(output="%s")' % self.output
+
+    def line(self):
+        return '%d\t%d\t%d\t%s\t%016x\n' % (self.start, self.end, self.mtime,
+                                           self.output, self.command_hash)
+
+
+class BuildLog(object):
+    """An append-only record of the commands run to build each output.
+
+    Like ninja's .ninja_log, each line records when a command started
+    and ended (in milliseconds since the start of the build it ran in),
+    the mtime of the output afterwards (in nanoseconds), the output's
+    path, and a hash of the command line. Later lines for the same
+    output supersede earlier ones, and the log is rewritten once it has
+    too many stale lines.
+    """
+
+    def __init__(self, host, path=LOG_FILE):
+        self.host = host
+        self.path = path
+        self.entries = {}
+        self._needs_header = True
+
+    def load(self):
+        if not self.host.exists(self.path):
+            return
+
+        lines = self.host.read(self.path).splitlines()
+        if not lines or lines[0] + '\n' != _BUILD_LOG_HEADER:
+            # Written by a different version of pyn; start over.
+            return
+
+        for line in lines[1:]:
+            fields = line.split('\t')
+            if len(fields) != 5:
+                continue
+            start, end, mtime, output, command_hash = fields
+            try:
+                self.entries[output] = LogEntry(output, int(command_hash, 16),
+                                                int(start), int(end),
+                                                int(mtime))
+            except ValueError:
+                continue
+        self._needs_header = False
+
+        if (len(lines) > _BUILD_LOG_MIN_RECOMPACT_LINES and
+                len(lines) > _BUILD_LOG_RECOMPACT_RATIO * len(self.entries)):
+            self.recompact()
+
+    def durations(self):
+        """Return how long each output's last command took, in seconds."""
+        return dict((output, (entry.end - entry.start) / 1000.0)
+                    for output, entry in self.entries.items())
+
+    def lookup(self, output):
+        return self.entries.get(output)
+
+    def record(self, output, command, start, end, mtime):
+        # 'too many arguments' pylint: disable=R0913
+        entry = LogEntry(output, hash_command(command), start, end, mtime)
+        self.entries[output] = entry
+        if self._needs_header:
+            self.host.write(self.path, _BUILD_LOG_HEADER)
+            self._needs_header = False
+        self.host.append(self.path, entry.line())
+
+    def recompact(self):
+        self.host.write(self.path,
+                        _BUILD_LOG_HEADER +
+                        ''.join(self.entries[output].line()
+                                for output in sorted(self.entries)))
+        self._needs_header = False
@@ -0,0 +1,91 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from build_log import BuildLog, LOG_FILE, hash_command
+from host_fake import FakeHost
+
+
+class TestBuildLog(unittest.TestCase):
+    def setUp(self):  # 'invalid name' pylint: disable=C0103
+        self.host = FakeHost()
+
+    def reload(self):
+        log = BuildLog(self.host)
+        log.load()
+        return log
+
+    def test_hash_command(self):
+        self.assertEqual(hash_command('cc -o foo.o foo.c'),
+                         hash_command('cc -o foo.o foo.c'))
+        self.assertNotEqual(hash_command('cc -o foo.o foo.c'),
+                            hash_command('cc -o foo.o  foo.c'))
+        self.assertTrue(0 <= hash_command('') < 2 ** 64)
+
+    def test_empty(self):
+        log = self.reload()
+        self.assertEqual(log.entries, {})
+        self.assertEqual(log.lookup('foo.o'), None)
+
+    def test_round_trip(self):
+        log = self.reload()
+        log.record('foo.o', 'cc -o foo.o foo.c', 10, 1510, 1234500000000)
+        log.record('bar.o', 'cc -o bar.o bar.c', 20, 520, 1235)
+
+        log = self.reload()
+        entry = log.lookup('foo.o')
+        self.assertEqual(entry.command_hash, hash_command('cc -o foo.o foo.c'))
+        self.assertEqual((entry.start, entry.end, entry.mtime),
+                         (10, 1510, 1234500000000))
+        self.assertEqual(log.durations(), {'foo.o': 1.5, 'bar.o': 0.5})
+
+    def test_later_entries_win(self):
+        log = self.reload()
+        log.record('foo.o', 'cc -o foo.o foo.c', 0, 10, 1)
+        log.record('foo.o', 'cc -O2 -o foo.o foo.c', 0, 20, 2)
+
+        entry = self.reload().lookup('foo.o')
+        self.assertEqual(entry.command_hash,
+                         hash_command('cc -O2 -o foo.o foo.c'))
+        self.assertEqual(entry.mtime, 2)
+
+    def test_other_versions_are_ignored(self):
+        self.host.write(LOG_FILE, '# pyn log v1\n0\t1\t0\tfoo.o\t0\n')
+        log = self.reload()
+        self.assertEqual(log.entries, {})
+
+        log.record('foo.o', 'touch foo.o', 0, 1, 1)
+        self.assertEqual(list(self.reload().entries), ['foo.o'])
+
+    def test_bad_lines_are_skipped(self):
+        self.host.write(LOG_FILE, '# pyn log v2\n'
+                                  'garbage\n'
+                                  '0\t1\t0\tfoo.o\tnothex\n'
+                                  '0\t1\t0\tbar.o\t00000000000000ff\n')
+        log = self.reload()
+        self.assertEqual(list(log.entries), ['bar.o'])
+        self.assertEqual(log.lookup('bar.o').command_hash, 255)
+
+    def test_recompact(self):
+        log = self.reload()
+        for i in range(200):
+            log.record('foo.o', 'cc -o foo.o foo.c', i, i + 1, i)
+        self.assertEqual(len(self.host.read(LOG_FILE).splitlines()), 201)
+
+        log = self.reload()
+        self.assertEqual(self.host.read(LOG_FILE).splitlines()[1:],
+                         ['199\t200\t199\tfoo.o\t%016x' %
+                          hash_command('cc -o foo.o foo.c')])
+        self.assertEqual(log.lookup('foo.o').start, 199)
@@ -12,10 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from build_log import BuildLog, hash_command
+from deps_log import DepsLog
 from pyn_exceptions import PynException
 from stats import Stats
-from pool import Pool, Empty
+from load_monitor import LoadMonitor
+from path_table import canonicalize_path
+from pool import ProcessPool, Empty
 from printer import Printer
+from scheduler import Scheduler
+from stat_cache import StatCache
 
 
 class Builder(object):
@@ -27,65 +33,153 @@ class Builder(object):
         self.stats = Stats(host.getenv('NINJA_STATUS', '[%s/%t] '),
                            host.time, started_time)
         self._printer = Printer(host.print_out, self._should_overwrite)
-        self._mtimes = {}
+        self._stat_cache = StatCache(host)
+        self._load_monitor = LoadMonitor(host, args.max_load)
+        self._maybe_clean = set()
+        self._changed = set()
+        self._stale_deps = set()
+        self.build_log = BuildLog(host)
+        self.build_log.load()
+        self.deps_log = DepsLog(host)
+        self.deps_log.load()
         self._failures = 0
         self._pool = None
+        self._node_pools = {}
+        self._console_node = None
+        self._held_output = []
 
-    def find_nodes_to_build(self, old_graph, graph):
-        node_names = self.args.targets or graph.defaults or graph.roots()
+    def find_nodes_to_build(self, graph):
+        self._add_logged_deps(graph)
+        node_names = ([canonicalize_path(t) for t in self.args.targets] or
+                      graph.defaults or graph.roots())
         try:
-            nodes_to_build = graph.closure(node_names)
+            nodes_to_build_set = graph.closure(node_names)
         except KeyError as e:
             raise PynException('error: unknown target %s' % str(e))
 
-        sorted_nodes = graph.tsort(nodes_to_build)
-        sorted_nodes = [n for n in sorted_nodes
-                        if graph.nodes[n].rule_name != 'phony']
+        paths = set(nodes_to_build_set)
+        for node_name in nodes_to_build_set:
+            paths.update(graph.nodes[node_name].deps())
+        self._stat_cache.prefetch(paths, self.args.jobs)
 
+        # A node needs to be rebuilt if it is dirty itself, or if any
+        # of its inputs are going to be rebuilt. In the latter case we
+        # might still be able to skip it, if its inputs come from 'restat'
+        # rules that turn out not to change them (see _can_skip()).
         nodes_to_build = []
-        for node_name in sorted_nodes:
+        dirty_nodes = {}
+        self._maybe_clean = set()
+        for node_name in graph.tsort(nodes_to_build_set):
             n = graph.nodes[node_name]
-            my_stat = self._stat(node_name)
-            if my_stat is None or any(self._stat(d) > my_stat
-                                      for d in n.deps()):
+            if n.name not in dirty_nodes:
+                inputs_dirty = any(dirty_nodes.get(d) for d in n.deps())
+                if n.rule_name == 'phony':
+                    dirty_nodes[n.name] = inputs_dirty
+                elif self._is_dirty(graph, node_name):
+                    dirty_nodes[n.name] = True
+                elif inputs_dirty:
+                    dirty_nodes[n.name] = True
+                    self._maybe_clean.add(n.name)
+                else:
+                    dirty_nodes[n.name] = False
+            dirty_nodes[node_name] = dirty_nodes[n.name]
+            if dirty_nodes[node_name] and n.rule_name != 'phony':
                 nodes_to_build.append(node_name)
+
+        return nodes_to_build
+
+    def _is_dirty(self, graph, node_name):
+        n = graph.nodes[node_name]
+        if n.name in self._stale_deps:
+            return True
+        output_mtimes = [self._stat(o) for o in n.outputs]
+        if None in output_mtimes:
+            return True
+        my_stat = min(output_mtimes)
+
+        # If a restat rule ran but didn't touch its outputs, the log has
+        # the mtime of the inputs it was run against.
+        entry = self.build_log.lookup(node_name)
+        if entry and self._binding(graph, node_name, 'restat'):
+            my_stat = max(my_stat, entry.mtime)
+
+        for d in n.deps():
+            mtime = self._stat(d)
+            if mtime is None or mtime > my_stat:
+                return True
+
+        if self._binding(graph, node_name, 'generator') != '1':
+            if (not entry or entry.command_hash !=
+                    hash_command(self._command(graph, node_name))):
+                return True
+
+        return False
+
+    def _add_logged_deps(self, graph):
+        outputs = [o for o in self.deps_log.outputs() if o in graph.nodes]
+        self._stat_cache.prefetch(outputs, self.args.jobs)
+        for output in outputs:
+            deps = self.deps_log.get(output)
+            if deps is None:
                 continue
 
-            if old_graph and node_name in old_graph.nodes:
-                if (self._command(old_graph, node_name) !=
-                        self._command(graph, node_name)):
-                    nodes_to_build.append(node_name)
-                    continue
+            # Like ninja, don't trust deps that were recorded for an
+            # older version of the output; rebuild it to get new ones.
+            mtime = self._stat(output)
+            if mtime is not None and self.deps_log.mtime(output) < mtime:
+                self._stale_deps.add(graph.nodes[output].name)
+                continue
 
-        return nodes_to_build
+            # The paths are only interned here, as they are used, since
+            # a graph loaded from the cache builds its path table then.
+            graph.set_depsfile_deps(output, graph.paths.intern_all(deps))
 
     def build(self, graph, nodes_to_build):
+        pools = dict(graph.pools)
+        pools['console'] = 1
+        self._node_pools = {}
+        for node_name in nodes_to_build:
+            pool = self._binding(graph, node_name, 'pool')
+            if pool:
+                if pool not in pools:
+                    raise PynException("error: unknown pool name '%s'" % pool)
+                self._node_pools[node_name] = pool
+
+        scheduler = Scheduler(graph, nodes_to_build,
+                              self.build_log.durations(), pools,
+                              self._node_pools)
         stats = self.stats
-        stats.total = len(nodes_to_build)
+        stats.total = scheduler.remaining
         stats.started = 0
         stats.started_time = self.host.time()
 
-        running_jobs = []
-        self._pool = Pool(self.args.jobs, _call)
+        running_jobs = set()
+        self._pool = ProcessPool(self.host, self.args.jobs,
+                                 stats.started_time)
         try:
-            while nodes_to_build and self._failures < self.args.errors:
-                while stats.started - stats.finished < self.args.jobs:
-                    n = self._find_next_available_node(graph, nodes_to_build)
-                    if n:
-                        self._build_node(graph, n)
-                        running_jobs.append(n)
-                    else:
-                        break
-                did_work = self._process_completed_jobs(graph, running_jobs)
-                if (not did_work and nodes_to_build and
-                        self._failures < self.args.errors):
-                    did_work = self._process_completed_jobs(graph,
-                                                            running_jobs,
-                                                            block=True)
+            while self._failures < self.args.errors:
+                # We always keep at least one job running, however high
+                # the load is, so that the build can make progress.
+                while (stats.started - stats.finished < self.args.jobs and
+                       scheduler.has_ready() and
+                       (not running_jobs or
+                        not self._load_monitor.too_high())):
+                    node_name = scheduler.next()
+                    if self._can_skip(graph, node_name):
+                        stats.total -= 1
+                        scheduler.mark_done(node_name)
+                        continue
+                    self._check_deps_exist(graph, node_name)
+                    self._build_node(graph, node_name)
+                    running_jobs.add(node_name)
+                if not running_jobs:
+                    break
+                self._process_completed_jobs(graph, scheduler, running_jobs,
+                                             block=True)
 
             while running_jobs:
-                did_work = self._process_completed_jobs(graph, running_jobs,
-                                                        block=True)
+                self._process_completed_jobs(graph, scheduler, running_jobs,
+                                             block=True)
         finally:
             self._pool.close()
             self._pool.join()
@@ -93,88 +187,112 @@ class Builder(object):
         self._printer.flush()
         return 1 if self._failures else 0
 
-    def _find_next_available_node(self, graph, nodes_to_build):
-        next_node = None
-        for node_name in nodes_to_build:
-            n = graph.nodes[node_name]
-            if not any(d in graph.nodes and graph.nodes[d].running
-                       for d in n.deps(include_order_only=True)):
-                next_node = node_name
-                break
+    def _can_skip(self, graph, node_name):
+        """Return whether a node's inputs were rebuilt without changing.
+
+        This only applies to nodes that aren't dirty on their own, when
+        the inputs that were rebuilt come from 'restat' rules.
+        """
+        n = graph.nodes[node_name]
+        return (n.name in self._maybe_clean and
+                not self._inputs_changed(graph, n))
 
-        if next_node:
-            # Ensure all of the dependencies actually exist.
-            # FIXME: is there a better place for this check?
-            for d in n.deps():
-                if not self.host.exists(d):
-                    raise PynException("error: '%s', needed by '%s', %s" %
-                                       (d, next_node,
-                                        "missing and no known rule to make "
-                                        "it"))
-            nodes_to_build.remove(next_node)
-        return next_node
+    def _inputs_changed(self, graph, n):
+        for d in n.deps():
+            if d in self._changed:
+                return True
+            if (d in graph.nodes and graph.nodes[d].rule_name == 'phony' and
+                    self._inputs_changed(graph, graph.nodes[d])):
+                return True
+        return False
+
+    def _check_deps_exist(self, graph, node_name):
+        # Ensure all of the dependencies actually exist.
+        # FIXME: is there a better place for this check?
+        # Deps that came from a depfile may have gone away since it was
+        # written; that just means the node needs to be rebuilt.
+        n = graph.nodes[node_name]
+        for d in n.explicit_deps + n.implicit_deps:
+            if self._stat(d) is None:
+                raise PynException("error: '%s', needed by '%s', %s" %
+                                   (d, node_name,
+                                    "missing and no known rule to make it"))
 
     def _command(self, graph, node_name):
+        return graph.command(node_name, self.expand_vars)
+
+    def _binding(self, graph, node_name, var):
+        """Return the value of a variable as seen by a build edge."""
         node = graph.nodes[node_name]
+        if var in node.scope.objs:
+            return node.scope.objs[var]
         rule_scope = graph.rules[node.rule_name]
-        return self.expand_vars(rule_scope['command'], node.scope, rule_scope)
+        if var in rule_scope.objs:
+            return self.expand_vars(rule_scope.objs[var], node.build_scope(),
+                                    rule_scope)
+        return node.scope[var]
 
     def _description(self, graph, node_name):
         node = graph.nodes[node_name]
         rule_scope = graph.rules[node.rule_name]
         desc = rule_scope['description'] or rule_scope['command']
-        return self.expand_vars(desc, node.scope, rule_scope)
+        return self.expand_vars(desc, node.build_scope(), rule_scope)
 
     def _build_node(self, graph, node_name):
         node = graph.nodes[node_name]
         desc = self._description(graph, node_name)
         command = self._command(graph, node_name)
-        self._build_node_started(node, desc, command)
+        self._build_node_started(desc, command)
+
+        # Jobs in the console pool write straight to our stdout, so
+        # anything else we'd print is held back until they finish.
+        console = self._node_pools.get(node_name) == 'console'
+        if console:
+            self._printer.flush()
+            self._console_node = node_name
 
         dry_run = node.rule_name == 'phony' or self.args.dry_run
         if not dry_run:
             for o in node.outputs:
                 self.host.maybe_mkdir(self.host.dirname(o))
-        self._pool.send((node.name, desc, command, dry_run, self.host))
+        self._pool.send((node_name, desc, command, dry_run, console))
 
-    def _process_completed_jobs(self, graph, running_jobs, block=False):
-        did_work = False
+    def _process_completed_jobs(self, graph, scheduler, running_jobs,
+                                block=False):
         while True:
             try:
                 resp = self._pool.get(block=block)
-                running_jobs.remove(resp[0])
-                did_work = True
-                self._build_node_done(graph, resp)
-                if block:
-                    break
             except Empty:
                 break
-        return did_work
+            running_jobs.remove(resp[0])
+            self._build_node_done(graph, scheduler, resp)
+
+            # Pick up anything else that has finished, but don't wait.
+            block = False
 
-    def _build_node_started(self, node, desc, command):
-        node.running = True
+    def _build_node_started(self, desc, command):
         self.stats.started += 1
         if self.args.verbose > 1:
             self._update(command, elide=False)
         else:
             self._update(desc)
 
-    def _build_node_done(self, graph, result):
-        node_name, desc, command, ret, out, err = result
+    def _build_node_done(self, graph, scheduler, result):
+        node_name, desc, command, ret, out, err, start, end = result
         n = graph.nodes[node_name]
-        rule_scope = graph.rules[n.rule_name]
-        n.running = False
-
-        if n.scope['depfile'] and n.scope['deps'] == 'gcc':
-            path = self.expand_vars(n.scope['depfile'], n.scope, rule_scope)
-            if self.host.exists(path):
-                depsfile_deps = self.host.read(path).split()[2:]
-                self.host.remove(path)
-                if n.depsfile_deps != depsfile_deps:
-                    n.depsfile_deps = depsfile_deps
-                    graph.dirty = True
 
         self.stats.finished += 1
+        if not ret:
+            if self.args.dry_run:
+                self._changed.update(n.outputs)
+            else:
+                self._record_results(graph, node_name, command, start, end)
+            scheduler.mark_done(node_name)
+        else:
+            scheduler.mark_failed(node_name)
+
+        if node_name == self._console_node:
+            self._console_node = None
 
         if ret:
             self._failures += 1
@@ -184,32 +302,71 @@ class Builder(object):
         elif self._should_overwrite:
             self._update(desc)
         if out or err:
-            self._printer.flush()
+            self._output('flush')
         if out:
-            self.host.print_out(out, end='')
+            self._output('out', out)
         if err:
-            self.host.print_err(err, end='')
+            self._output('err', err)
+
+        if not self._console_node:
+            held, self._held_output = self._held_output, []
+            for args in held:
+                self._output(*args)
+
+    def _record_results(self, graph, node_name, command, start, end):
+        # 'too many arguments' pylint: disable=R0913
+        n = graph.nodes[node_name]
+        has_deps = False
+        if self._binding(graph, node_name, 'deps') == 'gcc':
+            path = self._binding(graph, node_name, 'depfile')
+            if path and self.host.exists(path):
+                depsfile_deps = _parse_depfile(self.host.read(path))
+                graph.set_depsfile_deps(node_name,
+                                        graph.paths.intern_all(depsfile_deps))
+                self.host.remove(path)
+                has_deps = True
+
+        restat = self._binding(graph, node_name, 'restat')
+        old_mtimes = [self._stat(o) for o in n.outputs]
+        mtimes = [self._restat(o) or 0 for o in n.outputs]
+        if not restat or mtimes != old_mtimes:
+            self._changed.update(n.outputs)
+            log_mtimes = mtimes
+        else:
+            # Nothing changed, so record the newest input's mtime as the
+            # outputs' mtime; otherwise the node would look dirty forever.
+            newest_input = max([self._stat(d) or 0 for d in n.deps()] or [0])
+            log_mtimes = [max(m, newest_input) for m in mtimes]
+
+        for o, mtime, log_mtime in zip(n.outputs, mtimes, log_mtimes):
+            self.build_log.record(o, command, start, end, log_mtime)
+            if has_deps:
+                self.deps_log.record(o, mtime, n.depsfile_deps)
 
     def _update(self, msg, prefix=None, elide=True):
         prefix = prefix or self.stats.format()
-        self._printer.update(prefix + msg, elide=elide)
+        self._output('update', prefix + msg, elide)
+
+    def _output(self, kind, msg=None, elide=True):
+        if self._console_node:
+            self._held_output.append((kind, msg, elide))
+        elif kind == 'update':
+            self._printer.update(msg, elide=elide)
+        elif kind == 'flush':
+            self._printer.flush()
+        elif kind == 'out':
+            self.host.print_out(msg, end='')
+        else:
+            self.host.print_err(msg, end='')
 
     def _stat(self, name):
-        if not name in self._mtimes:
-            self._restat(name)
-        return self._mtimes.get(name, None)
+        return self._stat_cache.mtime(name)
 
     def _restat(self, name):
-        if self.host.exists(name):
-            self._mtimes[name] = self.host.mtime(name)
-        else:
-            self._mtimes[name] = None
+        return self._stat_cache.restat(name)
 
 
-def _call(request):
-    node_name, desc, command, dry_run, host = request
-    if dry_run:
-        ret, out, err = 0, '', ''
-    else:
-        ret, out, err = host.call(command)
-    return (node_name, desc, command, ret, out, err)
+def _parse_depfile(contents):
+    """Return the inputs listed in a gcc-style (Makefile) depfile."""
+    _, _, deps = contents.partition(':')
+    return deps.replace('\\\n', ' ').split()
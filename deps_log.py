@@ -0,0 +1,186 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+
+from path_table import canonicalize_path
+
+
+DEPS_FILE = '.pyn_deps'
+
+DEPS_LOG_VERSION = 2
+
+_DEPS_LOG_HEADER = '# pyndeps\n' + struct.pack('<i', DEPS_LOG_VERSION)
+
+# The high bit of a record's size marks it as a deps record rather
+# than a path record.
+_DEPS_FLAG = 0x80000000
+
+# Recompact the log when it holds this many times more deps records
+# than live outputs ...
+_DEPS_LOG_RECOMPACT_RATIO = 3
+
+# ... but don't bother until it has at least this many records.
+_DEPS_LOG_MIN_RECOMPACT_RECORDS = 1000
+
+
+class DepsLog(object):
+    """An append-only, binary record of the deps discovered from depfiles.
+
+    Like ninja's .ninja_deps, the log is a header followed by two kinds
+    of records, each prefixed by its size:
+
+      - a path record is a path, padded with NULs to a multiple of four
+        bytes, and the one's complement of the ID it is given. IDs are
+        handed out in the order paths are added to the log.
+      - a deps record is the ID of an output, the output's mtime (in
+        nanoseconds), and the IDs of each of the output's dependencies.
+
+    Recording the deps for an output appends any new paths and one deps
+    record; later deps records for an output supersede earlier ones.
+    Paths are canonicalized as they are read back, so that a path that
+    was logged under more than one spelling still has a single entry.
+    """
+
+    def __init__(self, host, path=DEPS_FILE):
+        self.host = host
+        self.path = path
+        self.paths = []
+        self.ids = {}
+        self.deps = {}
+        self.num_records = 0
+        self._needs_header = True
+
+    def load(self):
+        if not self.host.exists(self.path):
+            return
+
+        contents = self.host.read_binary(self.path)
+        if not contents.startswith(_DEPS_LOG_HEADER):
+            # Written by a different version of pyn; start over.
+            return
+        self._needs_header = False
+
+        # The IDs of paths that were logged under another spelling of a
+        # path logged earlier, and the ID of the earlier one.
+        aliases = {}
+
+        p, end = len(_DEPS_LOG_HEADER), len(contents)
+        while p + 4 <= end:
+            size, = struct.unpack_from('<I', contents, p)
+            is_deps = size & _DEPS_FLAG
+            size &= ~_DEPS_FLAG
+            if size % 4 or p + 4 + size > end:
+                break
+            p += 4
+            if is_deps:
+                if size < 12:
+                    break
+                out_id, mtime = struct.unpack_from('<iq', contents, p)
+                dep_ids = struct.unpack_from('<%di' % ((size - 12) // 4),
+                                             contents, p + 12)
+                if (out_id >= len(self.paths) or
+                        any(i >= len(self.paths) for i in dep_ids)):
+                    break
+                if aliases:
+                    out_id = aliases.get(out_id, out_id)
+                    dep_ids = [aliases.get(i, i) for i in dep_ids]
+                self.deps[out_id] = (mtime, list(dep_ids))
+                self.num_records += 1
+            else:
+                path = canonicalize_path(contents[p:p + size - 4].rstrip('\0'))
+                checksum, = struct.unpack_from('<i', contents, p + size - 4)
+                if checksum != ~len(self.paths):
+                    break
+                if path in self.ids:
+                    aliases[len(self.paths)] = self.ids[path]
+                else:
+                    self.ids[path] = len(self.paths)
+                self.paths.append(path)
+            p += size
+
+        if p != end:
+            # The log was truncated or is corrupt (e.g., we were killed
+            # in the middle of a write); drop anything we couldn't read.
+            self.recompact()
+        elif (self.num_records > _DEPS_LOG_MIN_RECOMPACT_RECORDS and
+              self.num_records > _DEPS_LOG_RECOMPACT_RATIO * len(self.deps)):
+            self.recompact()
+
+    def get(self, output):
+        """Return the recorded deps for output, or None if there are none."""
+        out_id = self.ids.get(output)
+        if out_id is None or out_id not in self.deps:
+            return None
+        return [self.paths[i] for i in self.deps[out_id][1]]
+
+    def mtime(self, output):
+        out_id = self.ids.get(output)
+        if out_id is None or out_id not in self.deps:
+            return None
+        return self.deps[out_id][0]
+
+    def outputs(self):
+        return [self.paths[out_id] for out_id in self.deps]
+
+    def record(self, output, mtime, deps):
+        records = []
+        out_id = self._intern(output, records)
+        dep_ids = [self._intern(d, records) for d in deps]
+        if self.deps.get(out_id) == (mtime, dep_ids):
+            return
+        records.append(_deps_record(out_id, mtime, dep_ids))
+        self.deps[out_id] = (mtime, dep_ids)
+        self.num_records += 1
+
+        if self._needs_header:
+            self.host.write_binary(self.path, _DEPS_LOG_HEADER)
+            self._needs_header = False
+        self.host.append_binary(self.path, ''.join(records))
+
+    def recompact(self):
+        """Rewrite the log with only the live paths and deps records."""
+        old_paths, old_deps = self.paths, self.deps
+        self.paths, self.ids, self.deps = [], {}, {}
+
+        records = []
+        for old_out_id in sorted(old_deps):
+            mtime, old_dep_ids = old_deps[old_out_id]
+            out_id = self._intern(old_paths[old_out_id], records)
+            dep_ids = [self._intern(old_paths[i], records)
+                       for i in old_dep_ids]
+            records.append(_deps_record(out_id, mtime, dep_ids))
+            self.deps[out_id] = (mtime, dep_ids)
+        self.num_records = len(self.deps)
+
+        self.host.write_binary(self.path, _DEPS_LOG_HEADER + ''.join(records))
+        self._needs_header = False
+
+    def _intern(self, path, records):
+        if path in self.ids:
+            return self.ids[path]
+        path_id = len(self.paths)
+        self.ids[path] = path_id
+        self.paths.append(path)
+
+        padded = path + '\0' * (-len(path) % 4)
+        records.append(struct.pack('<I', len(padded) + 4) + padded +
+                       struct.pack('<i', ~path_id))
+        return path_id
+
+
+def _deps_record(out_id, mtime, dep_ids):
+    return (struct.pack('<Iiq', (12 + 4 * len(dep_ids)) | _DEPS_FLAG,
+                        out_id, mtime) +
+            struct.pack('<%di' % len(dep_ids), *dep_ids))
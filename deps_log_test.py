@@ -0,0 +1,113 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from deps_log import DepsLog, DEPS_FILE
+from host_fake import FakeHost
+
+
+class TestDepsLog(unittest.TestCase):
+    def setUp(self):  # 'invalid name' pylint: disable=C0103
+        self.host = FakeHost()
+
+    def reload(self):
+        log = DepsLog(self.host)
+        log.load()
+        return log
+
+    def test_empty(self):
+        log = self.reload()
+        self.assertEqual(log.get('foo.o'), None)
+        self.assertEqual(log.outputs(), [])
+
+    def test_round_trip(self):
+        log = self.reload()
+        log.record('foo.o', 1500000000, ['foo.c', 'foo.h', 'bar.h'])
+        log.record('bar.o', 2000000000, ['bar.c', 'bar.h'])
+
+        log = self.reload()
+        self.assertEqual(log.get('foo.o'), ['foo.c', 'foo.h', 'bar.h'])
+        self.assertEqual(log.get('bar.o'), ['bar.c', 'bar.h'])
+        self.assertEqual(log.mtime('foo.o'), 1500000000)
+        self.assertEqual(sorted(log.outputs()), ['bar.o', 'foo.o'])
+
+        # Paths are not a source of deps themselves.
+        self.assertEqual(log.get('bar.h'), None)
+
+    def test_paths_are_interned(self):
+        log = self.reload()
+        log.record('foo.o', 0, ['common.h'])
+        size = len(self.host.read(DEPS_FILE))
+        log.record('bar.o', 0, ['common.h'])
+
+        # A path record for bar.o (16 bytes), and a deps record for it
+        # that refers to common.h by ID (20 bytes).
+        self.assertEqual(len(self.host.read(DEPS_FILE)) - size, 36)
+
+    def test_unchanged_deps_are_not_rewritten(self):
+        log = self.reload()
+        log.record('foo.o', 0, ['foo.h'])
+        size = len(self.host.read(DEPS_FILE))
+        log.record('foo.o', 0, ['foo.h'])
+        self.assertEqual(len(self.host.read(DEPS_FILE)), size)
+
+        log.record('foo.o', 1, ['foo.h'])
+        self.assertNotEqual(len(self.host.read(DEPS_FILE)), size)
+        self.assertEqual(self.reload().mtime('foo.o'), 1)
+
+    def test_spellings_are_canonicalized(self):
+        log = self.reload()
+        log.record('./foo.o', 0, ['x/../foo.h'])
+        log.record('foo.o', 1, ['foo.h', 'bar.h'])
+
+        log = self.reload()
+        self.assertEqual(log.outputs(), ['foo.o'])
+        self.assertEqual(log.get('foo.o'), ['foo.h', 'bar.h'])
+        self.assertEqual(log.mtime('foo.o'), 1)
+
+    def test_truncated_log(self):
+        log = self.reload()
+        log.record('foo.o', 0, ['foo.h'])
+        log.record('bar.o', 0, ['bar.h'])
+        contents = self.host.read(DEPS_FILE)
+        self.host.write(DEPS_FILE, contents[:-3])
+
+        log = self.reload()
+        self.assertEqual(log.get('foo.o'), ['foo.h'])
+        self.assertEqual(log.get('bar.o'), None)
+
+        # The partial record should have been thrown away.
+        log.record('bar.o', 0, ['bar.h'])
+        self.assertEqual(self.reload().get('bar.o'), ['bar.h'])
+
+    def test_other_versions_are_ignored(self):
+        self.host.write(DEPS_FILE, '# pyndeps\n\0\0\0\0garbage')
+        log = self.reload()
+        self.assertEqual(log.outputs(), [])
+        log.record('foo.o', 0, ['foo.h'])
+        self.assertEqual(self.reload().get('foo.o'), ['foo.h'])
+
+    def test_recompact(self):
+        log = self.reload()
+        for i in range(1100):
+            log.record('foo.o', i, ['foo.h', 'v%d.h' % (i % 2)])
+        size = len(self.host.read(DEPS_FILE))
+
+        log = self.reload()
+        self.assertEqual(log.num_records, 1)
+        self.assertEqual(log.get('foo.o'), ['foo.h', 'v1.h'])
+        self.assertEqual(log.mtime('foo.o'), 1099)
+        self.assertTrue(len(self.host.read(DEPS_FILE)) < size / 100)
+        self.assertEqual(self.reload().get('foo.o'), ['foo.h', 'v1.h'])
@@ -0,0 +1,418 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+
+from build_graph import Graph, Node, Scope
+from path_table import PathTable
+
+
+CACHE_FILE = '.pyn.db'
+
+GRAPH_CACHE_VERSION = 9
+
+_GRAPH_CACHE_MAGIC = 'PYNGRAPH'
+
+# The sections of the file, in the order they appear. Each entry in the
+# header's section table is the offset of the section and the number of
+# records in it; each record is the given number of 32-bit ints, except
+# for the string blob, which is bytes.
+_SECTIONS = (
+    ('strings', 2),     # offset into blob, length
+    ('blob', 0),        # the contents of every string, back to back
+    ('manifests', 1),   # string IDs of the includes, then the subninjas
+    ('manifest_mtimes', 3),  # manifest, low and high 32 bits of its mtime
+    ('defaults', 1),    # string IDs
+    ('scopes', 4),      # name, parent scope index (or -1), vars offset,
+                        # vars count
+    ('vars', 2),        # name, value
+    ('named_scopes', 2),  # name, scope index
+    ('rules', 2),       # name, scope index
+    ('pools', 2),       # name, depth
+    ('nodes', 8),       # name, rule name, scope index, paths offset,
+                        # number of outputs, explicit, implicit, and
+                        # order-only deps
+    ('paths', 1),       # string IDs
+    ('consumers', 3),   # input path, output path, kind of edge
+    ('subninja_manifests', 2),  # subninja, a manifest it read
+    ('subninja_nodes', 2),      # subninja, a node's first output
+    ('subninja_rules', 2),      # subninja, a rule it declared
+    ('subninja_scopes', 2),     # subninja, a scope it declared
+    ('subninja_pools', 2),      # subninja, a pool it declared
+    ('commands', 2),    # node name, expanded command
+)
+
+# The sections that hold, for each subninja, the names of the things it
+# read or declared; see Graph.subninja_manifests and friends.
+_SUBNINJA_SECTIONS = ('subninja_manifests', 'subninja_nodes',
+                      'subninja_rules', 'subninja_scopes', 'subninja_pools')
+
+# magic, version, graph name, number of includes, and the section table.
+_GRAPH_CACHE_HEADER = struct.Struct('<8sIII' + 'II' * len(_SECTIONS))
+
+
+class GraphCache(object):
+    """A read-only view of a graph that was saved with write_graph().
+
+    The file is a header, a table of sections, and then the sections
+    themselves. All strings are stored once in a string table and
+    referred to by index, and every other record is a fixed number of
+    32-bit ints, so we can find any record directly.
+
+    The file is memory-mapped, and only the parts that are asked for are
+    ever decoded. In particular, deciding whether the manifests need
+    to be rescanned only touches the header, the list of manifests,
+    and the strings they refer to, and the parts of the graph that a
+    no-op build doesn't use are only decoded if they are used (see
+    Graph.defer()). Call close() (or use a with statement) once done.
+    """
+
+    def __init__(self, host, path=CACHE_FILE):
+        self.host = host
+        self.path = path
+        self._buf = None
+        self._sections = {}
+        self._name = None
+        self._num_includes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+    def load(self):
+        """Map the file in; returns False if it is missing or unusable."""
+        if not self.host.exists(self.path):
+            return False
+        self._buf = self.host.mmap(self.path)
+        if not self._load():
+            self.close()
+            return False
+        return True
+
+    def close(self):
+        """Unmap the file; graphs returned by graph() are unaffected."""
+        if self._buf is not None:
+            self._buf.close()
+            self._buf = None
+
+    def _load(self):
+        buf = self._buf
+        if len(buf) < _GRAPH_CACHE_HEADER.size:
+            return False
+        fields = _GRAPH_CACHE_HEADER.unpack_from(buf, 0)
+        magic, version, name, num_includes = fields[:4]
+        if magic != _GRAPH_CACHE_MAGIC or version != GRAPH_CACHE_VERSION:
+            return False
+
+        sections = {}
+        for i, (section, width) in enumerate(_SECTIONS):
+            offset, count = fields[4 + 2 * i], fields[5 + 2 * i]
+            size = count * width * 4 if width else count
+            if offset + size > len(buf):
+                return False
+            sections[section] = (offset, count)
+
+        self._sections = sections
+        self._name = name
+        self._num_includes = num_includes
+        return True
+
+    def name(self):
+        return self._string(self._name)
+
+    def includes(self):
+        return [self._string(i) for i in
+                self._ints('manifests')[:self._num_includes]]
+
+    def subninjas(self):
+        return [self._string(i) for i in
+                self._ints('manifests')[self._num_includes:]]
+
+    def manifest_mtimes(self):
+        """Return the mtime of each manifest from when it was read."""
+        return _mtimes(self._records('manifest_mtimes'), self._string)
+
+    def subninja_manifests(self):
+        """Return the manifests that each subninja read."""
+        return _string_lists(self._records('subninja_manifests'),
+                             self._string)
+
+    def graph(self):
+        """Decode the graph (or at least, the parts every build uses)."""
+        strings = self._strings()
+        graph = Graph(strings[self._name])
+        graph.includes = self.includes()
+        graph.subninjas = self.subninjas()
+        graph.defaults = [strings[i] for i in self._ints('defaults')]
+
+        scopes = []
+        all_vars = self._records('vars')
+        for name, parent, off, count in self._records('scopes'):
+            scope = Scope(strings[name],
+                          scopes[parent] if parent >= 0 else None)
+            for k, v in all_vars[off:off + count]:
+                scope.objs[strings[k]] = strings[v]
+            scopes.append(scope)
+
+        for name, scope_idx in self._records('named_scopes'):
+            graph.scopes[strings[name]] = scopes[scope_idx]
+        for name, scope_idx in self._records('rules'):
+            graph.rules[strings[name]] = scopes[scope_idx]
+        for name, depth in self._records('pools'):
+            graph.pools[strings[name]] = depth
+
+        paths = [strings[i] for i in self._ints('paths')]
+        for (name, rule_name, scope_idx, off, num_outputs, num_explicit,
+             num_implicit, num_order_only) in self._records('nodes'):
+            explicit_off = off + num_outputs
+            implicit_off = explicit_off + num_explicit
+            order_only_off = implicit_off + num_implicit
+            outputs = paths[off:explicit_off]
+            n = Node(strings[name], scopes[scope_idx], outputs,
+                     strings[rule_name],
+                     paths[explicit_off:implicit_off],
+                     paths[implicit_off:order_only_off],
+                     paths[order_only_off:order_only_off + num_order_only])
+            for o in outputs:
+                graph.nodes[o] = n
+
+        graph.commands = dict((strings[name], strings[command])
+                              for name, command in self._records('commands'))
+
+        def consumer_index(records):
+            index = {}
+            for path, output, kind in records:
+                index.setdefault(strings[path], []).append(
+                    (strings[output], kind))
+            return index
+
+        def string_lists(records):
+            return _string_lists(records, strings.__getitem__)
+
+        # The paths were all canonicalized when they were analyzed, and
+        # the table shares the nodes' copies of them.
+        graph.defer('paths', lambda: PathTable(
+            (p for n in graph.unique_nodes() for p in n.paths),
+            canonical=True))
+        graph.defer('manifest_mtimes',
+                    self._deferred_records(
+                        'manifest_mtimes',
+                        lambda records: _mtimes(records, strings.__getitem__)))
+        graph.defer('consumer_index',
+                    self._deferred_records('consumers', consumer_index))
+        for section in _SUBNINJA_SECTIONS:
+            graph.defer(section,
+                        self._deferred_records(section, string_lists))
+        return graph
+
+    def _ints(self, section):
+        offset, count = self._sections[section]
+        width = dict(_SECTIONS)[section]
+        return _ints(self._buf, offset, count * width)
+
+    def _records(self, section):
+        return _records(self._ints(section), dict(_SECTIONS)[section])
+
+    def _deferred_records(self, section, decode):
+        """Return a function that decodes section's records with decode().
+
+        The section is copied out of the file now (which is cheap next
+        to decoding it), so that the function works after close().
+        """
+        offset, count = self._sections[section]
+        width = dict(_SECTIONS)[section]
+        data = self._buf[offset:offset + count * width * 4]
+        return lambda: decode(_records(_ints(data, 0, count * width), width))
+
+    def _string(self, string_id):
+        offset, _ = self._sections['strings']
+        blob_offset, _ = self._sections['blob']
+        start, length = struct.unpack_from('<II', self._buf,
+                                           offset + 8 * string_id)
+        return self._buf[blob_offset + start:blob_offset + start + length]
+
+    def _strings(self):
+        blob_offset, _ = self._sections['blob']
+        ints = self._ints('strings')
+        buf = self._buf
+        return [buf[blob_offset + ints[i]:blob_offset + ints[i] + ints[i + 1]]
+                for i in range(0, len(ints), 2)]
+
+
+def _ints(buf, offset, count):
+    return struct.unpack_from('<%di' % count, buf, offset)
+
+
+def _records(ints, width):
+    return [ints[i:i + width] for i in range(0, len(ints), width)]
+
+
+def _mtimes(records, string):
+    mtimes = {}
+    for path, low, high in records:
+        mtimes[string(path)], = struct.unpack('<q',
+                                              struct.pack('<ii', low, high))
+    return mtimes
+
+
+def _string_lists(records, string):
+    lists = {}
+    for key, value in records:
+        lists.setdefault(string(key), []).append(string(value))
+    return lists
+
+
+def write_graph(host, graph, path=CACHE_FILE):
+    host.write_binary(path, _GraphWriter(graph).serialize())
+
+
+class _GraphWriter(object):
+    def __init__(self, graph):
+        self.graph = graph
+        self.string_ids = {}
+        self.strings = []
+        self.scope_ids = {}
+        self.scopes = []
+
+    def serialize(self):
+        graph = self.graph
+        s = self._string
+        name = s(graph.name)
+
+        manifests = ([s(p) for p in graph.includes] +
+                     [s(p) for p in graph.subninjas])
+        defaults = [s(p) for p in graph.defaults]
+
+        # Only the manifests that are still part of the build are kept.
+        manifest_mtimes = []
+        for p in sorted(set([graph.name] + graph.includes + [
+                f for subninja in graph.subninjas
+                for f in graph.subninja_manifests.get(subninja, ())])):
+            if p in graph.manifest_mtimes:
+                manifest_mtimes.append(
+                    (s(p),) + struct.unpack(
+                        '<ii', struct.pack('<q', graph.manifest_mtimes[p])))
+        named_scopes = [(s(n), self._scope(graph.scopes[n]))
+                        for n in sorted(graph.scopes)]
+        rules = [(s(n), self._scope(graph.rules[n]))
+                 for n in sorted(graph.rules)]
+        pools = [(s(n), graph.pools[n]) for n in sorted(graph.pools)]
+
+        nodes = []
+        paths = []
+        seen = set()
+        for output in sorted(graph.nodes):
+            n = graph.nodes[output]
+            if n.name in seen:
+                continue
+            seen.add(n.name)
+            nodes.append((s(n.name), s(n.rule_name), self._scope(n.scope),
+                          len(paths), len(n.outputs), len(n.explicit_deps),
+                          len(n.implicit_deps), len(n.order_only_deps)))
+            paths.extend(s(p) for p in n.paths)
+
+        consumers = []
+        index = graph.consumers_by_path()
+        for path in sorted(index):
+            consumers.extend((s(path), s(output), kind)
+                             for output, kind in index[path])
+
+        subninja_records = {}
+        for section in _SUBNINJA_SECTIONS:
+            lists = getattr(graph, section)
+            subninja_records[section] = [
+                (s(subninja), s(p)) for subninja in graph.subninjas
+                for p in lists.get(subninja, ())]
+
+        commands = [(s(n), s(graph.commands[n]))
+                    for n in sorted(graph.commands)]
+
+        scopes = []
+        all_vars = []
+        for scope in self.scopes:
+            parent = (self.scope_ids[id(scope.parent)]
+                      if scope.parent else -1)
+            scopes.append((s(scope.name), parent, len(all_vars),
+                           len(scope.objs)))
+            for k in sorted(scope.objs):
+                all_vars.append((s(k), s(scope.objs[k])))
+
+        blob = []
+        string_records = []
+        offset = 0
+        for string in self.strings:
+            string_records.append((offset, len(string)))
+            blob.append(string)
+            offset += len(string)
+
+        contents = {
+            'strings': string_records,
+            'blob': ''.join(blob),
+            'manifests': manifests,
+            'defaults': defaults,
+            'manifest_mtimes': manifest_mtimes,
+            'scopes': scopes,
+            'vars': all_vars,
+            'named_scopes': named_scopes,
+            'rules': rules,
+            'pools': pools,
+            'nodes': nodes,
+            'paths': paths,
+            'consumers': consumers,
+            'commands': commands,
+        }
+        contents.update(subninja_records)
+
+        table = []
+        sections = []
+        offset = _GRAPH_CACHE_HEADER.size
+        for section, width in _SECTIONS:
+            records = contents[section]
+            if width == 0:
+                data = records
+            elif width == 1:
+                data = struct.pack('<%di' % len(records), *records)
+            else:
+                data = struct.pack('<%di' % (len(records) * width),
+                                   *[i for r in records for i in r])
+            data += '\0' * (-len(data) % 4)
+            table.extend((offset, len(records)))
+            sections.append(data)
+            offset += len(data)
+
+        header = _GRAPH_CACHE_HEADER.pack(_GRAPH_CACHE_MAGIC,
+                                          GRAPH_CACHE_VERSION, name,
+                                          len(graph.includes), *table)
+        return header + ''.join(sections)
+
+    def _string(self, string):
+        if string not in self.string_ids:
+            self.string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return self.string_ids[string]
+
+    def _scope(self, scope):
+        # Parents are always added before their children, so that they
+        # can be recreated in order when the graph is read back in.
+        chain = []
+        parent = scope
+        while parent is not None and id(parent) not in self.scope_ids:
+            chain.append(parent)
+            parent = parent.parent
+        for s in reversed(chain):
+            self.scope_ids[id(s)] = len(self.scopes)
+            self.scopes.append(s)
+        return self.scope_ids[id(scope)]
@@ -0,0 +1,193 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+import textwrap
+import unittest
+
+from analyzer import NinjaAnalyzer
+from graph_cache import (CACHE_FILE, GRAPH_CACHE_VERSION, GraphCache,
+                         write_graph)
+from host_fake import FakeHost
+from parser import parse
+from var_expander import expand_vars
+
+
+class TestGraphCache(unittest.TestCase):
+    def setUp(self):  # 'invalid name' pylint: disable=C0103
+        self.host = FakeHost()
+        self.host.files = {
+            '/tmp/build.ninja': textwrap.dedent("""
+                cflags = -Wall
+                pool link_pool
+                    depth = 2
+                rule cc
+                    command = cc $cflags -c $in -o $out
+                rule gen
+                    command = gen $in
+                build foo.h foo.cc : gen foo.idl
+                build foo.o : cc foo.cc | foo.h || gen
+                    cflags = -O2
+                build gen : phony
+                default foo.o
+                include vars.ninja
+                subninja sub.ninja
+                """),
+            '/tmp/vars.ninja': 'ldflags = -g\n',
+            '/tmp/sub.ninja': 'build bar.o : cc bar.cc\n',
+        }
+        analyzer = NinjaAnalyzer(self.host, None, parse, expand_vars)
+        self.graph = analyzer.analyze(parse(self.host.read('build.ninja'),
+                                            'build.ninja'), 'build.ninja')
+
+    def reload(self):
+        write_graph(self.host, self.graph)
+        cache = GraphCache(self.host)
+        self.assertTrue(cache.load())
+        return cache
+
+    def test_manifests(self):
+        cache = self.reload()
+        self.assertEqual(cache.name(), 'build.ninja')
+        self.assertEqual(cache.includes(), ['vars.ninja'])
+        self.assertEqual(cache.subninjas(), ['sub.ninja'])
+
+    def test_round_trip(self):
+        graph = self.reload().graph()
+        self.assertEqual(graph.name, 'build.ninja')
+        self.assertEqual(graph.defaults, ['foo.o'])
+        self.assertEqual(graph.pools, {'link_pool': 2})
+        self.assertEqual(sorted(graph.rules), ['cc', 'gen'])
+        self.assertEqual(sorted(graph.scopes), ['build.ninja', 'sub.ninja'])
+        self.assertEqual(sorted(graph.nodes),
+                         ['bar.o', 'foo.cc', 'foo.h', 'foo.o', 'gen'])
+        self.assertFalse(graph.is_dirty)
+
+        n = graph.nodes['foo.o']
+        self.assertEqual(n.outputs, ('foo.o',))
+        self.assertEqual(n.rule_name, 'cc')
+        self.assertEqual(n.explicit_deps, ('foo.cc',))
+        self.assertEqual(n.implicit_deps, ('foo.h',))
+        self.assertEqual(n.order_only_deps, ('gen',))
+        rule_scope = graph.rules['cc']
+        self.assertEqual(expand_vars(rule_scope['command'], n.build_scope(),
+                                     rule_scope),
+                         'cc -O2 -c foo.cc -o foo.o')
+
+        # Nodes with multiple outputs are shared.
+        self.assertTrue(graph.nodes['foo.h'] is graph.nodes['foo.cc'])
+
+        # Scopes keep their parents.
+        self.assertTrue(graph.nodes['bar.o'].scope.parent is
+                        graph.scopes['sub.ninja'])
+        self.assertTrue(graph.scopes['sub.ninja'].parent is
+                        graph.scopes['build.ninja'])
+        self.assertEqual(graph.scopes['sub.ninja']['ldflags'], '-g')
+
+    def test_path_table(self):
+        graph = self.reload().graph()
+        self.assertEqual(sorted(graph.paths.paths),
+                         sorted(self.graph.paths.paths))
+
+        # The nodes share the table's copies of their paths.
+        self.assertTrue(graph.nodes['foo.o'].explicit_deps[0] is
+                        graph.paths.intern('foo.cc'))
+        self.assertTrue(graph.nodes['foo.h'].outputs[1] is
+                        graph.paths.intern('foo.cc'))
+
+    def test_consumers(self):
+        graph = self.reload().graph()
+        self.assertEqual(graph.consumer_index,
+                         self.graph.consumers_by_path())
+        self.assertEqual(graph.consumers('foo.h'), ['foo.o'])
+        self.assertEqual(graph.consumers('gen'), [])
+        self.assertEqual(graph.consumers('gen', include_order_only=True),
+                         ['foo.o'])
+
+    def test_close(self):
+        cache = self.reload()
+        graph = cache.graph()
+        cache.close()
+        self.assertTrue(all(buf.closed for buf in self.host.mmaps))
+
+        # The parts of the graph that are decoded lazily still work.
+        self.assertFalse('consumer_index' in graph.__dict__)
+        self.assertEqual(graph.consumers('foo.h'), ['foo.o'])
+        self.assertEqual(graph.subninja_manifests,
+                         {'sub.ninja': ['sub.ninja']})
+
+    def test_with(self):
+        write_graph(self.host, self.graph)
+        with GraphCache(self.host) as cache:
+            self.assertTrue(cache.load())
+        self.assertTrue(all(buf.closed for buf in self.host.mmaps))
+
+    def test_subninja_manifests(self):
+        cache = self.reload()
+        self.assertEqual(cache.subninja_manifests(),
+                         {'sub.ninja': ['sub.ninja']})
+        graph = cache.graph()
+        self.assertEqual(graph.subninja_manifests,
+                         {'sub.ninja': ['sub.ninja']})
+        self.assertEqual(graph.subninja_nodes, {'sub.ninja': ['bar.o']})
+        self.assertEqual(graph.subninja_rules, {})
+        self.assertEqual(graph.subninja_scopes,
+                         {'sub.ninja': ['sub.ninja']})
+        self.assertEqual(graph.subninja_pools, {})
+
+    def test_manifest_mtimes(self):
+        mtimes = dict((p, self.host.mtime(p))
+                      for p in ('vars.ninja', 'sub.ninja'))
+        self.assertEqual(self.graph.manifest_mtimes, mtimes)
+
+        # mtimes are in nanoseconds, so they need more than 32 bits, and
+        # only the manifests that are part of the build are kept.
+        self.graph.manifest_mtimes['build.ninja'] = 1500000000123456789
+        self.graph.manifest_mtimes['old.ninja'] = 1
+        mtimes['build.ninja'] = 1500000000123456789
+        cache = self.reload()
+        self.assertEqual(cache.manifest_mtimes(), mtimes)
+        self.assertEqual(cache.graph().manifest_mtimes, mtimes)
+
+    def test_commands(self):
+        self.graph.command('foo.o', expand_vars)
+        graph = self.reload().graph()
+        self.assertEqual(graph.commands,
+                         {'foo.o': 'cc -O2 -c foo.cc -o foo.o'})
+        self.assertFalse(graph.is_dirty)
+
+    def test_missing(self):
+        self.assertFalse(GraphCache(self.host).load())
+
+    def test_other_versions_are_ignored(self):
+        self.reload()
+        contents = self.host.read(CACHE_FILE)
+        self.host.write(CACHE_FILE,
+                        contents[:8] +
+                        struct.pack('<I', GRAPH_CACHE_VERSION + 1) +
+                        contents[12:])
+        self.assertFalse(GraphCache(self.host).load())
+
+    def test_garbage_is_ignored(self):
+        self.host.write(CACHE_FILE, '')
+        self.assertFalse(GraphCache(self.host).load())
+        self.host.write(CACHE_FILE, 'not a graph at all, really, not one')
+        self.assertFalse(GraphCache(self.host).load())
+
+    def test_truncated(self):
+        self.reload()
+        contents = self.host.read(CACHE_FILE)
+        self.host.write(CACHE_FILE, contents[:-4])
+        self.assertFalse(GraphCache(self.host).load())
+        self.assertTrue(self.host.mmaps[-1].closed)
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import mmap
 import multiprocessing
 import os
 import shutil
@@ -29,6 +30,14 @@ class Host(object):
     def abspath(self, *comps):
         return os.path.abspath(self.join(*comps))
 
+    def append(self, path, contents):
+        with open(path, 'a') as f:
+            f.write(contents)
+
+    def append_binary(self, path, contents):
+        with open(path, 'ab') as f:
+            f.write(contents)
+
     def call(self, cmd_str):
         proc = subprocess.Popen(cmd_str, shell=True, stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE)
@@ -61,6 +70,13 @@ class Host(object):
     def getenv(self, key, default=None):
         return os.getenv(key, default=default)
 
+    def getloadavg(self):
+        """Return the one-minute load average, or None if it's unknown."""
+        try:
+            return os.getloadavg()[0]
+        except (AttributeError, OSError):
+            return None
+
     def join(self, *comps):
         return os.path.join(*comps)
 
@@ -69,11 +85,29 @@ class Host(object):
         if not self.exists(path):
             os.mkdir(path)
 
+    def maybe_mtime(self, *comps):
+        """Return the mtime of a path, or None if it doesn't exist."""
+        try:
+            return _mtime_ns(os.stat(self.join(*comps)))
+        except OSError:
+            return None
+
     def mkdtemp(self, **kwargs):
         return tempfile.mkdtemp(**kwargs)
 
+    def mmap(self, *comps):
+        """Return a read-only, memory-mapped view of a file's contents.
+
+        The caller should close() the mapping once it is done with it.
+        """
+        with open(self.join(*comps), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return _EmptyMap()
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
     def mtime(self, *comps):
-        return os.stat(self.join(*comps)).st_mtime
+        """Return the mtime of a path as an integer number of nanoseconds."""
+        return _mtime_ns(os.stat(self.join(*comps)))
 
     def print_err(self, msg, end='\n'):
         self.stderr.write(str(msg) + end)
@@ -87,6 +121,11 @@ class Host(object):
         with open(path) as f:
             return f.read()
 
+    def read_binary(self, *comps):
+        path = self.join(*comps)
+        with open(path, 'rb') as f:
+            return f.read()
+
     def relpath(self, path, start):
         return os.path.relpath(path, start)
 
@@ -96,9 +135,41 @@ class Host(object):
     def rmtree(self, path):
         shutil.rmtree(path, ignore_errors=True)
 
+    def spawn(self, cmd_str, inline=False):
+        """Start a command and return without waiting for it to finish.
+
+        The returned object has the interface of a subprocess.Popen.
+        The command's stdout and stderr are pipes unless inline is
+        True, in which case it runs with our stdin, stdout, and stderr.
+        """
+        if inline:
+            return subprocess.Popen(cmd_str, shell=True)
+        return subprocess.Popen(cmd_str, shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+
     def time(self):
         return time.time()
 
     def write(self, path, contents):
         with open(path, 'w') as f:
             f.write(contents)
+
+    def write_binary(self, path, contents):
+        with open(path, 'wb') as f:
+            f.write(contents)
+
+
+class _EmptyMap(str):
+    """Stands in for the mapping of an empty file, which mmap can't map."""
+
+    def close(self):
+        pass
+
+
+def _mtime_ns(st):
+    if hasattr(st, 'st_mtime_ns'):
+        return st.st_mtime_ns
+
+    # Python 2 only gives us a float, which is good to about a
+    # microsecond; anything finer than that is just noise.
+    return int(round(st.st_mtime * 1000000)) * 1000
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import shlex
 
 # FIXME: make this work w/ python3.
@@ -34,8 +35,11 @@ class FakeHost(object):
         self.last_tmpdir = None
         self.current_tmpno = 0
         self.mtimes = {}
+        self.last_mtime = 0
         self.cmds = []
         self.cwd = '/tmp'
+        self.load_average = 0.0
+        self.mmaps = []
 
     def abspath(self, *comps):
         relpath = self.join(*comps)
@@ -43,13 +47,24 @@ class FakeHost(object):
             return relpath
         return self.join(self.cwd, relpath)
 
+    def append(self, path, contents):
+        full_path = self.abspath(path)
+        self.write(full_path, (self.files.get(full_path) or '') + contents)
+
+    def append_binary(self, path, contents):
+        self.append(path, contents)
+
     def call(self, cmd_str):
         self.cmds.append(cmd_str)
         args = shlex.split(cmd_str)
+        if args == ['true']:
+            return 0, '', ''
         if args[0] == 'echo' and args[-2] == '>':
             out = ' '.join(args[1:len(args) - 2]) + '\n'
             self.write(self.abspath(args[-1]), out)
             return 0, '', ''
+        if args[0] == 'echo':
+            return 0, ' '.join(args[1:]) + '\n', ''
         if args[0] == 'cat' and args[-2] == '>':
             out = ''
             for f in args[1:len(args) - 2]:
@@ -72,7 +87,7 @@ class FakeHost(object):
 
     def exists(self, *comps):
         path = self.join(self.cwd, *comps)
-        return path in self.files or path in self.dirs
+        return self.files.get(path) is not None or path in self.dirs
 
     def files_under(self, top):
         files = []
@@ -88,6 +103,9 @@ class FakeHost(object):
         assert key
         return default
 
+    def getloadavg(self):
+        return self.load_average
+
     def join(self, *comps):
         p = ''
         for c in comps:
@@ -106,6 +124,11 @@ class FakeHost(object):
         if not path in self.dirs:
             self.dirs.add(path)
 
+    def maybe_mtime(self, *comps):
+        if not self.exists(*comps):
+            return None
+        return self.mtime(*comps)
+
     def mkdtemp(self, suffix='', prefix='tmp', dir=None, **_kwargs):
         if dir is None:
             dir = self.sep + '__im_tmp'
@@ -114,8 +137,13 @@ class FakeHost(object):
         self.last_tmpdir = self.join(dir, '%s_%u_%s' % (prefix, curno, suffix))
         return self.last_tmpdir
 
+    def mmap(self, *comps):
+        buf = FakeMmap(self.read(*comps))
+        self.mmaps.append(buf)
+        return buf
+
     def mtime(self, *comps):
-        return self.mtimes.get(self.join(*comps), 0)
+        return self.mtimes.get(self.abspath(*comps), 0)
 
     def print_err(self, msg, end='\n'):
         self.stderr.write(msg + end)
@@ -126,6 +154,9 @@ class FakeHost(object):
     def read(self, *comps):
         return self.files[self.abspath(*comps)]
 
+    def read_binary(self, *comps):
+        return self.read(*comps)
+
     def relpath(self, path, start):
         return path.replace(start + '/', '')
 
@@ -141,6 +172,14 @@ class FakeHost(object):
                 self.files[f] = None
                 self.written_files[f] = None
 
+    def spawn(self, cmd_str, inline=False):
+        ret, out, err = self.call(cmd_str)
+        if inline:
+            self.print_out(out, end='')
+            self.print_err(err, end='')
+            return FakeProcess(ret)
+        return FakeProcess(ret, out, err)
+
     def time(self):
         return 0
 
@@ -149,3 +188,44 @@ class FakeHost(object):
         self.maybe_mkdir(self.dirname(full_path))
         self.files[full_path] = contents
         self.written_files[full_path] = contents
+        self.last_mtime += 1
+        self.mtimes[full_path] = self.last_mtime
+
+    def write_binary(self, path, contents):
+        self.write(path, contents)
+
+
+class FakeMmap(str):
+    """The contents of a file, as returned by mmap(); remembers close()."""
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeProcess(object):
+    """A command that has already finished, as returned by spawn().
+
+    The output is handed back through real pipes, so that callers can
+    wait on it the same way they would for a real process (the output
+    needs to fit in the pipe's buffer, but fake commands don't say much).
+    """
+
+    def __init__(self, returncode, out=None, err=None):
+        self.returncode = returncode
+        self.stdout = _finished_pipe(out) if out is not None else None
+        self.stderr = _finished_pipe(err) if err is not None else None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        return self.returncode
+
+
+def _finished_pipe(contents):
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, contents)
+    os.close(write_fd)
+    return os.fdopen(read_fd, 'rb')
@@ -43,7 +43,7 @@ def path_to_main():
 class IntegrationTestMixin(object):
     def _files_to_ignore(self):
         # return ['.ninja_deps', '.ninja_log']
-        return ['.pyn.db']
+        return ['.pyn.db', '.pyn_asts.d', '.pyn_deps', '.pyn_log']
 
     def _host(self):
         return Host()
@@ -59,7 +59,10 @@ class IntegrationTestArgs(IntegrationTestMixin, main_test.TestArgs):
 
 
 class IntegrationTestBuild(IntegrationTestMixin, main_test.TestBuild):
-    pass
+    def test_load_limit(self):
+        # We can't set the real load average, so just check that the
+        # build finishes whether or not it is over the limit.
+        self.check_load_limit()
 
 
 class IntegrationTestTools(IntegrationTestMixin, main_test.TestTools):
@@ -0,0 +1,45 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# The load average only changes every few seconds, so there's no point
+# in asking for it more often than this (in seconds).
+MIN_SAMPLE_INTERVAL = 0.5
+
+
+class LoadMonitor(object):
+    """Decide whether the system is too busy to start another job.
+
+    Like ninja's -l, this compares the one-minute load average against
+    a limit; a limit of zero or less (or a system that can't report its
+    load) means there is no limit. The load is sampled at most once
+    every `interval` seconds, and the last sample is reused in between.
+    """
+
+    def __init__(self, host, max_load, interval=MIN_SAMPLE_INTERVAL):
+        self.host = host
+        self.max_load = max_load
+        self.interval = interval
+        self._last_sample_time = None
+        self._last_load = None
+
+    def too_high(self):
+        if not self.max_load or self.max_load <= 0:
+            return False
+        now = self.host.time()
+        if (self._last_sample_time is None or
+                now - self._last_sample_time >= self.interval):
+            self._last_sample_time = now
+            self._last_load = self.host.getloadavg()
+        return self._last_load is not None and self._last_load > self.max_load
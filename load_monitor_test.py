@@ -0,0 +1,71 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from host_fake import FakeHost
+from load_monitor import LoadMonitor
+
+
+class ClockHost(FakeHost):
+    def __init__(self):
+        super(ClockHost, self).__init__()
+        self.now = 0.0
+        self.samples = 0
+
+    def getloadavg(self):
+        self.samples += 1
+        return super(ClockHost, self).getloadavg()
+
+    def time(self):
+        return self.now
+
+
+class TestLoadMonitor(unittest.TestCase):
+    def setUp(self):  # 'invalid name' pylint: disable=C0103
+        self.host = ClockHost()
+
+    def test_no_limit(self):
+        self.host.load_average = 100.0
+        self.assertFalse(LoadMonitor(self.host, None).too_high())
+        self.assertFalse(LoadMonitor(self.host, 0).too_high())
+        self.assertEqual(self.host.samples, 0)
+
+    def test_limit(self):
+        monitor = LoadMonitor(self.host, 4.0)
+        self.host.load_average = 4.0
+        self.assertFalse(monitor.too_high())
+
+        self.host.now = 1.0
+        self.host.load_average = 4.5
+        self.assertTrue(monitor.too_high())
+
+    def test_sampling_is_rate_limited(self):
+        monitor = LoadMonitor(self.host, 4.0, interval=1.0)
+        self.host.load_average = 8.0
+        self.assertTrue(monitor.too_high())
+
+        # The load dropping isn't noticed until the next sample.
+        self.host.load_average = 1.0
+        self.host.now = 0.5
+        self.assertTrue(monitor.too_high())
+        self.assertEqual(self.host.samples, 1)
+
+        self.host.now = 1.0
+        self.assertFalse(monitor.too_high())
+        self.assertEqual(self.host.samples, 2)
+
+    def test_unknown_load(self):
+        self.host.load_average = None
+        self.assertFalse(LoadMonitor(self.host, 1.0).too_high())
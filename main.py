@@ -12,14 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import cPickle
 import sys
 
 from analyzer import NinjaAnalyzer
 from args import parse_args
+from ast_cache import AstCache
 from builder import Builder
+from graph_cache import GraphCache, write_graph
 from host import Host
-from parser import parse
+from parser import parse_iter
 from pyn_exceptions import PynException
 from tools import tool_names, list_tools, run_tool
 from var_expander import expand_vars
@@ -53,22 +54,18 @@ def main(host, argv=None):
         return 2
 
     try:
-        old_graph, graph = _load_graphs(host, args)
-
-        if args.tool:
-            return run_tool(host, args, old_graph, graph, started_time)
-
-        builder = Builder(host, args, expand_vars, started_time)
-        nodes_to_build = builder.find_nodes_to_build(old_graph, graph)
-
-        if nodes_to_build:
-            res = builder.build(graph, nodes_to_build)
-            if graph.is_dirty:
-                graph_str = cPickle.dumps(graph)
-                host.write('.pyn.db', graph_str)
-        else:
-            host.print_out('pyn: no work to do.')
-            res = 0
+        graph = _load_graph(host, args)
+        graph.freeze_scopes()
+        if graph.is_dirty:
+            write_graph(host, graph)
+            graph.is_dirty = False
+
+        res = _run(host, args, graph, started_time)
+
+        # Save any commands that were expanded for the first time, so
+        # that later runs don't have to.
+        if graph.is_dirty:
+            write_graph(host, graph)
         return res
     except PynException as e:
         host.print_err(str(e))
@@ -78,30 +75,68 @@ def main(host, argv=None):
         return 130  # SIGINT
 
 
-def _load_graphs(host, args):
-    old_graph = None
-    needs_rescan = True
-    if host.exists('.pyn.db'):
-        graph_str = host.read('.pyn.db')
-        old_graph = cPickle.loads(graph_str)
-
-        graph_mtime = host.mtime('.pyn.db')
-        file_mtime = host.mtime(args.file)
-        needs_rescan = (file_mtime > graph_mtime or
-                        any(host.mtime(f) > graph_mtime for
-                            f in old_graph.includes) or
-                        any(host.mtime(f) > graph_mtime for
-                            f in old_graph.subninjas))
-
-    if needs_rescan:
-        ast = parse(host.read(args.file), args.file)
-        analyzer = NinjaAnalyzer(host, args, parse, expand_vars)
-        graph = analyzer.analyze(ast, args.file)
-        graph.is_dirty = True
-    else:
-        graph = old_graph
-
-    return old_graph, graph
+def _run(host, args, graph, started_time):
+    if args.tool:
+        return run_tool(host, args, graph, started_time)
+
+    builder = Builder(host, args, expand_vars, started_time)
+    nodes_to_build = builder.find_nodes_to_build(graph)
+    if nodes_to_build:
+        return builder.build(graph, nodes_to_build)
+    host.print_out('pyn: no work to do.')
+    return 0
+
+
+def _load_graph(host, args):
+    # Only the files that have changed since they were last parsed
+    # need to be parsed again.
+    ast_cache = AstCache(host)
+    analyzer = NinjaAnalyzer(host, args, parse_iter, expand_vars, ast_cache)
+
+    with GraphCache(host) as cache:
+        if cache.load() and cache.name() == args.file:
+            graph = _load_cached_graph(host, args, cache, ast_cache,
+                                       analyzer)
+            if graph:
+                return graph
+
+    graph = analyzer.analyze(analyzer.parse_file(args.file), args.file)
+    ast_cache.prune()
+    graph.is_dirty = True
+    return graph
+
+
+def _load_cached_graph(host, args, cache, ast_cache, analyzer):
+    """Return the cached graph, updated if only subninjas have changed.
+
+    Returns None if the whole manifest needs to be analyzed again.
+    """
+    # A manifest has changed if its mtime is any different from when it
+    # was read (not just newer than the cache, which may have been
+    # rewritten after a build that regenerated the manifest).
+    mtimes = cache.manifest_mtimes()
+
+    def changed(path):
+        mtime = host.maybe_mtime(path)
+        return mtime is None or mtime != mtimes.get(path)
+
+    if any(changed(f) for f in [args.file] + cache.includes()):
+        return None
+
+    manifests = cache.subninja_manifests()
+    subninjas = cache.subninjas()
+    changed_subninjas = [s for s in subninjas
+                         if any(changed(f) for f in manifests.get(s, [s]))]
+    if not changed_subninjas:
+        return cache.graph()
+
+    # Only the subninjas that changed need to be analyzed again.
+    graph = analyzer.reanalyze(cache.graph(), changed_subninjas)
+    ast_cache.keep([args.file] + cache.includes() +
+                   [f for s in subninjas for f in manifests.get(s, [])])
+    ast_cache.prune()
+    graph.is_dirty = True
+    return graph
 
 
 if __name__ == '__main__':
@@ -19,6 +19,7 @@ import unittest
 # FIXME: make this work w/ python3
 from StringIO import StringIO
 
+from deps_log import DepsLog
 from host_fake import FakeHost
 from main import main, VERSION
 
@@ -45,10 +46,31 @@ def default_test_files():
     return in_files, out_files
 
 
+class LoadedHost(FakeHost):
+    """Records when each job starts and when it is waited on."""
+
+    def __init__(self, load_average):
+        super(LoadedHost, self).__init__()
+        self.load_average = load_average
+        self.jobs = []
+
+    def spawn(self, cmd_str, inline=False):
+        proc = super(LoadedHost, self).spawn(cmd_str, inline)
+        self.jobs.append('start')
+        wait = proc.wait
+
+        def recording_wait():
+            self.jobs.append('end')
+            return wait()
+
+        proc.wait = recording_wait
+        return proc
+
+
 class UnitTestMixin(object):
     def _files_to_ignore(self):
         # return ['.ninja_deps', '.ninja_log']
-        return ['.pyn.db']
+        return ['.pyn.db', '.pyn_asts.d', '.pyn_deps', '.pyn_log']
 
     def _host(self):
         return FakeHost()
@@ -79,14 +101,17 @@ class CheckMixin(object):
     def assert_files(self, expected_files, actual_files):
         for k, v in expected_files.items():
             self.assertEqual(expected_files[k], v)
-        interesting_files = set(actual_files.keys()).difference(
-            self._files_to_ignore())
+        # The AST cache is a directory of entries.
+        interesting_files = set(f for f in actual_files
+                                if f.split('/')[0] not in
+                                self._files_to_ignore())
         self.assertEqual(interesting_files, set(expected_files.keys()))
 
     def check(self, in_files, expected_out_files=None,
               expected_return_code=None, expected_out=None, expected_err=None,
-              args=None):
-        host = self._host()
+              args=None, host=None):
+        # 'too many arguments' pylint: disable=R0913
+        host = host or self._host()
         args = args or []
 
         try:
@@ -194,9 +219,7 @@ class TestBuild(unittest.TestCase, UnitTestMixin, CheckMixin):
             self.assert_files(out_files, self._read_files(host, tmpdir))
 
             returncode, _, _ = self._call(host, ['-t', 'question'])
-            # FIXME: make the fake host deal w/ mtimes properly.
-            # self.assertEqual(returncode, 0)
-            self.assertTrue(returncode in (0, 1))
+            self.assertEqual(returncode, 0)
 
             self.assert_files(out_files, self._read_files(host, tmpdir))
 
@@ -229,6 +252,11 @@ class TestBuild(unittest.TestCase, UnitTestMixin, CheckMixin):
         # Note that 'bar' is not executed.
         self.check(in_files, out_files)
 
+    def test_garbage_graph_cache(self):
+        in_files, out_files = default_test_files()
+        in_files['.pyn.db'] = 'not a graph'
+        self.check(in_files, out_files, expected_return_code=0)
+
     def test_multiple_rules_fails(self):
         in_files = {}
         in_files['build.ninja'] = textwrap.dedent("""
@@ -357,12 +385,228 @@ class TestBuild(unittest.TestCase, UnitTestMixin, CheckMixin):
         self.check(in_files, out_files)
 
     def test_command_line_changes(self):
-        # FIXME: write a test to check rebuild when command line changes.
-        pass
+        in_files, out_files = default_test_files()
+        host = self._host()
+        try:
+            orig_wd = host.getcwd()
+            tmpdir = host.mkdtemp()
+            host.chdir(tmpdir)
+            self._write_files(host, in_files)
+
+            returncode, _, _ = self._call(host, [])
+            self.assertEqual(returncode, 0)
+            self.assert_files(out_files, self._read_files(host, tmpdir))
+
+            returncode, _, _ = self._call(host, ['-t', 'question'])
+            self.assertEqual(returncode, 0)
+
+            host.write('build.ninja', in_files['build.ninja'] +
+                       'rule unused\n'
+                       '    command = true\n')
+            returncode, _, _ = self._call(host, ['-t', 'question'])
+            self.assertEqual(returncode, 0)
+
+            host.write('build.ninja',
+                       in_files['build.ninja'].replace('cat $in',
+                                                       'cat  $in'))
+            returncode, _, _ = self._call(host, ['-t', 'question'])
+            self.assertEqual(returncode, 1)
+        finally:
+            host.rmtree(tmpdir)
+            host.chdir(orig_wd)
+
+    def _build_twice(self, in_files, touched_file, new_contents=None):
+        """Build everything, touch a file, and return the next build's out.
+
+        If new_contents is given, the file is changed rather than touched.
+        """
+        host = self._host()
+        try:
+            orig_wd = host.getcwd()
+            tmpdir = host.mkdtemp()
+            host.chdir(tmpdir)
+            self._write_files(host, in_files)
+
+            returncode, _, _ = self._call(host, [])
+            self.assertEqual(returncode, 0)
+
+            host.write(touched_file, (new_contents or
+                                      in_files[touched_file]))
+            returncode, out, _ = self._call(host, [])
+            self.assertEqual(returncode, 0)
+
+            returncode, no_op_out, _ = self._call(host, [])
+            self.assertEqual(returncode, 0)
+            self.assertEqual(no_op_out, 'pyn: no work to do.\n')
+            return out
+        finally:
+            host.rmtree(tmpdir)
+            host.chdir(orig_wd)
 
     def test_target_out_of_date(self):
-        # FIXME: write a test where a target is out of date
-        pass
+        in_files, _ = default_test_files()
+
+        # Everything downstream of 'a' gets rebuilt in the same run.
+        self.assertEqual(self._build_twice(in_files, 'a'),
+                         '[1/2] cat a b > ab\n'
+                         '[2/2] cat ab cd > abcd\n')
+
+    def test_subninja_changes(self):
+        in_files = {
+            'build.ninja': ('rule cat\n'
+                            '  command = cat $in > $out\n'
+                            'subninja ab.ninja\n'
+                            'subninja cd.ninja\n'),
+            'ab.ninja': 'build ab: cat a b\n',
+            'cd.ninja': 'build cd: cat c d\n',
+            'a': 'a\n', 'b': 'b\n', 'c': 'c\n', 'd': 'd\n',
+        }
+        self.assertEqual(self._build_twice(in_files, 'cd.ninja',
+                                           'build cd: cat d c\n'),
+                         '[1/1] cat d c > cd\n')
+
+    def test_subninja_regenerated_during_build(self):
+        in_files = {
+            'build.ninja': ('rule cat\n'
+                            '  command = cat $in > $out\n'
+                            'build sub.ninja: cat sub.in\n'
+                            'subninja sub.ninja\n'),
+            'sub.ninja': 'build x: cat a\n',
+            'a': 'a\n', 'b': 'b\n',
+        }
+        host = self._host()
+        try:
+            orig_wd = host.getcwd()
+            tmpdir = host.mkdtemp()
+            host.chdir(tmpdir)
+            self._write_files(host, in_files)
+            host.write('sub.in', 'build x: cat b\n')
+
+            # The cache is written again after this build (to save the
+            # commands it expanded), after sub.ninja was regenerated ...
+            returncode, _, _ = self._call(host, [])
+            self.assertEqual(returncode, 0)
+            self.assertEqual(host.read('sub.ninja'), 'build x: cat b\n')
+
+            # ... but the new sub.ninja is still noticed.
+            _, out, _ = self._call(host, [])
+            self.assertEqual(out, '[1/1] cat b > x\n')
+        finally:
+            host.rmtree(tmpdir)
+            host.chdir(orig_wd)
+
+    def test_restat(self):
+        in_files = {}
+        in_files['build.ninja'] = textwrap.dedent("""
+            rule touch_if_changed
+                command = true
+                restat = 1
+            rule cat
+                command = cat $in > $out
+
+            build gen.h : touch_if_changed gen.in
+            build gen : phony gen.h
+            build foo : cat foo.in || gen
+            build bar : cat gen.h
+            """)
+        in_files['gen.in'] = ''
+        in_files['gen.h'] = 'gen.h\n'
+        in_files['foo.in'] = 'foo\n'
+
+        # gen.h is regenerated but doesn't change, so bar doesn't need
+        # to be rebuilt (and foo never did).
+        self.assertEqual(self._build_twice(in_files, 'gen.in'),
+                         '[1/2] true\n')
+
+    def test_pools(self):
+        in_files = {}
+        in_files['build.ninja'] = textwrap.dedent("""
+            pool link_pool
+                depth = 1
+            rule cat
+                command = cat $in > $out
+                pool = link_pool
+
+            build foo : cat foo.in
+            build bar : cat bar.in
+            """)
+        in_files['foo.in'] = 'foo\n'
+        in_files['bar.in'] = 'bar\n'
+        out_files = in_files.copy()
+        out_files['foo'] = 'foo\n'
+        out_files['bar'] = 'bar\n'
+        self.check(in_files, out_files, expected_return_code=0)
+
+    def test_equivalent_spellings(self):
+        in_files = {}
+        in_files['build.ninja'] = textwrap.dedent("""
+            rule cat
+                command = cat $in > $out
+
+            build out/ab : cat ./a b
+            build abc : cat out/x/../ab .//c
+            """)
+        in_files['a'] = 'a\n'
+        in_files['b'] = 'b\n'
+        in_files['c'] = 'c\n'
+        out_files = in_files.copy()
+        out_files['out/ab'] = 'a\nb\n'
+        out_files['abc'] = 'a\nb\nc\n'
+        self.check(in_files, out_files, expected_return_code=0,
+                   expected_out=('[1/2] cat a b > out/ab\n'
+                                 '[2/2] cat out/ab c > abc\n'))
+
+    def test_load_limit(self):
+        # However loaded the machine is, one job at a time still runs,
+        # but only one.
+        host = LoadedHost(load_average=10.0)
+        self.check_load_limit(host)
+        self.assertEqual(host.jobs, ['start', 'end', 'start', 'end'])
+
+        host = LoadedHost(load_average=0.5)
+        self.check_load_limit(host)
+        self.assertEqual(host.jobs, ['start', 'start', 'end', 'end'])
+
+    def check_load_limit(self, host=None):
+        in_files = {}
+        in_files['build.ninja'] = textwrap.dedent("""
+            rule cat
+                command = cat $in > $out
+
+            build foo : cat foo.in
+            build bar : cat bar.in
+            """)
+        in_files['foo.in'] = 'foo\n'
+        in_files['bar.in'] = 'bar\n'
+        out_files = in_files.copy()
+        out_files['foo'] = 'foo\n'
+        out_files['bar'] = 'bar\n'
+        self.check(in_files, out_files, expected_return_code=0,
+                   args=['-j', '2', '-l', '1'], host=host)
+
+    def test_console_pool(self):
+        in_files = {}
+        in_files['build.ninja'] = textwrap.dedent("""
+            rule say
+                command = echo hello
+                pool = console
+
+            build foo : say
+            """)
+        self.check(in_files, expected_return_code=0,
+                   expected_out='[1/1] echo hello\nhello\n')
+
+    def test_unknown_pool(self):
+        in_files = {}
+        in_files['build.ninja'] = textwrap.dedent("""
+            rule cat
+                command = cat $in > $out
+                pool = missing
+
+            build foo : cat foo.in
+            """)
+        in_files['foo.in'] = 'foo\n'
+        self.check(in_files, expected_return_code=1)
 
     def test_verbose(self):
         # FIXME: write a test for build w/ -v
@@ -373,8 +617,74 @@ class TestBuild(unittest.TestCase, UnitTestMixin, CheckMixin):
         pass
 
     def test_gcc_deps(self):
-        # FIXME: write a test for real gcc deps
-        pass
+        in_files = {}
+        in_files['build.ninja'] = textwrap.dedent("""
+            rule cc
+                command = echo $out: $in foo.h > $out.d
+                depfile = $out.d
+                deps = gcc
+
+            build foo.o : cc foo.c
+            """)
+        in_files['foo.c'] = ''
+        in_files['foo.h'] = ''
+        host = self._host()
+        try:
+            orig_wd = host.getcwd()
+            tmpdir = host.mkdtemp()
+            host.chdir(tmpdir)
+            self._write_files(host, in_files)
+
+            returncode, _, _ = self._call(host, [])
+            self.assertEqual(returncode, 0)
+
+            # The depfile should have been folded into the deps log.
+            self.assert_files(in_files, self._read_files(host, tmpdir))
+            returncode, out, _ = self._call(host, ['-t', 'deps', 'foo.o'])
+            self.assertEqual(returncode, 0)
+            self.assertEqual(out, ('foo.o: #deps 2\n'
+                                   '    foo.c\n'
+                                   '    foo.h\n'))
+        finally:
+            host.rmtree(tmpdir)
+            host.chdir(orig_wd)
+
+    def test_stale_deps_are_ignored(self):
+        in_files = {}
+        in_files['build.ninja'] = textwrap.dedent("""
+            rule cat
+                command = cat $in > $out
+                depfile = $out.d
+                deps = gcc
+
+            build foo.o : cat foo.c
+            """)
+        in_files['foo.c'] = 'foo\n'
+        in_files['foo.h'] = ''
+        host = self._host()
+        try:
+            orig_wd = host.getcwd()
+            tmpdir = host.mkdtemp()
+            host.chdir(tmpdir)
+            self._write_files(host, in_files)
+            self._call(host, [])
+            mtime = host.mtime('foo.o')
+
+            # Deps recorded for the current foo.o are used ...
+            deps_log = DepsLog(host)
+            deps_log.load()
+            deps_log.record('foo.o', mtime, ['foo.c', 'foo.h'])
+            _, out, _ = self._call(host, [])
+            self.assertEqual(out, 'pyn: no work to do.\n')
+
+            # ... but deps recorded for an older foo.o are not, and it
+            # is rebuilt to get new ones.
+            deps_log.record('foo.o', mtime - 1, ['foo.c', 'foo.h'])
+            _, out, _ = self._call(host, [])
+            self.assertEqual(out, '[1/1] cat foo.c > foo.o\n')
+        finally:
+            host.rmtree(tmpdir)
+            host.chdir(orig_wd)
 
     def test_ctrl_c(self):
         # FIXME: write a test to handle ctrl-c
@@ -416,7 +726,14 @@ class TestTools(unittest.TestCase, UnitTestMixin, CheckMixin):
         pass
 
     def test_clean_single_target(self):
-        pass
+        in_files, _ = default_test_files()
+        in_files['ab'] = 'hello world\n'
+        in_files['cd'] = 'how are you?\n'
+        out_files = in_files.copy()
+        del out_files['ab']
+        self.check(in_files, out_files, args=['-t', 'clean', './ab'],
+                   expected_return_code=0,
+                   expected_err='Cleaning... 1 files.\n')
 
     def test_commands(self):
         in_files, _ = default_test_files()
@@ -424,12 +741,16 @@ class TestTools(unittest.TestCase, UnitTestMixin, CheckMixin):
                    expected_out=('cat a b > ab\n'
                                  'cat c d > cd\n'
                                  'cat ab cd > abcd\n'))
+        self.check(in_files, args=['-t', 'commands', './ab'],
+                   expected_out='cat a b > ab\n')
 
     def test_deps(self):
         # FIXME: implement w/ real deps tests.
         in_files, _ = default_test_files()
         self.check(in_files, args=['-t', 'deps'],
                    expected_out='abcd: deps not found\n')
+        self.check(in_files, args=['-t', 'deps', 'x/../abcd'],
+                   expected_out='abcd: deps not found\n')
 
     def test_query(self):
         in_files, _ = default_test_files()
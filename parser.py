@@ -12,63 +12,87 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
+
 from pyn_exceptions import PynException
 
 
 def parse(msg, fname):
-    return NinjaParser(msg, fname).parse()
+    return FastNinjaParser(msg, fname).parse()
+
+
+def parse_iter(msg, fname):
+    """Like parse(), but returns a generator of the declarations."""
+    return FastNinjaParser(msg, fname).iter_parse()
+
+
+class _Expected(object):
+    """An error from expect().
+
+    Most of these are thrown away while trying the alternatives in a
+    rule, so the message is only formatted if one is actually reported.
+    """
+
+    __slots__ = ('substr', 'pos')
+
+    def __init__(self, substr, pos):
+        self.substr = substr
+        self.pos = pos
+
+    def __str__(self):
+        return 'expecting "%s" at %d' % (self.substr, self.pos)
 
 
 class NinjaParser(object):
-    """Parse the contents of a .ninja file and return an AST."""
+    """Parse the contents of a .ninja file and return an AST.
+
+    The contents can be a string or anything that slices like one and
+    has a find() method, like a memory-mapped file.
+    """
     def __init__(self, msg, fname):
         self.msg = msg
         self.end = len(msg)
         self.fname = fname
 
     def parse(self):
-        msg = self.msg
-        v, p, err = self.grammar_(0)
-        if err:
-            lineno = 1
-            colno = 1
-            i = 0
-            while i < p:
-                if msg[i] == '\n':
-                    lineno += 1
-                    colno = 1
-                else:
-                    colno += 1
-                i += 1
-
-            pos_str = '%s:%d:%d' % (self.fname, lineno, colno)
-            raise PynException("%s %s" % (pos_str, err))
-        else:
-            return v
+        return list(self.iter_parse())
+
+    def iter_parse(self):
+        """Yield each declaration as soon as it has been parsed.
+
+        A syntax error is raised when it is reached, so the declarations
+        before it will already have been returned.
+        """
+        for v, p, err in self.grammar_(0):
+            if err:
+                lineno = _count_newlines(self.msg, p) + 1
+                colno = p - self.msg.rfind('\n', 0, p)
+                pos_str = '%s:%d:%d' % (self.fname, lineno, colno)
+                raise PynException("%s %s" % (pos_str, err))
+            yield v
 
     def expect(self, start, substr):
         l = len(substr)
-        if (self.end - start) < l or self.msg[start:start + l] != substr:
-            return None, start, 'expecting "%s" at %d' % (substr, start)
+        if self.msg[start:start + l] != substr:
+            return None, start, _Expected(substr, start)
         return substr, start + l, None
 
     def grammar_(self, start):
-        """ ((empty_line* decl)*:ds empty_line*) end -> ds """
-        ds = []
-        err = None
+        """ ((empty_line* decl)*:ds empty_line*) end -> ds
+
+        This is a generator of (decl, p, err) tuples; it stops after the
+        first error.
+        """
         p = start
-        while not err and p < self.end:
+        while p < self.end:
+            err = None
             while not err and p < self.end:
                 _, p, err = self.empty_line_(p)
-            orig_p = p
             if p < self.end:
-                v, p, err = self.decl_(orig_p)
-                if not err:
-                    ds.append(v)
-        if not err:
-            return ds, p, err
-        else:
-            return None, p, err
+                v, p, err = self.decl_(p)
+                yield v, p, err
+                if err:
+                    return
 
     def decl_(self, start):
         """ build | rule | subninja | include | pool | default | var """
@@ -465,3 +489,132 @@ class NinjaParser(object):
             return '\n', p, None
         else:
             return None, p, None
+
+
+# How much of a file to copy at a time when counting its lines.
+_COUNT_CHUNK_SIZE = 1024 * 1024
+
+
+def _count_newlines(msg, end):
+    # mmaps have no count() method, so count a chunk at a time rather
+    # than copying everything before end.
+    return sum(msg[i:min(i + _COUNT_CHUNK_SIZE, end)].count('\n')
+               for i in range(0, end, _COUNT_CHUNK_SIZE))
+
+
+# The pieces of a declaration that FastNinjaParser recognizes directly.
+_NAME = r'[A-Za-z_][A-Za-z0-9_]*'
+_PATH = r'[^ :=|]+'
+_PATHS = r'%s(?: +%s)*' % (_PATH, _PATH)
+
+_DECLS = {
+    'build': re.compile(r'build +(%s) *: *(%s)((?: +%s)*)'
+                        r'(?: *\|(?!\|) *(%s))?(?: *\|\| *(%s))? *$' %
+                        (_PATHS, _NAME, _PATH, _PATHS, _PATHS)),
+    'rule': re.compile(r'rule +(%s) *$' % _NAME),
+    'pool': re.compile(r'pool +(%s) *$' % _NAME),
+    'subninja': re.compile(r'subninja +(%s) *$' % _PATH),
+    'include': re.compile(r'include +(%s) *$' % _PATH),
+    'default': re.compile(r'default +(%s) *$' % _PATHS),
+}
+_VAR = re.compile(r'(%s) *= *(.*)$' % _NAME)
+_INDENTED_VAR = re.compile(r' +(%s) *= *(.*)$' % _NAME)
+
+
+def _split_paths(paths):
+    if not paths:
+        return []
+    paths = paths.split(' ')
+    if '' in paths:
+        return [p for p in paths if p]
+    return paths
+
+
+class FastNinjaParser(NinjaParser):
+    """A NinjaParser that handles most lines with a regular expression.
+
+    NinjaParser tries each kind of declaration in turn at each offset,
+    looking at one character at a time. Most lines in real .ninja files
+    are simple, though, so this parser looks at the keyword a line
+    starts with, and matches the whole line with a regex for that kind
+    of declaration.
+
+    The regexes only accept a subset of the grammar that parses the
+    same way in both parsers: in particular, lines with '$ ' escapes or
+    '$\\n' continuations, and anything that would be an error, don't
+    match. Such lines fall back to NinjaParser at the same offset, so
+    the AST (and any error) is always the same as NinjaParser's.
+    """
+
+    def decl_(self, start):
+        line, line_end = self._line(start)
+        if line is not None:
+            i = line.find(' ')
+            keyword = line[:i] if i >= 0 else line
+            if keyword in _DECLS:
+                m = _DECLS[keyword].match(line)
+            else:
+                keyword = 'var'
+                m = _VAR.match(line)
+            if m:
+                return self._decl(keyword, m, line_end)
+        return NinjaParser.decl_(self, start)
+
+    def _decl(self, keyword, m, p):
+        if keyword == 'build':
+            vs, p, _ = self.ws_vars_(p)
+            return ['build', _split_paths(m.group(1)), m.group(2),
+                    _split_paths(m.group(3)), _split_paths(m.group(4)),
+                    _split_paths(m.group(5)), vs], p, None
+        if keyword in ('rule', 'pool'):
+            vs, p, _ = self.ws_vars_(p)
+            return [keyword, m.group(1), vs], p, None
+        if keyword == 'default':
+            return ['default', _split_paths(m.group(1))], p, None
+        if keyword == 'var':
+            return ['var', m.group(1), m.group(2)], p, None
+        return [keyword, m.group(1)], p, None
+
+    def ws_vars_(self, start):
+        """ (ws var)*:vs -> vs """
+        msg, p, end = self.msg, start, self.end
+        vs = []
+        while p < end and msg[p] == ' ':
+            line, line_end = self._line(p)
+            m = line is not None and _INDENTED_VAR.match(line)
+            if not m:
+                more_vs, p, _ = NinjaParser.ws_vars_(self, p)
+                return vs + more_vs, p, None
+            vs.append(['var', m.group(1), m.group(2)])
+            p = line_end
+        if p < end and msg[p] == '$':
+            more_vs, p, _ = NinjaParser.ws_vars_(self, p)
+            vs.extend(more_vs)
+        return vs, p, None
+
+    def comment_(self, start):
+        """ '#' (~'\n' anything)* ('\n'|end) """
+        msg, end = self.msg, self.end
+        if msg[start] != '#':
+            return None, start, "expecting a '#'"
+        p = msg.find('\n', start)
+        if p == -1:
+            return None, end, None
+        return '\n', p, None
+
+    def _line(self, start):
+        """Return the line at start and the offset of the next line.
+
+        The line is None if it has any escapes that the regexes don't
+        handle.
+        """
+        line_end = self.msg.find('\n', start)
+        if line_end == -1:
+            line_end = self.end
+            next_line = self.end
+        else:
+            next_line = line_end + 1
+        line = self.msg[start:line_end]
+        if '$ ' in line or line.endswith('$'):
+            return None, next_line
+        return line, next_line
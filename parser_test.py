@@ -12,26 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import mmap
+import os
+import tempfile
 import textwrap
 import unittest
 
-from parser import parse
+import parser
+from parser import FastNinjaParser, NinjaParser, parse, parse_iter
 from pyn_exceptions import PynException
 
 
 class TestNinjaParser(unittest.TestCase):
     # unused argument 'files'  pylint:disable=W0613
+    def parse(self, text, fname):
+        return parse(text, fname)
+
     def check(self, text, ast, dedent=True, files=None):
         if dedent:
             dedented_text = textwrap.dedent(text)
-            actual_ast = parse(dedented_text, 'build.ninja')
+            actual_ast = self.parse(dedented_text, 'build.ninja')
         else:
-            actual_ast = parse(text, 'build.ninja')
+            actual_ast = self.parse(text, 'build.ninja')
         self.assertEqual(actual_ast, ast)
 
     def err(self, text, files=None):
         dedented_text = textwrap.dedent(text)
-        self.assertRaises(PynException, parse, dedented_text,
+        self.assertRaises(PynException, self.parse, dedented_text,
                           'build.ninja')
 
     # pylint:enable=W0613
@@ -193,9 +200,165 @@ class TestNinjaParser(unittest.TestCase):
         self.check('build foo.o: cc foo.c $\n\n',
                    [['build', ['foo.o'], 'cc', ['foo.c'], [], [], []]])
 
+    def test_error_positions(self):
+        for text, expected in (
+                ('syntaxerror', 'build.ninja:1:12 '),
+                ('foo = 4\nsyntaxerror', 'build.ninja:2:12 '),
+                ('foo = 4\n\n  build :\n', 'build.ninja:3:9 '),
+                ('rule cc\n  command = cc\nrule', 'build.ninja:3:5 '),
+                ):
+            try:
+                self.parse(text, 'build.ninja')
+                self.fail('parse() should have raised an exception')
+            except PynException as e:
+                self.assertTrue(str(e).startswith(expected),
+                                '%s does not start with %s' % (str(e),
+                                                               expected))
+
     def test_var_errs(self):
         # not a legal var name
         self.err('123')
 
         # no equals sign
         self.err('foo ')
+
+
+class TestSlowNinjaParser(TestNinjaParser):
+    def parse(self, text, fname):
+        return NinjaParser(text, fname).parse()
+
+
+class TestFastNinjaParser(unittest.TestCase):
+    """Check that FastNinjaParser always agrees with NinjaParser."""
+
+    def check(self, text):
+        def result(parser_cls):
+            try:
+                return parser_cls(text, 'build.ninja').parse()
+            except PynException as e:
+                return str(e)
+        self.assertEqual(result(FastNinjaParser), result(NinjaParser))
+
+    def test_lines(self):
+        for text in (
+                'build foo.o: cc foo.c',
+                'build  foo.o  bar.o  :  cc  foo.c  bar.c  ',
+                'build a: cc b|c||d',
+                'build a: cc b | c || d',
+                'build a: cc | c',
+                'build a: cc || d',
+                'build a: cc b | | c',
+                'build a: cc b ||| c',
+                'build a: cc b:c',
+                'build a: cc.o b',
+                'build a: cc b=c',
+                'build a: 1cc b',
+                'build a\tb: cc c\td\r',
+                'build $builddir/a: cc $in$$ b$:c',
+                'build a$ b: cc c',
+                'build a: cc b $\n    c',
+                'build a $\n  : cc b',
+                'build = foo',
+                'build',
+                'buildx = 1',
+                'build_dir=foo',
+                'rule cc',
+                'rule cc  ',
+                'rule cc x',
+                'rule 1cc',
+                'rules = foo',
+                'rule = foo',
+                'pool link',
+                'pool = 3',
+                'subninja foo.ninja',
+                'subninja foo$ bar.ninja',
+                'subninja a b',
+                'include foo.ninja  ',
+                'include =foo',
+                'default a b  c',
+                'default = a',
+                'default_x = 1',
+                'foo = bar',
+                'foo=bar  ',
+                'foo =',
+                'foo = # not a comment',
+                'foo = a$ b',
+                'foo = a$',
+                'foo bar = baz',
+                'foo',
+                '  foo = bar',
+                '# comment',
+                '#',
+                'x = 1\n# comment\ny = 2',
+                ):
+            self.check(text)
+            self.check(text + '\n')
+
+    def test_indented_vars(self):
+        for text in (
+                'rule cc\n  command = cc $in\n  deps = gcc\n',
+                'rule cc\n  command = cc $\n    $in\n  deps = gcc\n',
+                'rule cc\n  command = a$ b\n  deps = gcc\n',
+                'rule cc\n  command = cc\n  # comment\n  deps = gcc\n',
+                'rule cc\n  command = cc\n\n  deps = gcc\n',
+                'rule cc\n  command = cc\n  bogus\n',
+                'rule cc\n  command = cc\n$\n  deps = gcc\n',
+                'rule cc\n  command = cc\n  \n',
+                'pool link\n  depth = 4\nbuild a: cc b\n  x = y',
+                'build a: cc b\n  cflags = -O2\nfoo = bar\n',
+                ):
+            self.check(text)
+
+
+class TestParseIter(unittest.TestCase):
+    def test_decls_are_returned_before_errors(self):
+        decls = parse_iter('foo = bar\nsyntaxerror\n', 'build.ninja')
+        self.assertEqual(next(decls), ['var', 'foo', 'bar'])
+        self.assertRaises(PynException, next, decls)
+
+    def test_mmap(self):
+        text = textwrap.dedent("""
+            rule cc
+              command = cc $in $
+                  -o $out
+            build foo.o: cc foo.c | foo.h
+            default foo.o
+            """)
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, text)
+            buf = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            self.assertEqual(list(parse_iter(buf, path)),
+                             parse(text, path))
+            self.assertEqual(NinjaParser(buf, path).parse(),
+                             parse(text, path))
+            buf.close()
+        finally:
+            os.close(fd)
+            os.remove(path)
+
+    def test_mmap_errors(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, 'foo = bar\n  syntaxerror\n')
+            buf = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            try:
+                parse(buf, 'build.ninja')
+                self.fail('parse() should have raised an exception')
+            except PynException as e:
+                self.assertTrue(str(e).startswith('build.ninja:2:14 '))
+            buf.close()
+        finally:
+            os.close(fd)
+            os.remove(path)
+
+    def test_error_lines_are_counted_in_chunks(self):
+        orig_chunk_size = parser._COUNT_CHUNK_SIZE  # pylint: disable=W0212
+        try:
+            parser._COUNT_CHUNK_SIZE = 4  # pylint: disable=W0212
+            parse('a = 1\nb = 22\n\nsyntaxerror', 'build.ninja')
+            self.fail('parse() should have raised an exception')
+        except PynException as e:
+            self.assertTrue(str(e).startswith('build.ninja:4:12 '))
+        finally:
+            parser._COUNT_CHUNK_SIZE = orig_chunk_size  # pylint: disable=W0212
@@ -0,0 +1,101 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import re
+
+
+# Matches a '.' or '..' component, an empty component, or a trailing '/'.
+_NEEDS_CANONICALIZING = re.compile(r'(^|/)\.\.?(/|$)|//|./$')
+
+
+def canonicalize_path(path):
+    """Return path with '.' and 'x/..' components and repeated '/'s removed.
+
+    Like ninja, this is purely lexical: it doesn't look at the file
+    system, so 'x/..' is removed even if x is a symlink. Leading '..'s
+    in a relative path are kept.
+    """
+    if not _NEEDS_CANONICALIZING.search(path):
+        return path
+
+    is_absolute = path.startswith('/')
+    comps = []
+    for comp in path.split('/'):
+        if comp == '' or comp == '.':
+            continue
+        if comp == '..':
+            if comps and comps[-1] != '..':
+                comps.pop()
+                continue
+            if is_absolute:
+                continue
+        comps.append(comp)
+    canonical_path = '/'.join(comps)
+    if is_absolute:
+        return '/' + canonical_path
+    return canonical_path or '.'
+
+
+class PathTable(object):
+    """Give each distinct path one shared string.
+
+    Paths are canonicalized first (see canonicalize_path()), so every
+    spelling of a path that goes through intern() comes back as the
+    same string object, so a graph holds one copy of each path no
+    matter how many nodes refer to it. Python strings cache their hash,
+    and dict lookups with the same object short-circuit on identity, so
+    looking up interned paths in the graph, the stat cache, and so on
+    never rehashes or compares them character by character.
+
+    If the paths given to the constructor are known to be canonical
+    already (e.g., they come from a saved graph), pass canonical=True
+    to skip checking them again.
+    """
+
+    def __init__(self, paths=None, canonical=False):
+        self.paths = []
+        self._canonical = {}
+        if canonical:
+            for path in paths:
+                if path not in self._canonical:
+                    self._canonical[path] = path
+                    self.paths.append(path)
+        else:
+            for path in paths or []:
+                self.intern(path)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self._canonical
+
+    def intern(self, path):
+        """Return the shared, canonical copy of path, adding it if new."""
+        shared_path = self._canonical.get(path)
+        if shared_path is None:
+            canonical_path = canonicalize_path(path)
+            shared_path = self._canonical.get(canonical_path)
+            if shared_path is None:
+                shared_path = canonical_path
+                self._canonical[canonical_path] = canonical_path
+                self.paths.append(canonical_path)
+
+            # Remember this spelling, so that we only canonicalize it once.
+            self._canonical[path] = shared_path
+        return shared_path
+
+    def intern_all(self, paths):
+        return [self.intern(p) for p in paths]
@@ -0,0 +1,80 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from path_table import PathTable, canonicalize_path
+
+
+class TestCanonicalizePath(unittest.TestCase):
+    def check(self, path, expected):
+        self.assertEqual(canonicalize_path(path), expected)
+
+    def test_unchanged(self):
+        self.check('foo.o', 'foo.o')
+        self.check('out/obj/foo.o', 'out/obj/foo.o')
+        self.check('out/.hidden/foo..o', 'out/.hidden/foo..o')
+        self.check('/usr/include/stdio.h', '/usr/include/stdio.h')
+        self.check('../src/foo.c', '../src/foo.c')
+        self.check('.', '.')
+        self.check('/', '/')
+        self.check('', '')
+
+    def test_dots_and_slashes(self):
+        self.check('./out/a.o', 'out/a.o')
+        self.check('out//a.o', 'out/a.o')
+        self.check('out/./a.o', 'out/a.o')
+        self.check('out/x/../a.o', 'out/a.o')
+        self.check('out/x/y/../../a.o', 'out/a.o')
+        self.check('out/', 'out')
+        self.check('out/.', 'out')
+        self.check('out/..', '.')
+        self.check('./', '.')
+
+    def test_parent_dirs(self):
+        self.check('../../a.o', '../../a.o')
+        self.check('x/../../a.o', '../a.o')
+        self.check('./../x/../a.o', '../a.o')
+        self.check('/../a.o', '/a.o')
+        self.check('/x/../a.o', '/a.o')
+
+
+class TestPathTable(unittest.TestCase):
+    def test_intern(self):
+        table = PathTable()
+        foo = table.intern(''.join(['out/', 'foo.o']))
+        self.assertEqual(foo, 'out/foo.o')
+        self.assertTrue(table.intern(''.join(['out/', 'foo.o'])) is foo)
+        self.assertEqual(len(table), 1)
+        self.assertTrue('out/foo.o' in table)
+        self.assertFalse('out/bar.o' in table)
+
+    def test_intern_all(self):
+        table = PathTable(['a', 'b'])
+        self.assertEqual(table.intern_all(['c', './a']), ['c', 'a'])
+        self.assertEqual(table.paths, ['a', 'b', 'c'])
+
+    def test_canonical(self):
+        a = ''.join(['out/', 'a.o'])
+        table = PathTable([a, 'b', a], canonical=True)
+        self.assertEqual(table.paths, ['out/a.o', 'b'])
+        self.assertTrue(table.intern('./out/a.o') is a)
+
+    def test_spellings(self):
+        table = PathTable()
+        a = table.intern('out/a.o')
+        self.assertTrue(table.intern('./out/a.o') is a)
+        self.assertTrue(table.intern('out//a.o') is a)
+        self.assertTrue(table.intern('out/x/../a.o') is a)
+        self.assertEqual(table.paths, ['out/a.o'])
@@ -12,6 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import errno
+import os
+import select
 import threading
 import Queue
 
@@ -55,3 +59,172 @@ def _loop(callback, requests, responses):
             break
         resp = callback(args)
         responses.put(resp)
+
+
+class ProcessPool(object):
+    """Runs commands in child processes, all from the calling thread.
+
+    This has the same interface as Pool, but rather than handing each
+    command to a thread that blocks until it finishes, it starts the
+    commands itself with host.spawn() and then waits on the output of
+    all of them at once with poll(), so that running lots of short
+    commands doesn't mean lots of threads contending for the GIL.
+
+    Requests are (name, desc, command, dry_run, console) tuples.
+    Responses are (name, desc, command, returncode, out, err, start,
+    end) tuples, where start and end are in milliseconds since
+    started_time.
+    """
+
+    # How often to check on console jobs, which we have no pipes for.
+    CONSOLE_POLL_INTERVAL = 0.05
+
+    def __init__(self, host, num_processes, started_time):
+        self.host = host
+        self.num_processes = num_processes
+        self.started_time = started_time
+        self.requests = collections.deque()
+        self.responses = collections.deque()
+        self.jobs = []
+        self._readers = {}
+        self._poller = _Poller()
+
+    def send(self, msg):
+        self.requests.append(msg)
+        self._start_jobs()
+
+    def get(self, block=True, timeout=None):
+        if timeout is not None:
+            deadline = self.host.time() + timeout
+        while not self.responses:
+            self._start_jobs()
+            if not self.jobs:
+                break
+            if not block:
+                wait = 0
+            elif timeout is not None:
+                wait = max(deadline - self.host.time(), 0)
+            else:
+                wait = None
+            self._wait(wait)
+            if not block or (timeout is not None and
+                             self.host.time() >= deadline):
+                break
+        if not self.responses:
+            raise Empty
+        return self.responses.popleft()
+
+    def close(self):
+        # There are no worker threads to stop.
+        pass
+
+    def join(self):
+        """Wait for every command that was sent to finish."""
+        while self.requests or self.jobs:
+            try:
+                self.get(block=True)
+            except Empty:
+                break
+        self.responses.clear()
+
+    def _now(self):
+        return int((self.host.time() - self.started_time) * 1000)
+
+    def _start_jobs(self):
+        while self.requests and len(self.jobs) < self.num_processes:
+            name, desc, command, dry_run, console = self.requests.popleft()
+            start = self._now()
+            if dry_run:
+                self.responses.append((name, desc, command, 0, '', '',
+                                       start, start))
+                continue
+            job = _Job(name, desc, command, start,
+                       self.host.spawn(command, inline=console))
+            for f, chunks in ((job.proc.stdout, job.out),
+                              (job.proc.stderr, job.err)):
+                if f:
+                    self._readers[f.fileno()] = (job, f, chunks)
+                    self._poller.register(f.fileno())
+                    job.num_open += 1
+            self.jobs.append(job)
+
+    def _wait(self, timeout):
+        if len(self._readers) < 2 * len(self.jobs):
+            # Some of the jobs are in the console pool, and we'll only
+            # find out that they're done by asking.
+            if timeout is None or timeout > self.CONSOLE_POLL_INTERVAL:
+                timeout = self.CONSOLE_POLL_INTERVAL
+        for fd in self._poller.poll(timeout):
+            job, f, chunks = self._readers[fd]
+            data = os.read(fd, 65536)
+            if data:
+                chunks.append(data)
+            else:
+                self._poller.unregister(fd)
+                del self._readers[fd]
+                f.close()
+                job.num_open -= 1
+
+        for job in self.jobs[:]:
+            if job.proc.stdout or job.proc.stderr:
+                if job.num_open:
+                    continue
+                # The child has closed its end of the pipes, so it
+                # should be exiting, if it hasn't already.
+                ret = job.proc.wait()
+            else:
+                ret = job.proc.poll()
+                if ret is None:
+                    continue
+            self.jobs.remove(job)
+            self.responses.append((job.name, job.desc, job.command, ret,
+                                   ''.join(job.out), ''.join(job.err),
+                                   job.start, self._now()))
+
+
+class _Job(object):
+    # "too few public methods" pylint: disable=R0903
+
+    def __init__(self, name, desc, command, start, proc):
+        self.name = name
+        self.desc = desc
+        self.command = command
+        self.start = start
+        self.proc = proc
+        self.out = []
+        self.err = []
+        self.num_open = 0
+
+
+class _Poller(object):
+    """Wait for any of a set of file descriptors to be readable.
+
+    This uses poll() where we have it, since select() can't handle
+    descriptors past FD_SETSIZE, and select() elsewhere.
+    """
+
+    def __init__(self):
+        self.fds = set()
+        self._poll = select.poll() if hasattr(select, 'poll') else None
+
+    def register(self, fd):
+        self.fds.add(fd)
+        if self._poll:
+            self._poll.register(fd, select.POLLIN | select.POLLPRI)
+
+    def unregister(self, fd):
+        self.fds.remove(fd)
+        if self._poll:
+            self._poll.unregister(fd)
+
+    def poll(self, timeout):
+        """Return the readable fds; timeout is in seconds, or None."""
+        try:
+            if self._poll:
+                return [fd for fd, _ in self._poll.poll(
+                    None if timeout is None else timeout * 1000)]
+            return select.select(list(self.fds), [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
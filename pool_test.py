@@ -0,0 +1,97 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from host import Host
+from host_fake import FakeHost
+from pool import ProcessPool, Empty
+
+
+class TestProcessPool(unittest.TestCase):
+    def host(self):
+        return FakeHost()
+
+    def run_all(self, requests, num_processes=4):
+        pool = ProcessPool(self.host(), num_processes, 0)
+        for r in requests:
+            pool.send(r)
+        responses = {}
+        for _ in requests:
+            resp = pool.get(block=True)
+            responses[resp[0]] = resp[3:6]
+        pool.close()
+        pool.join()
+        return responses
+
+    def test_output_and_returncodes(self):
+        responses = self.run_all([
+            ('a', 'A', 'echo hello', False, False),
+            ('b', 'B', 'false', False, False),
+            ('c', 'C', 'true', False, False),
+        ])
+        self.assertEqual(responses['a'], (0, 'hello\n', ''))
+        self.assertNotEqual(responses['b'][0], 0)
+        self.assertEqual(responses['c'], (0, '', ''))
+
+    def test_dry_run(self):
+        host = self.host()
+        pool = ProcessPool(host, 1, 0)
+        pool.send(('a', 'A', 'false', True, False))
+        self.assertEqual(pool.get(block=False)[3:6], (0, '', ''))
+
+    def test_more_requests_than_processes(self):
+        requests = [('n%d' % i, '', 'echo %d' % i, False, False)
+                    for i in range(20)]
+        responses = self.run_all(requests, num_processes=3)
+        self.assertEqual(sorted(responses), sorted(r[0] for r in requests))
+        for i in range(20):
+            self.assertEqual(responses['n%d' % i], (0, '%d\n' % i, ''))
+
+    def test_nothing_to_get(self):
+        pool = ProcessPool(self.host(), 1, 0)
+        self.assertRaises(Empty, pool.get, block=False)
+        self.assertRaises(Empty, pool.get, block=True)
+
+
+class TestProcessPoolWithRealHost(TestProcessPool):
+    def host(self):
+        return Host()
+
+    def test_stderr(self):
+        responses = self.run_all([
+            ('a', 'A', 'echo out; echo err >&2; exit 3', False, False),
+        ])
+        self.assertEqual(responses['a'], (3, 'out\n', 'err\n'))
+
+    def test_lots_of_output(self):
+        # Much more than fits in a pipe's buffer, on both pipes at once.
+        responses = self.run_all([
+            ('a', 'A', 'seq 100000; seq 100000 >&2', False, False),
+        ])
+        expected = ''.join('%d\n' % i for i in range(1, 100001))
+        self.assertEqual(responses['a'], (0, expected, expected))
+
+    def test_console(self):
+        responses = self.run_all([('a', 'A', 'true', False, True),
+                                  ('b', 'B', 'false', False, True)])
+        self.assertEqual(responses['a'], (0, '', ''))
+        self.assertNotEqual(responses['b'][0], 0)
+
+    def test_get_does_not_wait_unless_asked(self):
+        pool = ProcessPool(self.host(), 1, 0)
+        pool.send(('a', 'A', 'sleep 0.2', False, False))
+        self.assertRaises(Empty, pool.get, block=False)
+        self.assertRaises(Empty, pool.get, block=True, timeout=0.01)
+        self.assertEqual(pool.get(block=True)[0], 'a')
@@ -0,0 +1,206 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+
+
+# Relative cost of a command we have no recorded duration for.
+DEFAULT_DURATION = 1.0
+
+
+class Scheduler(object):
+    """Hand out nodes to build once all of their inputs have been built.
+
+    Each node to build keeps a count of the inputs it is still waiting
+    on, and each node keeps a list of the nodes waiting on it. When a
+    node finishes, we decrement its consumers' counts, and any consumer
+    that drops to zero is added to the ready queue. Each edge is thus
+    touched once when the scheduler is created and once when its input
+    finishes, and finished work is never rescanned.
+
+    Ready nodes come out longest-critical-path first: each node is
+    weighted by its own expected duration plus the heaviest chain of
+    consumers downstream of it, so that long serial tails (e.g., links)
+    get started as early as possible. Ties are broken by the order of
+    nodes_to_build.
+
+    Nodes may also be assigned to pools, which limit how many of the
+    pool's nodes can be handed out at once. A ready node whose pool is
+    full waits in the pool's own queue (in the same order), and is moved
+    to the ready queue when one of the pool's nodes finishes. Nodes not
+    in a pool, or in a pool with a depth of 0, are never held back.
+    """
+
+    def __init__(self, graph, nodes_to_build, durations=None, pools=None,
+                 node_pools=None):
+        # 'too many arguments' pylint: disable=R0913
+        self.graph = graph
+        self._pending = {}
+        self._consumers = {}
+        self._ready = []
+        self._pool_depths = pools or {}
+        self._node_pools = node_pools or {}
+        self._pool_queues = dict((p, []) for p in self._pool_depths)
+        self._pool_in_use = dict((p, 0) for p in self._pool_depths)
+        self._order = {}
+        self.weights = {}
+
+        # Nodes with multiple outputs show up once per output in
+        # nodes_to_build; we only want to build them once, so the
+        # first output we see stands in for the node.
+        keys = {}
+        for node_name in nodes_to_build:
+            n = graph.nodes[node_name]
+            if n.name not in keys:
+                keys[n.name] = node_name
+                self._pending[node_name] = 0
+                self._consumers[node_name] = []
+
+        for node_name in self._pending:
+            consumers = self._consumers_of(keys, node_name)
+            self._consumers[node_name] = consumers
+            for c in consumers:
+                self._pending[c] += 1
+
+        for node_name in nodes_to_build:
+            if node_name in self._pending and node_name not in self._order:
+                self._order[node_name] = len(self._order)
+
+        self._compute_weights(durations or {})
+
+        for node_name in nodes_to_build:
+            if self._pending.get(node_name) == 0:
+                self._push(node_name)
+
+        self.remaining = len(self._pending)
+
+    def _consumers_of(self, keys, node_name):
+        """Return the nodes being built that wait for node_name.
+
+        Phony nodes aren't built themselves, so we look through them to
+        their consumers.
+        """
+        graph = self.graph
+        consumers = set()
+        visited = set()
+        to_visit = list(graph.nodes[node_name].outputs)
+        while to_visit:
+            path = to_visit.pop()
+            for c in graph.consumers(path, include_order_only=True):
+                if c in visited:
+                    continue
+                visited.add(c)
+                n = graph.nodes[c]
+                if n.name in keys:
+                    consumers.add(keys[n.name])
+                elif n.rule_name == 'phony':
+                    to_visit.extend(n.outputs)
+        consumers.discard(node_name)
+        return sorted(consumers)
+
+    def _compute_weights(self, durations):
+        estimates = _rule_estimates(self.graph, self._pending, durations)
+
+        # Walk the nodes consumers-first, so that every node's consumers
+        # have been weighted by the time we get to the node itself.
+        unweighted = dict((node_name, len(consumers))
+                          for node_name, consumers in self._consumers.items())
+        inputs = dict((node_name, []) for node_name in self._pending)
+        for node_name, consumers in self._consumers.items():
+            for c in consumers:
+                inputs[c].append(node_name)
+
+        to_visit = [node_name for node_name, count in unweighted.items()
+                    if not count]
+        while to_visit:
+            node_name = to_visit.pop()
+            n = self.graph.nodes[node_name]
+            duration = durations.get(node_name)
+            if duration is None:
+                duration = estimates[n.rule_name]
+            self.weights[node_name] = duration + max(
+                [self.weights[c] for c in self._consumers[node_name]] or [0])
+            for i in inputs[node_name]:
+                unweighted[i] -= 1
+                if not unweighted[i]:
+                    to_visit.append(i)
+
+    def _push(self, node_name):
+        entry = (-self.weights[node_name], self._order[node_name], node_name)
+        pool = self._node_pools.get(node_name)
+        if pool and self._pool_depths[pool]:
+            heapq.heappush(self._pool_queues[pool], entry)
+            self._fill_from_pool(pool)
+        else:
+            heapq.heappush(self._ready, entry)
+
+    def _fill_from_pool(self, pool):
+        queue = self._pool_queues[pool]
+        while queue and self._pool_in_use[pool] < self._pool_depths[pool]:
+            self._pool_in_use[pool] += 1
+            heapq.heappush(self._ready, heapq.heappop(queue))
+
+    def _release(self, node_name):
+        pool = self._node_pools.get(node_name)
+        if pool and self._pool_depths[pool]:
+            self._pool_in_use[pool] -= 1
+            self._fill_from_pool(pool)
+
+    def has_ready(self):
+        return bool(self._ready)
+
+    def next(self):
+        """Return the next node that is ready to build, or None."""
+        if self._ready:
+            return heapq.heappop(self._ready)[2]
+        return None
+
+    def mark_done(self, node_name):
+        """Record that node_name finished, readying its consumers."""
+        self.remaining -= 1
+        self._release(node_name)
+        for c in self._consumers[node_name]:
+            self._pending[c] -= 1
+            if not self._pending[c]:
+                self._push(c)
+
+    def mark_failed(self, node_name):
+        """Record that node_name failed; its consumers will never be ready."""
+        self._release(node_name)
+
+
+def _rule_estimates(graph, node_names, durations):
+    """Return the expected duration of a command for each rule.
+
+    This is the mean of the recorded durations of the rule's other
+    commands, or DEFAULT_DURATION if none of them have been recorded.
+    Phony rules don't run anything and are free.
+    """
+    totals = {}
+    for node_name in node_names:
+        rule_name = graph.nodes[node_name].rule_name
+        count, total = totals.get(rule_name, (0, 0.0))
+        if node_name in durations:
+            count, total = count + 1, total + durations[node_name]
+        totals[rule_name] = (count, total)
+
+    estimates = {}
+    for rule_name, (count, total) in totals.items():
+        if rule_name == 'phony':
+            estimates[rule_name] = 0.0
+        elif count:
+            estimates[rule_name] = total / count
+        else:
+            estimates[rule_name] = DEFAULT_DURATION
+    return estimates
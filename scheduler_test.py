@@ -0,0 +1,188 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from build_graph import Graph, Node
+from scheduler import Scheduler
+
+
+def _graph(*nodes):
+    g = Graph('build.ninja')
+    for n in nodes:
+        for o in n.outputs:
+            g.nodes[o] = n
+    return g
+
+
+class TestScheduler(unittest.TestCase):
+    def test_chain(self):
+        g = _graph(Node('foo.o', None, ['foo.o'], 'cc', ['foo.c']),
+                   Node('foo', None, ['foo'], 'link', ['foo.o']))
+        s = Scheduler(g, ['foo.o', 'foo'])
+        self.assertEqual(s.remaining, 2)
+        self.assertEqual(s.next(), 'foo.o')
+        self.assertEqual(s.next(), None)
+        s.mark_done('foo.o')
+        self.assertEqual(s.next(), 'foo')
+        s.mark_done('foo')
+        self.assertEqual(s.remaining, 0)
+        self.assertFalse(s.has_ready())
+
+    def test_waits_for_all_inputs(self):
+        g = _graph(Node('a.o', None, ['a.o'], 'cc', ['a.c']),
+                   Node('b.o', None, ['b.o'], 'cc', ['b.c']),
+                   Node('gen.h', None, ['gen.h'], 'gen'),
+                   Node('foo', None, ['foo'], 'link', ['a.o', 'b.o'],
+                        order_only_deps=['gen.h']))
+        s = Scheduler(g, ['a.o', 'b.o', 'gen.h', 'foo'])
+        self.assertEqual([s.next(), s.next(), s.next()],
+                         ['a.o', 'b.o', 'gen.h'])
+        s.mark_done('b.o')
+        s.mark_done('a.o')
+        self.assertFalse(s.has_ready())
+        s.mark_done('gen.h')
+        self.assertEqual(s.next(), 'foo')
+
+    def test_inputs_not_being_built_are_ignored(self):
+        g = _graph(Node('foo.o', None, ['foo.o'], 'cc', ['foo.c']),
+                   Node('foo', None, ['foo'], 'link', ['foo.o']))
+        s = Scheduler(g, ['foo'])
+        self.assertEqual(s.next(), 'foo')
+
+    def test_multiple_outputs_are_built_once(self):
+        g = _graph(Node('foo.h foo.cc', None, ['foo.h', 'foo.cc'], 'gen',
+                        ['foo.idl']),
+                   Node('foo.o', None, ['foo.o'], 'cc', ['foo.cc', 'foo.h']))
+        s = Scheduler(g, ['foo.h', 'foo.cc', 'foo.o'])
+        self.assertEqual(s.remaining, 2)
+        self.assertEqual(s.next(), 'foo.h')
+        self.assertEqual(s.next(), None)
+        s.mark_done('foo.h')
+        self.assertEqual(s.next(), 'foo.o')
+
+    def test_critical_path_first(self):
+        # Three short, independent compiles, and one compile that feeds
+        # a long chain of links; the chain should go first.
+        g = _graph(Node('a.o', None, ['a.o'], 'cc', ['a.c']),
+                   Node('b.o', None, ['b.o'], 'cc', ['b.c']),
+                   Node('c.o', None, ['c.o'], 'cc', ['c.c']),
+                   Node('d.o', None, ['d.o'], 'cc', ['d.c']),
+                   Node('d.so', None, ['d.so'], 'link', ['d.o']),
+                   Node('d', None, ['d'], 'link', ['d.so']))
+        s = Scheduler(g, ['a.o', 'b.o', 'c.o', 'd.o', 'd.so', 'd'])
+        self.assertEqual(s.weights['d.o'], 3.0)
+        self.assertEqual(s.weights['a.o'], 1.0)
+        self.assertEqual(s.next(), 'd.o')
+        self.assertEqual(s.next(), 'a.o')
+
+    def test_durations(self):
+        g = _graph(Node('a.o', None, ['a.o'], 'cc', ['a.c']),
+                   Node('b.o', None, ['b.o'], 'cc', ['b.c']),
+                   Node('c.o', None, ['c.o'], 'cc', ['c.c']),
+                   Node('all', None, ['all'], 'phony', ['a.o', 'b.o']))
+        s = Scheduler(g, ['a.o', 'b.o', 'c.o', 'all'],
+                      durations={'a.o': 2.0, 'b.o': 6.0})
+        self.assertEqual(s.weights['all'], 0.0)
+        self.assertEqual(s.weights['b.o'], 6.0)
+
+        # c.o has never been built, so it gets the average of the
+        # other 'cc' commands.
+        self.assertEqual(s.weights['c.o'], 4.0)
+        self.assertEqual([s.next(), s.next(), s.next()],
+                         ['b.o', 'c.o', 'a.o'])
+
+    def test_wide_then_narrow_is_faster(self):
+        # Eight one-second compiles, one of which feeds a four-step
+        # chain of links: building the chain first saves a step at -j 2.
+        nodes = [Node('%d.o' % i, None, ['%d.o' % i], 'cc', ['%d.c' % i])
+                 for i in range(8)]
+        names = [n.name for n in nodes]
+        prev = '7.o'
+        for i in range(4):
+            nodes.append(Node('lib%d' % i, None, ['lib%d' % i], 'link',
+                              [prev]))
+            names.append('lib%d' % i)
+            prev = 'lib%d' % i
+        g = _graph(*nodes)
+
+        def makespan(scheduler, jobs):
+            now, running = 0, []
+            while scheduler.remaining:
+                while len(running) < jobs and scheduler.has_ready():
+                    running.append((now + 1, scheduler.next()))
+                running.sort()
+                now, node_name = running.pop(0)
+                scheduler.mark_done(node_name)
+            return now
+
+        self.assertEqual(makespan(Scheduler(g, names), 2), 6)
+
+        # Without any weighting, the chain starts last.
+        unweighted = Scheduler(g, names)
+        unweighted.weights = dict((n, 0) for n in names)
+        unweighted._ready = []  # pylint: disable=W0212
+        for n in names[:8]:
+            unweighted._push(n)  # pylint: disable=W0212
+        self.assertEqual(makespan(unweighted, 2), 8)
+
+    def test_phony_inputs_are_looked_through(self):
+        g = _graph(Node('gen.h', None, ['gen.h'], 'gen', ['gen.in']),
+                   Node('headers', None, ['headers'], 'phony', ['gen.h']),
+                   Node('foo.o', None, ['foo.o'], 'cc', ['foo.c'],
+                        order_only_deps=['headers']))
+        s = Scheduler(g, ['gen.h', 'foo.o'])
+        self.assertEqual(s.next(), 'gen.h')
+        self.assertEqual(s.next(), None)
+        s.mark_done('gen.h')
+        self.assertEqual(s.next(), 'foo.o')
+
+    def test_pools_limit_concurrency(self):
+        g = _graph(Node('a', None, ['a'], 'link'),
+                   Node('b', None, ['b'], 'link'),
+                   Node('c', None, ['c'], 'link'),
+                   Node('d.o', None, ['d.o'], 'cc'))
+        s = Scheduler(g, ['a', 'b', 'c', 'd.o'],
+                      pools={'link_pool': 2},
+                      node_pools={'a': 'link_pool', 'b': 'link_pool',
+                                  'c': 'link_pool'})
+        self.assertEqual(sorted([s.next(), s.next(), s.next()]),
+                         ['a', 'b', 'd.o'])
+        self.assertFalse(s.has_ready())
+        s.mark_done('d.o')
+        self.assertFalse(s.has_ready())
+
+        # A failure frees up the pool as well.
+        s.mark_failed('b')
+        self.assertEqual(s.next(), 'c')
+        self.assertFalse(s.has_ready())
+
+    def test_pools_with_no_depth_are_unlimited(self):
+        g = _graph(Node('a', None, ['a'], 'link'),
+                   Node('b', None, ['b'], 'link'))
+        s = Scheduler(g, ['a', 'b'], pools={'p': 0},
+                      node_pools={'a': 'p', 'b': 'p'})
+        self.assertEqual(sorted([s.next(), s.next()]), ['a', 'b'])
+
+    def test_pool_nodes_wait_for_their_inputs(self):
+        g = _graph(Node('a.o', None, ['a.o'], 'cc', ['a.c']),
+                   Node('a', None, ['a'], 'link', ['a.o']),
+                   Node('b', None, ['b'], 'link'))
+        s = Scheduler(g, ['a.o', 'a', 'b'], pools={'console': 1},
+                      node_pools={'a': 'console', 'b': 'console'})
+        self.assertEqual(sorted([s.next(), s.next()]), ['a.o', 'b'])
+        s.mark_done('a.o')
+        self.assertFalse(s.has_ready())
+        s.mark_done('b')
+        self.assertEqual(s.next(), 'a')
@@ -0,0 +1,66 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pool import Pool
+
+
+# Statting fewer paths than this isn't worth starting up threads for.
+MIN_PARALLEL_STATS = 256
+
+
+class StatCache(object):
+    """Remember the mtime of each path, or that it doesn't exist.
+
+    Each path is stat'ed at most once (until restat() is called), with
+    a single stat() call. prefetch() can be used to stat a batch of
+    paths in parallel up front, which helps a lot on slow (e.g.,
+    network) filesystems, since the stat() calls don't hold the GIL.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self._mtimes = {}
+
+    def mtime(self, path):
+        """Return the mtime of path, or None if it doesn't exist."""
+        if path not in self._mtimes:
+            self._mtimes[path] = self.host.maybe_mtime(path)
+        return self._mtimes[path]
+
+    def restat(self, path):
+        self._mtimes[path] = self.host.maybe_mtime(path)
+        return self._mtimes[path]
+
+    def prefetch(self, paths, jobs, min_parallel=MIN_PARALLEL_STATS):
+        paths = [p for p in set(paths) if p not in self._mtimes]
+        if jobs < 2 or len(paths) < min_parallel:
+            for path in paths:
+                self._mtimes[path] = self.host.maybe_mtime(path)
+            return
+
+        pool = Pool(jobs, _stat)
+        try:
+            for path in paths:
+                pool.send((self.host, path))
+            for _ in paths:
+                path, mtime = pool.get()
+                self._mtimes[path] = mtime
+        finally:
+            pool.close()
+            pool.join()
+
+
+def _stat(request):
+    host, path = request
+    return path, host.maybe_mtime(path)
@@ -0,0 +1,69 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from host_fake import FakeHost
+from stat_cache import StatCache
+
+
+class CountingHost(FakeHost):
+    def __init__(self):
+        super(CountingHost, self).__init__()
+        self.stats = []
+
+    def maybe_mtime(self, *comps):
+        self.stats.append(self.join(*comps))
+        return super(CountingHost, self).maybe_mtime(*comps)
+
+
+class TestStatCache(unittest.TestCase):
+    def setUp(self):  # 'invalid name' pylint: disable=C0103
+        self.host = CountingHost()
+        self.host.write('foo.c', '')
+        self.cache = StatCache(self.host)
+
+    def test_hits_and_misses_are_cached(self):
+        self.assertEqual(self.cache.mtime('foo.c'), 1)
+        self.assertEqual(self.cache.mtime('foo.c'), 1)
+        self.assertEqual(self.cache.mtime('foo.o'), None)
+        self.assertEqual(self.cache.mtime('foo.o'), None)
+        self.assertEqual(self.host.stats, ['foo.c', 'foo.o'])
+
+    def test_restat(self):
+        self.assertEqual(self.cache.mtime('foo.o'), None)
+        self.host.write('foo.o', '')
+        self.assertEqual(self.cache.mtime('foo.o'), None)
+        self.assertEqual(self.cache.restat('foo.o'), 2)
+        self.assertEqual(self.cache.mtime('foo.o'), 2)
+
+    def test_prefetch(self):
+        self.cache.prefetch(['foo.c', 'foo.o', 'foo.c'], jobs=4)
+        self.assertEqual(sorted(self.host.stats), ['foo.c', 'foo.o'])
+        self.assertEqual(self.cache.mtime('foo.c'), 1)
+        self.assertEqual(self.cache.mtime('foo.o'), None)
+        self.assertEqual(len(self.host.stats), 2)
+
+    def test_parallel_prefetch(self):
+        paths = ['f%d' % i for i in range(20)]
+        for p in paths[:10]:
+            self.host.write(p, '')
+        self.cache.mtime('f0')
+        self.cache.prefetch(paths, jobs=4, min_parallel=1)
+
+        # f0 was already in the cache, so it isn't stat'ed again.
+        self.assertEqual(sorted(self.host.stats), sorted(paths))
+        self.assertEqual(self.cache.mtime('f9'), 11)
+        self.assertEqual(self.cache.mtime('f10'), None)
+        self.assertEqual(len(self.host.stats), 20)
@@ -12,19 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from ast_cache import AST_CACHE_DIR
 from builder import Builder
+from deps_log import DepsLog
+from graph_cache import CACHE_FILE
+from path_table import canonicalize_path
 from var_expander import expand_vars
 
 
-def check(host, _args, _old_graph, _graph, _started_time):
+def _targets(args):
+    """Return the targets on the command line, as the graph spells them."""
+    return [canonicalize_path(t) for t in args.targets]
+
+
+def check(host, _args, _graph, _started_time):
     """check the syntax of the build files"""
     host.print_out('pyn: syntax is correct.')
     return 0
 
 
-def clean(host, args, _old_graph, graph, _started_time):
+def clean(host, args, graph, _started_time):
     """clean built files"""
-    node_names = args.targets or graph.roots()
+    node_names = _targets(args) or graph.roots()
     files_to_remove = []
     for output_name in graph.closure(node_names):
         node = graph.nodes[output_name]
@@ -32,8 +41,12 @@ def clean(host, args, _old_graph, graph, _started_time):
                 (node.scope['generator'] != '1' or '-g' in args.targets)):
             files_to_remove.append(output_name)
 
-    if host.exists('.pyn.db') and '-g' in args.targets:
-        files_to_remove.append('.pyn.db')
+    if '-g' in args.targets:
+        if host.exists(CACHE_FILE):
+            files_to_remove.append(CACHE_FILE)
+        files_to_remove.extend(
+            host.join(AST_CACHE_DIR, f)
+            for f in host.files_under(host.abspath(AST_CACHE_DIR)))
     if args.verbose:
         host.print_err('Cleaning...')
     else:
@@ -49,28 +62,26 @@ def clean(host, args, _old_graph, graph, _started_time):
     return 0
 
 
-def commands(host, args, _old_graph, graph, _started_time):
+def commands(host, args, graph, _started_time):
     """list all commands required to rebuild given targets"""
-    node_names = (args.targets or graph.defaults or graph.roots())
+    node_names = (_targets(args) or graph.defaults or graph.roots())
     nodes_to_build = graph.closure(node_names)
     sorted_nodes = graph.tsort(nodes_to_build)
     sorted_nodes = [n for n in sorted_nodes
                     if graph.nodes[n].rule_name != 'phony']
 
     for node_name in sorted_nodes:
-        node = graph.nodes[node_name]
-        rule_scope = graph.rules[node.rule_name]
-        host.print_out(expand_vars(rule_scope['command'], node.scope,
-                                   rule_scope))
+        host.print_out(graph.command(node_name, expand_vars))
     return 0
 
 
-def deps(host, args, _old_graph, graph, _started_time):
+def deps(host, args, graph, _started_time):
     """show dependencies stored in the deps log"""
-    node_names = (args.targets or graph.defaults or graph.roots())
+    deps_log = DepsLog(host)
+    deps_log.load()
+    node_names = (_targets(args) or graph.defaults or graph.roots())
     for node_name in node_names:
-        n = graph.nodes[node_name]
-        depsfile_deps = n.scope['depsfile_deps']
+        depsfile_deps = deps_log.get(node_name)
         if depsfile_deps:
             host.print_out("%s: #deps %d" % (node_name, len(depsfile_deps)))
             for dep in depsfile_deps:
@@ -80,10 +91,10 @@ def deps(host, args, _old_graph, graph, _started_time):
     return 0
 
 
-def question(host, args, old_graph, graph, started_time):
+def question(host, args, graph, started_time):
     """check to see if the build is up to date"""
     builder = Builder(host, args, expand_vars, started_time)
-    nodes_to_build = builder.find_nodes_to_build(old_graph, graph)
+    nodes_to_build = builder.find_nodes_to_build(graph)
     if nodes_to_build:
         host.print_out('pyn: build is not up to date.')
         return 1
@@ -92,15 +103,14 @@ def question(host, args, old_graph, graph, started_time):
         return 0
 
 
-def query(host, args, _old_graph, graph, _started_time):
+def query(host, args, graph, _started_time):
     """show inputs/outputs for a path"""
-    target = args.targets[0]
+    target = _targets(args)[0]
     if target in graph.nodes:
-        inputs = graph.nodes[target].deps()
+        inputs = list(graph.nodes[target].deps())
     else:
         inputs = []
-    outputs = [node_name for node_name in graph.nodes if
-               target in graph.nodes[node_name].deps()]
+    outputs = graph.consumers(target)
     host.print_out(target)
     if inputs:
         host.print_out("  inputs:")
@@ -113,7 +123,7 @@ def query(host, args, _old_graph, graph, _started_time):
     return 0
 
 
-def rules(host, _args, _old_graph, graph, _started_time):
+def rules(host, _args, graph, _started_time):
     """list all the rules"""
     for rule_name in sorted(graph.rules):
         host.print_out("%s %s" % (rule_name,
@@ -121,7 +131,7 @@ def rules(host, _args, _old_graph, graph, _started_time):
     return 0
 
 
-def targets(host, args, _old_graph, graph, _started_time):
+def targets(host, args, graph, _started_time):
     """list targets by their rule or depth in the DAG"""
     if args.targets[0] == 'rule':
         if len(args.targets) == 2:
@@ -170,8 +180,8 @@ def list_tools(host):
         host.print_out("%10s  %s" % (tool, _TOOLS[tool].__doc__))
 
 
-def run_tool(host, args, old_graph, graph, started_time):
-    return _TOOLS[args.tool](host, args, old_graph, graph, started_time)
+def run_tool(host, args, graph, started_time):
+    return _TOOLS[args.tool](host, args, graph, started_time)
 
 
 _TOOLS = {
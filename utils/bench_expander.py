@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare compiled templates with VarExpander on a synthetic manifest.
+
+Times analyzing the manifest, and then expanding the command and
+description of every edge the way the builder does, with each of
+expand_vars() and the character-at-a-time VarExpander, and then with
+expand_vars() again once the graph's scopes are frozen.
+
+With --depth, the edges are declared in a chain of nested subninjas,
+so that looking up the top-level variables has further to go.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 'unable to import' pylint: disable=F0401
+from analyzer import NinjaAnalyzer
+from host_fake import FakeHost
+from parser import parse
+from var_expander import VarExpander, expand_vars
+
+
+def slow_expand_vars(msg, scope, rule_scope=None):
+    return VarExpander(scope, rule_scope).parse(msg)
+
+
+def synthetic_manifests(edges, depth):
+    """Return the files of a manifest, as a dict of paths to contents."""
+    files = {}
+    top = [
+        'builddir = out',
+        'cflags = -Wall -Werror -O2',
+        'rule cc',
+        '  command = gcc -MMD -MF $out.d $cflags $defines -c $in -o $out',
+        '  description = CC $out',
+        'rule link',
+        '  command = g++ $ldflags -o $out $in $libs',
+        '  description = LINK $out',
+    ]
+    for i in range(1, depth):
+        files['/tmp/sub%d.ninja' % i] = 'subninja sub%d.ninja\n' % (i + 1)
+    lines = []
+    objs = []
+    for i in range(edges):
+        src = 'src/module%d/file_%d.cc' % (i % 97, i)
+        obj = '$builddir/obj/%s.o' % src[:-3]
+        lines.append('build %s: cc ../../%s | gen/headers.stamp' % (obj, src))
+        lines.append('  defines = -DMODULE=%d' % (i % 97))
+        objs.append(obj)
+        if len(objs) == 50:
+            lines.append('build $builddir/lib%d.so: link %s' %
+                         (i, ' '.join(objs)))
+            objs = []
+    if depth:
+        top.append('subninja sub1.ninja')
+        files['/tmp/sub%d.ninja' % depth] = '\n'.join(lines) + '\n'
+    else:
+        top.extend(lines)
+    files['/tmp/build.ninja'] = '\n'.join(top) + '\n'
+    return files
+
+
+def expand_commands(graph, expand):
+    results = []
+    for n in graph.unique_nodes():
+        # As in Builder._binding(), $in and $out are only in the node's
+        # build scope, not in the scope it shares with other nodes.
+        rule_scope = graph.rules[n.rule_name]
+        build_scope = n.build_scope()
+        results.append(expand(rule_scope['command'], build_scope,
+                              rule_scope))
+        results.append(expand(rule_scope['description'], build_scope,
+                              rule_scope))
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--edges', type=int, default=100000,
+                    help='number of compile edges [%(default)s]')
+    ap.add_argument('--depth', type=int, default=0,
+                    help='how deeply to nest the edges in subninjas '
+                         '[%(default)s]')
+    args = ap.parse_args(argv)
+
+    host = FakeHost()
+    host.files = synthetic_manifests(args.edges, args.depth)
+    commands = []
+    for name, expand in (('compiled', expand_vars),
+                         ('VarExpander', slow_expand_vars)):
+        start = time.time()
+        analyzer = NinjaAnalyzer(host, None, parse, expand)
+        graph = analyzer.analyze(analyzer.parse_file('build.ninja'),
+                                 'build.ninja')
+        analyzed = time.time()
+        commands.append(expand_commands(graph, expand))
+        expanded = time.time()
+        print('%-12s analyze: %6.2fs  expand %d commands: %6.2fs' %
+              (name, analyzed - start, len(commands[-1]),
+               expanded - analyzed))
+
+        if expand == expand_vars:
+            graph.freeze_scopes()
+            start = time.time()
+            frozen_commands = expand_commands(graph, expand)
+            print('%-12s %17s  expand %d commands: %6.2fs' %
+                  ('frozen', '', len(frozen_commands),
+                   time.time() - start))
+            if frozen_commands != commands[-1]:
+                print('freezing the scopes changed the commands!')
+                return 1
+    if commands[0] != commands[1]:
+        print('the expanders returned different commands!')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
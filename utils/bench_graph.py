@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Time the graph algorithms over large synthetic graphs.
+
+  - 'chain' is a single chain of N nodes, each depending on the next.
+  - 'fan' is a root that depends on N-1 leaves.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 'unable to import' pylint: disable=F0401
+from build_graph import Graph, Node
+
+
+def chain(num_nodes):
+    g = Graph('build.ninja')
+    names = ['n%d' % i for i in range(num_nodes)]
+    for i, name in enumerate(names):
+        g.nodes[name] = Node(name, None, [name], 'cc', names[i + 1:i + 2])
+    return g, ['n0']
+
+
+def fan(num_nodes):
+    g = Graph('build.ninja')
+    leaves = ['n%d' % i for i in range(1, num_nodes)]
+    for name in leaves:
+        g.nodes[name] = Node(name, None, [name], 'cc', [name + '.c'])
+    g.nodes['n0'] = Node('n0', None, ['n0'], 'link', leaves)
+    return g, ['n0']
+
+
+SHAPES = {'chain': chain, 'fan': fan}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-n', '--nodes', type=int, default=1000000,
+                    help='number of nodes in each graph [%(default)s]')
+    ap.add_argument('shapes', nargs='*', default=sorted(SHAPES),
+                    help='the graphs to time (%s)' % ', '.join(sorted(SHAPES)))
+    args = ap.parse_args(argv)
+
+    for shape in args.shapes:
+        graph, targets = SHAPES[shape](args.nodes)
+        start = time.time()
+        closure = graph.closure(targets)
+        mid = time.time()
+        graph.tsort(closure)
+        end = time.time()
+        print('%-6s %8d nodes: closure %6.2fs, tsort %6.2fs' %
+              (shape, args.nodes, mid - start, end - mid))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure how fast the parsers get through a .ninja file, in MB/s.
+
+If no file is given, a synthetic one shaped like a generated Chromium
+manifest (a few rules, then lots of compile steps with per-edge vars and
+a few links) is used.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 'unable to import' pylint: disable=F0401
+from parser import FastNinjaParser, NinjaParser
+
+
+def synthetic_manifest(size_mb):
+    lines = [
+        '# Generated by bench_parser.py',
+        'builddir = out',
+        'cflags = -Wall -Werror -O2',
+        '',
+        'rule cc',
+        '  command = gcc -MMD -MF $out.d $cflags $defines -c $in -o $out',
+        '  description = CC $out',
+        '  depfile = $out.d',
+        '  deps = gcc',
+        'rule link',
+        '  command = g++ $ldflags -o $out @$out.rsp $',
+        '      $libs',
+        '  description = LINK $out',
+        'pool link_pool',
+        '  depth = 4',
+        '',
+    ]
+    size = sum(len(l) + 1 for l in lines)
+    i = 0
+    objs = []
+    while size < size_mb * 1024 * 1024:
+        src = 'src/module%d/subdir%d/file_%d.cc' % (i % 97, i % 13, i)
+        obj = '$builddir/obj/%s.o' % src[:-3]
+        block = [
+            'build %s: cc ../../%s | gen/headers.stamp || gen/all.stamp' %
+            (obj, src),
+            '  defines = -DMODULE=%d -DNDEBUG -D_FILE_OFFSET_BITS=64' %
+            (i % 97),
+            '  cflags = -Wall -Werror -O2 -fno-exceptions -I../../src -Igen',
+        ]
+        objs.append(obj)
+        if len(objs) == 50:
+            block.append('build out/lib%d.so: link %s' % (i, ' '.join(objs)))
+            block.append('  pool = link_pool')
+            objs = []
+        lines.extend(block)
+        size += sum(len(l) + 1 for l in block)
+        i += 1
+    lines.append('default out/lib%d.so' % (i - 1))
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--size', type=float, default=10,
+                    help='size of the synthetic manifest, in MB '
+                         '[%(default)s]')
+    ap.add_argument('--no-slow', action='store_true',
+                    help='only time FastNinjaParser')
+    ap.add_argument('file', nargs='?',
+                    help='time parsing this file instead')
+    args = ap.parse_args(argv)
+
+    if args.file:
+        with open(args.file) as f:
+            text = f.read()
+        name = args.file
+    else:
+        text = synthetic_manifest(args.size)
+        name = 'build.ninja'
+    size_mb = len(text) / (1024.0 * 1024.0)
+
+    parsers = [FastNinjaParser]
+    if not args.no_slow:
+        parsers.append(NinjaParser)
+
+    asts = []
+    for parser_cls in parsers:
+        start = time.time()
+        asts.append(parser_cls(text, name).parse())
+        elapsed = time.time() - start
+        print('%-16s %6.1f MB in %6.2fs: %6.2f MB/s' %
+              (parser_cls.__name__, size_mb, elapsed, size_mb / elapsed))
+    if len(asts) > 1 and asts[0] != asts[1]:
+        print('the parsers returned different ASTs!')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,16 +12,110 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
+
 from pyn_exceptions import PynException
 
 
+# How many compiled templates compile_template() remembers.
+TEMPLATE_CACHE_SIZE = 1024
+
+_VARNAME = re.compile('[A-Za-z_]+')
+
+# The recently used templates are kept in two generations, so that
+# finding one is a single dict lookup; see compile_template().
+_templates = {}
+_old_templates = {}
+
+
 def expand_vars(msg, scope, rule_scope=None):
-    return VarExpander(scope, rule_scope).parse(msg)
+    if '$' not in msg:
+        return msg
+    parts = list(compile_template(msg))
+    objs = scope.objs
+    parent = scope.parent
+    inherited = parent.flat if parent else {}
+    for i in range(1, len(parts), 2):
+        var = parts[i]
+        if var in objs:
+            parts[i] = objs[var]
+        elif rule_scope and var in rule_scope.objs:
+            parts[i] = rule_scope.objs[var]
+        elif inherited is not None:
+            parts[i] = inherited.get(var, '')
+        else:
+            parts[i] = parent[var]
+    return ''.join(parts)
+
+
+def compile_template(msg):
+    """Split msg into literal text and the names of the variables in it.
+
+    The result is a tuple that alternates between the two, starting and
+    ending with (possibly empty) text, so expanding it is just a matter
+    of looking up every other item and joining them back together. The
+    most recently used templates are cached, since the same strings
+    (rule commands, in particular) are expanded over and over again.
+    This accepts exactly the strings VarExpander does.
+
+    The cache is an approximate LRU: when the current generation of
+    templates fills up, it becomes the old one, and the templates in
+    the old one that haven't been used since are dropped. Updating a
+    real LRU's order on every hit costs as much as the expansion.
+    """
+    # 'using the global statement' pylint: disable=W0603
+    global _templates, _old_templates
+    template = _templates.get(msg)
+    if template is None:
+        template = _old_templates.get(msg)
+        if template is None:
+            template = _compile(msg)
+        if len(_templates) >= TEMPLATE_CACHE_SIZE:
+            _old_templates = _templates
+            _templates = {}
+        _templates[msg] = template
+    return template
+
+
+def _compile(msg):
+    parts = []
+    text = []
+    p, end = 0, len(msg)
+    while p < end:
+        q = msg.find('$', p)
+        if q == -1:
+            text.append(msg[p:])
+            break
+        text.append(msg[p:q])
+        if q + 1 == end:
+            raise PynException("expecting a varname or a '{' at %d" % (q + 1))
+        c = msg[q + 1]
+        if c in ' :$':
+            text.append(c)
+            p = q + 2
+            continue
+        start = q + 2 if c == '{' else q + 1
+        m = _VARNAME.match(msg, start)
+        if not m:
+            raise PynException('expecting a varname at %d' % start)
+        p = m.end()
+        if c == '{':
+            if p == end or msg[p] != '}':
+                raise PynException('expecting a closing } at %d' % p)
+            p += 1
+        parts.append(''.join(text))
+        parts.append(m.group())
+        text = []
+    parts.append(''.join(text))
+    return tuple(parts)
 
 
 class VarExpander(object):
     """Expand the variables in a string.
 
+    This is the straightforward, character-at-a-time version of
+    expand_vars(); it is kept as the reference for compile_template().
+
     grammar = chunk*:cs end         -> ''.join(cs)
     chunk   = ~'$' anything:c       -> c
             | '$' (' '|':'|'$'):c   -> c
@@ -17,7 +17,9 @@ import unittest
 
 from build_graph import Scope
 from pyn_exceptions import PynException
-from var_expander import expand_vars
+import var_expander
+
+from var_expander import VarExpander, compile_template, expand_vars
 
 
 class TestExpandVars(unittest.TestCase):
@@ -28,11 +30,14 @@ class TestExpandVars(unittest.TestCase):
         self.scope['foo'] = 'a'
         self.scope['bar'] = 'b'
 
+    def expand(self, inp, scope, rule_scope=None):
+        return expand_vars(inp, scope, rule_scope)
+
     def check(self, inp, out, rule_scope=None):
-        self.assertEqual(expand_vars(inp, self.scope, rule_scope), out)
+        self.assertEqual(self.expand(inp, self.scope, rule_scope), out)
 
     def err(self, inp):
-        self.assertRaises(PynException, expand_vars, inp, self.scope)
+        self.assertRaises(PynException, self.expand, inp, self.scope)
 
     def test_noop(self):
         self.check('xyz', 'xyz')
@@ -83,7 +88,8 @@ class TestExpandVars(unittest.TestCase):
 
         # ensure that the rule trumps the parent scope.
         c = Scope('child', self.scope)
-        self.assertEqual(expand_vars('$foo', c, r), 'r')
+        self.assertEqual(self.expand('$foo', c, r), 'r')
+        self.assertEqual(self.expand('$bar', c, r), 'b')
 
     def test_multiple_vars(self):
         # ensure that we handle back-to-back variables properly
@@ -94,3 +100,55 @@ class TestExpandVars(unittest.TestCase):
         # ensure that undefined variables are handled properly and
         # don't result in whitespace, either.
         self.check('$foo$baz$bar', 'ab')
+
+
+class TestSlowExpandVars(TestExpandVars):
+    def expand(self, inp, scope, rule_scope=None):
+        return VarExpander(scope, rule_scope).parse(inp)
+
+
+class TestFrozenExpandVars(TestExpandVars):
+    def expand(self, inp, scope, rule_scope=None):
+        if scope.parent:
+            scope.parent.freeze()
+        return expand_vars(inp, scope, rule_scope)
+
+
+class TestCompileTemplate(unittest.TestCase):
+    def test_segments(self):
+        self.assertEqual(compile_template('cc $in -o ${out}.o'),
+                         ('cc ', 'in', ' -o ', 'out', '.o'))
+        self.assertEqual(compile_template('$foo$bar'),
+                         ('', 'foo', '', 'bar', ''))
+        self.assertEqual(compile_template('a$$b$ c$:d'), ('a$b c:d',))
+
+    def test_errors_match_var_expander(self):
+        scope = Scope('base', None)
+        for msg in ('$', 'ab$', '${', '${foo', '${foo bar', '$1', 'a${}'):
+            try:
+                VarExpander(scope).parse(msg)
+                self.fail('%s should not have parsed' % msg)
+            except PynException as e:
+                expected = str(e)
+            try:
+                compile_template(msg)
+                self.fail('%s should not have compiled' % msg)
+            except PynException as e:
+                self.assertEqual(str(e), expected)
+
+    def test_cache_is_bounded(self):
+        # 'access to a protected member' pylint: disable=W0212
+        size = var_expander.TEMPLATE_CACHE_SIZE
+        compile_template('$first')
+        for i in range(3 * size):
+            compile_template('$v%d' % i)
+            compile_template('$first')
+        self.assertTrue(len(var_expander._templates) <= size)
+        self.assertTrue(len(var_expander._old_templates) <= size)
+
+        # Templates that keep being used stay in the cache, and the
+        # least recently used ones are dropped.
+        self.assertTrue('$first' in var_expander._templates)
+        self.assertFalse('$v0' in var_expander._templates or
+                         '$v0' in var_expander._old_templates)
+        self.assertTrue('$v%d' % (3 * size - 1) in var_expander._templates)